@@ -0,0 +1,213 @@
+"""
+自适应表格策略注册表
+每个下拉选项对应一个已注册的策略：输入阶段性结果的 token 数组（NumPy object 数组）和配置，
+返回自适应表格（列类型由 generate_adaptive_table_by_option 统一转换为字符串）。
+Config.dropdown_options 默认取自注册表，自定义策略只需注册即可出现在下拉框中：
+
+    from adaptive_strategies import register_adaptive_strategy
+
+    @register_adaptive_strategy("选项E")
+    def my_strategy(tokens, options):
+        return pd.DataFrame({"token": tokens})
+
+策略模块无需被核心代码 import：注册表加载时会依次导入 Config.strategy_modules、
+环境变量 TABLEGEN_STRATEGY_MODULES（以逗号分隔）中列出的模块，以及已安装的包在入口点组
+tablegen.adaptive_strategies 中声明的模块，例如：
+
+    TABLEGEN_STRATEGY_MODULES=examples.custom_data_handler streamlit run app.py
+"""
+import importlib
+import os
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from token_sort import estimate_bytes, merge_sorted, sort_tokens
+
+# 策略函数：(tokens, options) -> DataFrame，options 为 Config 实例
+AdaptiveStrategy = Callable[[np.ndarray, Any], pd.DataFrame]
+
+_STRATEGIES: Dict[str, AdaptiveStrategy] = {}
+
+# 未注册的选项沿用原有行为，按该选项处理
+DEFAULT_STRATEGY = "选项D"
+
+
+def register_adaptive_strategy(name: str) -> Callable[[AdaptiveStrategy], AdaptiveStrategy]:
+    """注册自适应表格策略（同名策略会被覆盖），可作为装饰器使用"""
+
+    def decorator(func: AdaptiveStrategy) -> AdaptiveStrategy:
+        _STRATEGIES[name] = func
+        return func
+
+    return decorator
+
+
+def get_adaptive_strategy(name: str) -> AdaptiveStrategy:
+    return _STRATEGIES.get(name, _STRATEGIES[DEFAULT_STRATEGY])
+
+
+def strategy_names() -> List[str]:
+    """按注册顺序返回全部策略名"""
+    return list(_STRATEGIES)
+
+
+def strategy_options_key(options: Any) -> tuple:
+    """策略用到的全部配置项，结果缓存的指纹需包含这些值"""
+    return (options.stats_top_n, options.stats_min_count, options.stats_order,
+            options.sort_unique, options.sort_collation)
+
+
+def modulo_groups(tokens: np.ndarray, columns: Sequence[str]) -> pd.DataFrame:
+    """按序号取模分组：第 g 列只保留序号 i % k == g 的 token，其余位置为空串（步长切片赋值，无逐行循环）"""
+    k = len(columns)
+    data = {}
+    for g, name in enumerate(columns):
+        column = np.full(len(tokens), "", dtype=object)
+        column[g::k] = tokens[g::k]
+        data[name] = column
+    return pd.DataFrame(data)
+
+
+def modulo_strategy(columns: Sequence[str]) -> AdaptiveStrategy:
+    """
+    构造取模分组策略；策略带有 groups 属性，
+    流式最终结果可据此直接对 token 流按步长切片，无需生成完整表格
+    """
+
+    def strategy(tokens: np.ndarray, options: Any) -> pd.DataFrame:
+        return modulo_groups(tokens, columns)
+
+    strategy.groups = len(columns)
+    return strategy
+
+
+def blockwise(partial: Callable[[Sequence[str], Any], Any],
+              merge: Callable[[List[Any], Any], pd.DataFrame]) -> Callable[[AdaptiveStrategy], AdaptiveStrategy]:
+    """
+    声明策略可按文本块增量计算：partial(tokens, options) 计算单个文本块的中间结果（按块内容及配置缓存），
+    merge(partials, options) 按块顺序合并为与策略本身相同的表格；只改动一个文本块时只需重算该块的 partial
+    """
+
+    def decorator(func: AdaptiveStrategy) -> AdaptiveStrategy:
+        func.partial = partial
+        func.merge = merge
+        return func
+
+    return decorator
+
+
+def count_token_frequencies(tokens: Iterable[str], top_n: Optional[int] = None, min_count: int = 1,
+                            order: str = "count") -> pd.DataFrame:
+    """
+    单次遍历统计 token 频次，返回 token / count / percentage 三列
+    - top_n: 仅保留排序后的前 N 个 token（None 表示全部）
+    - min_count: 仅保留出现次数不少于该值的 token（百分比仍以全部 token 为分母）
+    - order: "count" 按次数降序（次数相同按首次出现顺序）；"token" 按 token 字典序；"first" 按首次出现顺序
+    """
+    return frequency_table(Counter(tokens), top_n, min_count, order)
+
+
+def frequency_table(counts: Counter, top_n: Optional[int] = None, min_count: int = 1,
+                    order: str = "count") -> pd.DataFrame:
+    """由已有的计数生成频次表（参数同 count_token_frequencies，"first" 顺序取计数的插入顺序）"""
+    total = sum(counts.values())
+    if order == "count":
+        items = counts.most_common()
+    elif order == "token":
+        items = sorted(counts.items())
+    elif order == "first":
+        items = list(counts.items())
+    else:
+        raise ValueError(f"不支持的排序方式: {order}")
+    if min_count > 1:
+        items = [(token, count) for token, count in items if count >= min_count]
+    if top_n is not None:
+        items = items[:top_n]
+    return pd.DataFrame({
+        "token": [token for token, _ in items],
+        "count": [count for _, count in items],
+        "percentage": [f"{count/total*100:.1f}%" for _, count in items],
+    })
+
+
+# 选项A：生成2列表格，按奇偶分组
+register_adaptive_strategy("选项A")(modulo_strategy(["奇数组", "偶数组"]))
+
+# 选项B：生成3列表格，按模3分组
+register_adaptive_strategy("选项B")(modulo_strategy(["组1", "组2", "组3"]))
+
+
+def _merge_counts(partials: List[Counter], options: Any) -> pd.DataFrame:
+    # 按块顺序累加，插入顺序即各 token 在全文中的首次出现顺序
+    counts = Counter()
+    for block_counts in partials:
+        counts.update(block_counts)
+    return frequency_table(counts, top_n=options.stats_top_n, min_count=options.stats_min_count,
+                           order=options.stats_order)
+
+
+def _merge_sorted(partials: List[Sequence[str]], options: Any) -> pd.DataFrame:
+    """
+    各块已按相同规则排序（及去重），合并结果与直接排序全部 token 一致：
+    总量不超过 sort_memory_limit 时拼接后在内存中排序，否则逐个读取各块多路归并，不再拼接全部 token
+    """
+    limit = options.sort_memory_limit
+    if limit is None or sum(estimate_bytes(partial) for partial in partials) <= limit:
+        tokens = np.concatenate([np.asarray(partial, dtype=object) for partial in partials])
+        return pd.DataFrame({"sorted_tokens": sort_tokens(tokens, options)})
+    return pd.DataFrame({"sorted_tokens": merge_sorted(partials, options.sort_unique, options.sort_collation)})
+
+
+@register_adaptive_strategy("选项C")
+@blockwise(lambda tokens, options: Counter(tokens), _merge_counts)
+def token_statistics(tokens: np.ndarray, options: Any) -> pd.DataFrame:
+    """选项C：生成统计表格（单次遍历计数，顺序确定）"""
+    return count_token_frequencies(
+        tokens, top_n=options.stats_top_n, min_count=options.stats_min_count, order=options.stats_order
+    )
+
+
+def _sorted_block(tokens: Sequence[str], options: Any):
+    # 保留排序结果本身（已安装 pyarrow 时为 Arrow 字符串数组），缓存中不为每个 token 保留 Python 对象
+    return sort_tokens(tokens, options)
+
+
+@register_adaptive_strategy("选项D")
+@blockwise(_sorted_block, _merge_sorted)
+def sorted_tokens(tokens: np.ndarray, options: Any) -> pd.DataFrame:
+    """选项D：生成单列排序表格（数据量大时外部排序，见 token_sort）"""
+    return pd.DataFrame({"sorted_tokens": sort_tokens(tokens, options)})
+
+
+# 声明策略模块的入口点组
+ENTRY_POINT_GROUP = "tablegen.adaptive_strategies"
+
+
+def load_strategy_plugins(modules: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    导入策略模块（模块导入时自行注册策略），返回导入的模块名
+    modules 缺省时取 Config.strategy_modules、环境变量 TABLEGEN_STRATEGY_MODULES 及入口点组 ENTRY_POINT_GROUP
+    """
+    from importlib.metadata import entry_points
+
+    if modules is None:
+        from config import Config
+
+        modules = list(Config.strategy_modules or [])
+        modules += [name.strip() for name in os.environ.get("TABLEGEN_STRATEGY_MODULES", "").split(",")
+                    if name.strip()]
+        modules += [entry_point.value for entry_point in entry_points(group=ENTRY_POINT_GROUP)]
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            raise ImportError(f"无法加载自适应策略模块 {name}: {e}") from e
+        loaded.append(name)
+    return loaded
+
+
+load_strategy_plugins()
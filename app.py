@@ -1,14 +1,32 @@
+import time
+import uuid
 import streamlit as st
 import pandas as pd
+from collections import deque
 from pathlib import Path
+import data_handler
+import perf
+from adaptive_strategies import strategy_options_key
+from compact import compact_results, compress_idle
 from config import Config
-from data_handler import (
-    fill_table, 
-    create_template_from_upload, 
-    make_blank_template, 
-    generate_intermediate_result, 
-    generate_adaptive_table_by_option,
-    process_to_final_result
+from exporter import EXPORT_FORMATS, cached_export
+from jobs import DONE, ERROR, PENDING, QueueFull, job_queue
+from multi_template import filled_workbook_bytes, load_templates
+from preview import cached_page_table, page_count
+from result_cache import (
+    pipeline_cache,
+    fingerprint,
+    cached_template_from_upload,
+    cached_stored_template,
+    template_fingerprint_from_upload,
+    cached_blank_template,
+    cached_sparse_template,
+)
+from sparse_template import to_dense
+from incremental import (
+    incremental_intermediate_result,
+    incremental_adaptive_table,
+    incremental_final_result,
 )
 
 cfg = Config()
@@ -18,18 +36,203 @@ st.title("1. 数据表格填充 Demo")
 st.markdown("输入文本 → 生成阶段性结果 → 选择选项 → 生成自适应表格 → 输入最终参数 → 生成最终结果")
 
 # 初始化session_state
+# 上传的模板保存在服务端模板存储中，会话只记录其内容指纹（template_store_key）；
+# 模板无法写入存储时才在会话中保留 template_df
 if "template_df" not in st.session_state:
     st.session_state.template_df = None
+if "template_store_key" not in st.session_state:
+    st.session_state.template_store_key = None
+if "template_key" not in st.session_state:
+    st.session_state.template_key = None
+# 当前上传文件的 (file_id, 内容指纹)：同一次上传只计算一次指纹，轮询任务引起的重新运行不再重复读取整个文件
+if "upload_fingerprint" not in st.session_state:
+    st.session_state.upload_fingerprint = (None, None)
 if "template_rows" not in st.session_state:
     st.session_state.template_rows = cfg.rows
 if "template_cols" not in st.session_state:
     st.session_state.template_cols = cfg.cols
 if "stage_result" not in st.session_state:
     st.session_state.stage_result = None
+    st.session_state.stage_key = None
+    st.session_state.stage_blocks = None
+# 已有结果所用的选项 / 参数（adaptive_option / final_param_applied），重新生成阶段性结果时按这些值更新已有结果，
+# 而不是页面上尚未应用的选择
 if "adaptive_result" not in st.session_state:
     st.session_state.adaptive_result = None
+    st.session_state.adaptive_key = None
+    st.session_state.adaptive_option = None
 if "final_result" not in st.session_state:
     st.session_state.final_result = None
+    st.session_state.final_key = None
+    st.session_state.final_param_applied = None
+if "jobs" not in st.session_state:
+    # 各步骤（stage / adaptive / final）当前的后台任务号
+    st.session_state.jobs = {}
+if "session_id" not in st.session_state:
+    # 任务队列按会话轮流调度、限流
+    st.session_state.session_id = uuid.uuid4().hex
+# 会话中的结果表格以紧凑形式保存（见 compact），闲置会话的结果在此压缩
+compress_idle()
+if "perf_records" not in st.session_state:
+    st.session_state.perf_records = deque(maxlen=cfg.perf_max_records)
+
+# 性能埋点：本次运行产生的记录追加到当前会话
+if cfg.perf_panel:
+    perf.configure(enabled=True)
+perf.bind_collector(st.session_state.perf_records)
+
+def render_download(label: str, df: pd.DataFrame, result_key: str, file_stem: str) -> None:
+    """
+    下载区域：选择格式后点击"准备"才序列化结果，同一版本的结果按格式缓存，
+    避免每次页面重新运行都把整张表转换为文件内容
+    """
+    fmt = st.selectbox(f"{label}格式", list(EXPORT_FORMATS), key=f"{file_stem}_format")
+    ready = st.session_state.setdefault("export_ready", set())
+    if (result_key, fmt) not in ready and st.button(f"准备{label}文件", key=f"{file_stem}_prepare"):
+        ready.add((result_key, fmt))
+    if (result_key, fmt) in ready:
+        ext, mime = EXPORT_FORMATS[fmt]
+        try:
+            data = cached_export(result_key, df, fmt)
+        except ImportError as e:
+            st.error(str(e))
+            return
+        st.download_button(
+            label=f"下载{label} {fmt.upper()}",
+            data=data,
+            file_name=f"{file_stem}.{ext}",
+            mime=mime,
+            key=f"{file_stem}_download",
+        )
+
+
+# 本次运行中已轮询（显示过进度）的步骤
+polled_slots = set()
+
+
+def job_key(*parts) -> str:
+    """任务输入的指纹：其他会话正在计算相同输入时直接共享该任务（包含影响结果的全局配置）"""
+    dh_cfg = data_handler.cfg
+    return fingerprint("job", *parts, dh_cfg.tokenizer, dh_cfg.extractors, dh_cfg.placeholder,
+                       *strategy_options_key(dh_cfg))
+
+
+def submit_job(slot: str, name: str, func, *args, key: str = None) -> None:
+    """提交后台任务；同一步骤已有任务时先放弃（未完成的取消，已完成未取走的丢弃）。排队已满时提示稍后重试"""
+    previous = st.session_state.jobs.pop(slot, None)
+    if previous is not None:
+        job_queue.release(previous)
+    try:
+        st.session_state.jobs[slot] = job_queue.submit(
+            name, func, *args, owner=st.session_state.session_id, key=key
+        )
+    except QueueFull as e:
+        st.warning(f"服务繁忙，{name}未提交：{e}")
+
+
+def poll_job(slot: str) -> None:
+    """
+    轮询步骤对应的后台任务：完成时把任务返回的结果写入 session_state；
+    进行中时显示进度和取消按钮（页面末尾会定时重新运行脚本以刷新进度）
+    """
+    job_id = st.session_state.jobs.get(slot)
+    if job_id is None:
+        return
+    polled_slots.add(slot)
+    job = job_queue.get(job_id)
+    if job is not None and not job.done:
+        if job.status == PENDING:
+            ahead = job_queue.position(job_id)
+            message = "排队中" if not ahead else f"排队中，前面还有 {ahead} 个任务"
+        else:
+            message = job.message or "计算中"
+        st.progress(job.progress, text=f"{job.name}：{message}")
+        if st.button("取消", key=f"cancel_{slot}"):
+            # 与其他会话共享的任务只是不再等待其结果，其他会话照常完成；点击前刚好完成的任务直接丢弃结果
+            job_queue.release(job_id)
+            del st.session_state.jobs[slot]
+            st.warning(f"{job.name}已取消")
+        return
+    del st.session_state.jobs[slot]
+    job_queue.pop(job_id)
+    if job is None:
+        return
+    if job.status == DONE:
+        st.session_state.update(compact_results(job.result))
+    elif job.status == ERROR:
+        st.error(f"{job.name}失败: {job.error}")
+    else:
+        st.warning(f"{job.name}已取消")
+
+
+def run_stage_job(ctx, texts, option, final_param, template_key, df_template, rows, cols,
+                  update_adaptive, update_final) -> dict:
+    """生成阶段性结果；已有的自适应表格和最终结果按原选项和参数增量更新，不受影响的部分直接复用"""
+    stage_blocks, stage_df = incremental_intermediate_result(*texts, report=ctx.scaled(0.0, 0.4))
+    updates = {"stage_result": stage_df, "stage_key": stage_blocks.key, "stage_blocks": stage_blocks}
+    if update_adaptive:
+        adaptive_key, adaptive_df = incremental_adaptive_table(stage_blocks, stage_df, option,
+                                                               report=ctx.scaled(0.4, 0.7))
+        updates.update(adaptive_result=adaptive_df, adaptive_key=adaptive_key, adaptive_option=option)
+        if update_final:
+            final_key, final_df = incremental_final_result(
+                stage_blocks, adaptive_key, stage_df, adaptive_df, final_param,
+                template_key, df_template, rows, cols, report=ctx.scaled(0.7, 1.0),
+            )
+            updates.update(final_result=final_df, final_key=final_key, final_param_applied=final_param)
+    return updates
+
+
+def run_adaptive_job(ctx, stage_blocks, stage_df, option) -> dict:
+    ctx.report(0.0, "生成自适应表格")
+    stage_df = to_dense(stage_df)
+    adaptive_key, adaptive_df = incremental_adaptive_table(stage_blocks, stage_df, option,
+                                                           report=ctx.scaled(0.1, 1.0))
+    # 清空最终结果
+    return {"adaptive_result": adaptive_df, "adaptive_key": adaptive_key, "adaptive_option": option,
+            "final_result": None}
+
+
+def run_final_job(ctx, stage_blocks, adaptive_key, stage_df, adaptive_df, final_param,
+                  template_key, df_template, rows, cols) -> dict:
+    ctx.report(0.0, "准备数据")
+    stage_df, adaptive_df = to_dense(stage_df), to_dense(adaptive_df)
+    final_key, final_df = incremental_final_result(
+        stage_blocks, adaptive_key, stage_df, adaptive_df, final_param, template_key, df_template, rows, cols,
+        report=ctx.scaled(0.2, 1.0),
+    )
+    return {"final_result": final_df, "final_key": final_key, "final_param_applied": final_param}
+
+
+def run_multi_template_job(ctx, uploaded_files, stage_df, adaptive_df, final_param, sparse) -> dict:
+    """读取全部模板工作表（每个文件只解析一次），用同一份结果一次填充并写入同一个 xlsx"""
+    ctx.report(0.0, "读取模板")
+    stage_df, adaptive_df = to_dense(stage_df), to_dense(adaptive_df)
+    templates, errors = load_templates(uploaded_files, streaming=True, sparse=sparse)
+    if not templates:
+        raise ValueError("; ".join(errors) or "没有可填充的工作表")
+    ctx.report(0.4, f"填充 {len(templates)} 个工作表")
+    data = filled_workbook_bytes(stage_df, adaptive_df, final_param, templates)
+    return {"multi_result": data, "multi_sheets": list(templates), "multi_errors": errors}
+
+
+def render_preview(df: pd.DataFrame, result_key: str, name: str, navigation: bool = True) -> None:
+    """
+    分页预览：只把当前页发送给浏览器
+    同一结果在多处展示时共用页码（只有一处显示翻页控件），并复用缓存的页切片
+    """
+    page_size = cfg.preview_page_size
+    n_pages = page_count(len(df), page_size)
+    page_key = f"preview_page_{name}"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    if navigation and n_pages > 1:
+        page = st.number_input(f"页码（共 {n_pages} 页）", min_value=1, max_value=n_pages, step=1, key=page_key)
+    else:
+        page = st.session_state.get(page_key, 1)
+    st.dataframe(cached_page_table(result_key, df, page, page_size))
+    st.caption(f"第 {page}/{n_pages} 页，共 {len(df)} 行")
+
 
 # 侧边栏参数
 with st.sidebar:
@@ -39,7 +242,7 @@ with st.sidebar:
     st.info(f"当前模板: {st.session_state.template_rows}行 × {st.session_state.template_cols}列")
     
     # 手动调整尺寸（仅在没有上传模板时可用）
-    if st.session_state.template_df is None:
+    if st.session_state.template_df is None and st.session_state.template_store_key is None:
         cfg.rows = st.number_input("行数", 1, 20, st.session_state.template_rows)
         cfg.cols = st.number_input("列数", 1, 10, st.session_state.template_cols)
         st.session_state.template_rows = cfg.rows
@@ -48,44 +251,74 @@ with st.sidebar:
         st.write("⚠️ 上传模板后，尺寸由模板决定")
         if st.button("重置为默认模板"):
             st.session_state.template_df = None
+            st.session_state.template_store_key = None
+            st.session_state.template_key = None
             st.session_state.template_rows = cfg.rows
             st.session_state.template_cols = cfg.cols
             st.rerun()
     
     cfg.placeholder = st.text_input("占位符", cfg.placeholder)
+    
+    # 结果缓存统计（进程内所有会话共享）
+    cache_stats = pipeline_cache.stats()
+    st.caption(
+        f"结果缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']}，"
+        f"{cache_stats['entries']} 项，{cache_stats['bytes'] / 1024 / 1024:.1f} MB"
+    )
 
 # 上传或直接使用模板
 st.subheader("2. 选择或上传模板")
 uploaded = st.file_uploader("上传空白模板 (csv/excel)", type=["csv", "xlsx"])
 
 if uploaded is not None:
-    # 处理上传的文件
-    template_df, rows, cols, error = create_template_from_upload(uploaded)
+    # 处理上传的文件（相同内容的模板直接从模板存储映射加载）
+    file_id, store_key = st.session_state.upload_fingerprint
+    if file_id != uploaded.file_id:
+        store_key = template_fingerprint_from_upload(uploaded)
+        st.session_state.upload_fingerprint = (uploaded.file_id, store_key)
+    template_key, (template_df, rows, cols, error) = cached_template_from_upload(
+        uploaded, streaming=cfg.streaming_template_ingest, store_key=store_key
+    )
     
     if error:
         st.error(f"文件读取错误: {error}")
         st.stop()
     
     if template_df is not None:
-        st.session_state.template_df = template_df
+        st.session_state.template_store_key = store_key
+        stored = cached_stored_template(store_key)[1] is not None
+        st.session_state.template_df = None if stored else compact_results({"template_df": template_df})["template_df"]
+        st.session_state.template_key = template_key
         st.session_state.template_rows = rows
         st.session_state.template_cols = cols
         st.success(f"✅ 模板上传成功！尺寸: {rows}行 × {cols}列")
         
         # 显示模板预览
         st.subheader("模板预览")
-        st.dataframe(template_df)
+        render_preview(template_df, template_key, "template")
 
-# 确定使用的模板
-if st.session_state.template_df is not None:
-    df_blank = st.session_state.template_df
+# 确定使用的模板（存储中的模板在进程内缓存，所有会话共用同一份）
+if st.session_state.template_df is None and st.session_state.template_store_key is not None:
+    template_key, df_blank = cached_stored_template(st.session_state.template_store_key)
+    if df_blank is None:
+        # 模板已从服务端存储中淘汰：提示重新上传，不改用默认模板继续计算
+        st.error("已上传的模板已从服务端模板存储中清除，请重新上传模板，或在侧边栏中重置为默认模板")
+        st.stop()
+else:
+    # 会话中保留的是紧凑存储的模板，只在任务中（或生成稀疏模板时）才转换为 DataFrame
+    template_key, df_blank = st.session_state.template_key, st.session_state.template_df
+if df_blank is not None:
     current_rows = st.session_state.template_rows
     current_cols = st.session_state.template_cols
+    if cfg.sparse_templates:
+        template_key, df_blank = cached_sparse_template(template_key, df_blank)
 else:
     # 使用动态生成的默认模板
     current_rows = st.session_state.template_rows
     current_cols = st.session_state.template_cols
-    df_blank = make_blank_template(current_rows, current_cols, cfg.placeholder)
+    template_key, df_blank = cached_blank_template(
+        current_rows, current_cols, cfg.placeholder, sparse=cfg.sparse_templates
+    )
 
 st.subheader("3. 输入五段文本")
 text1 = st.text_area("文本块 1", cfg.default_text1, height=60)
@@ -94,25 +327,31 @@ text3 = st.text_area("文本块 3", cfg.default_text3, height=60)
 text4 = st.text_area("文本块 4", cfg.default_text4, height=60)
 text5 = st.text_area("文本块 5", cfg.default_text5, height=60)
 
-# 步骤一：生成阶段性结果
+# 步骤一：生成阶段性结果（后台执行，只对内容变化的文本块重新分词）
 if st.button("4. 生成阶段性结果"):
-    stage_df = generate_intermediate_result(text1, text2, text3, text4, text5)
-    st.session_state["stage_result"] = stage_df
-    # 清空后续结果，避免误导
-    st.session_state["adaptive_result"] = None
-    st.session_state["final_result"] = None
+    submit_job(
+        "stage", "生成阶段性结果", run_stage_job,
+        (text1, text2, text3, text4, text5),
+        st.session_state.get("adaptive_option"),
+        st.session_state.get("final_param_applied"),
+        template_key, df_blank, current_rows, current_cols,
+        st.session_state.get("adaptive_result") is not None,
+        st.session_state.get("final_result") is not None,
+        key=job_key(
+            "stage", text1, text2, text3, text4, text5,
+            st.session_state.get("adaptive_option"), st.session_state.get("final_param_applied"),
+            template_key, current_rows, current_cols,
+            st.session_state.get("adaptive_result") is not None,
+            st.session_state.get("final_result") is not None,
+        ),
+    )
+poll_job("stage")
 
 # 展示阶段性结果
 if st.session_state.get("stage_result") is not None:
     st.subheader("5. 阶段性结果预览")
-    st.dataframe(st.session_state["stage_result"])
-    csv_stage = st.session_state["stage_result"].to_csv(index=False).encode("utf-8")
-    st.download_button(
-        label="下载阶段性结果 CSV",
-        data=csv_stage,
-        file_name="stage_result.csv",
-        mime="text/csv",
-    )
+    render_preview(st.session_state["stage_result"], st.session_state["stage_key"], "stage")
+    render_download("阶段性结果", st.session_state["stage_result"], st.session_state["stage_key"], "stage_result")
 
     # 步骤二：下拉框选择
     st.subheader("6. 选择处理选项")
@@ -124,13 +363,14 @@ if st.session_state.get("stage_result") is not None:
     
     # 步骤三：生成自适应表格
     if st.button("7. 生成自适应表格"):
-        adaptive_df = generate_adaptive_table_by_option(
+        submit_job(
+            "adaptive", "生成自适应表格", run_adaptive_job,
+            st.session_state["stage_blocks"],
             st.session_state["stage_result"], 
-            selected_option
+            selected_option,
+            key=job_key("adaptive", st.session_state["stage_key"], selected_option),
         )
-        st.session_state["adaptive_result"] = adaptive_df
-        # 清空最终结果
-        st.session_state["final_result"] = None
+    poll_job("adaptive")
 
 # 同时展示阶段性结果和自适应表格（如果都存在）
 if (st.session_state.get("stage_result") is not None and 
@@ -143,20 +383,15 @@ if (st.session_state.get("stage_result") is not None and
     
     with col1:
         st.write("**阶段性结果**")
-        st.dataframe(st.session_state["stage_result"])
+        # 与上方预览共用页码和页切片
+        render_preview(st.session_state["stage_result"], st.session_state["stage_key"], "stage", navigation=False)
     
     with col2:
         st.write("**自适应表格**")
-        st.dataframe(st.session_state["adaptive_result"])
+        render_preview(st.session_state["adaptive_result"], st.session_state["adaptive_key"], "adaptive")
     
     # 下载按钮
-    csv_adaptive = st.session_state["adaptive_result"].to_csv(index=False).encode("utf-8")
-    st.download_button(
-        label="下载自适应表格 CSV",
-        data=csv_adaptive,
-        file_name="adaptive_table.csv",
-        mime="text/csv",
-    )
+    render_download("自适应表格", st.session_state["adaptive_result"], st.session_state["adaptive_key"], "adaptive_table")
 
     # 步骤四：最终参数输入
     st.subheader("9. 最终阶段参数输入")
@@ -164,25 +399,67 @@ if (st.session_state.get("stage_result") is not None and
 
     # 步骤五：生成最终结果
     if st.button("10. 生成最终结果"):
-        final_df = process_to_final_result(
+        submit_job(
+            "final", "生成最终结果", run_final_job,
+            st.session_state["stage_blocks"],
+            st.session_state["adaptive_key"],
             st.session_state["stage_result"],
             st.session_state["adaptive_result"],
             final_param,
+            template_key,
             df_blank,
             current_rows,
             current_cols,
+            key=job_key("final", st.session_state["stage_key"], st.session_state["adaptive_key"],
+                        final_param, template_key, current_rows, current_cols),
         )
-        st.session_state["final_result"] = final_df
+    poll_job("final")
 
 # 展示最终结果
 if st.session_state.get("final_result") is not None:
     st.subheader("11. 最终结果预览")
-    st.dataframe(st.session_state["final_result"])
-
-    csv_final = st.session_state["final_result"].to_csv(index=False).encode("utf-8")
-    st.download_button(
-        label="下载最终结果 CSV",
-        data=csv_final,
-        file_name="final_result.csv",
-        mime="text/csv",
-    )
+    render_preview(st.session_state["final_result"], st.session_state["final_key"], "final")
+
+    render_download("最终结果", st.session_state["final_result"], st.session_state["final_key"], "final_result")
+
+    # 多工作表 / 多模板：用同一份阶段性结果和自适应表格填充多个模板，结果写入同一个 xlsx
+    with st.expander("多工作表 / 多模板批量填充", expanded=False):
+        template_files = st.file_uploader(
+            "上传模板（可多选，xlsx 的每个工作表都会填充）",
+            type=["xlsx", "csv"], accept_multiple_files=True, key="multi_template_files",
+        )
+        if template_files and st.button("批量填充"):
+            submit_job(
+                "multi", "批量填充模板", run_multi_template_job,
+                list(template_files),
+                st.session_state["stage_result"],
+                st.session_state["adaptive_result"],
+                st.session_state.get("final_param_input", cfg.default_final_param),
+                cfg.sparse_templates,
+            )
+        poll_job("multi")
+        if st.session_state.get("multi_result") is not None:
+            for error in st.session_state.get("multi_errors") or []:
+                st.warning(error)
+            st.caption(f"已填充 {len(st.session_state['multi_sheets'])} 个工作表: "
+                       + "、".join(st.session_state["multi_sheets"]))
+            st.download_button(
+                "下载全部结果 (xlsx)",
+                st.session_state["multi_result"],
+                file_name="final_results.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            )
+
+# 性能面板（可折叠，显示本会话最近的调用记录）
+if cfg.perf_panel:
+    with st.sidebar:
+        with st.expander("性能", expanded=False):
+            st.dataframe(perf.records_frame(reversed(st.session_state.perf_records)))
+
+# 有后台任务时定时重新运行脚本，刷新进度并取回结果；
+# 所在区域本次未显示的任务（如前一步结果已被清空）在这里轮询，避免结果无人取回
+if st.session_state.jobs:
+    for slot in [slot for slot in st.session_state.jobs if slot not in polled_slots]:
+        poll_job(slot)
+    time.sleep(cfg.job_poll_interval)
+    st.rerun()
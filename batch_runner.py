@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+批量 / 无界面运行器
+读取任务清单（JSONL 或 CSV，每行一个任务），对每个任务依次执行
+generate_intermediate_result → generate_adaptive_table_by_option → process_to_final_result，
+并将三个阶段的结果写入输出目录。
+
+清单字段：
+- job_id: 任务编号（可选，默认按行号生成）；用作输出子目录名，不能包含路径分隔符，也不能重复
+- text1 ~ text5: 五段文本（缺省为空）
+- option: 处理选项（缺省为第一个下拉选项）
+- final_param: 最终阶段参数（缺省为配置默认值）
+- template: 模板文件路径（csv/xlsx，相对路径相对于清单所在目录；缺省时使用默认空白模板）
+- rows / cols: 默认空白模板的尺寸（仅在未指定 template 时使用）
+- sheets: 填充模板工作簿中的多个工作表："all" 为全部工作表，或以逗号分隔的工作表名；
+  工作簿只解析一次，全部结果写入同一个 final_result.xlsx（缺省时只填充第一个工作表，输出 final_result.csv）
+
+最终结果默认写为 final_result.csv，--final-format 可改为 csv.gz / xlsx / parquet。
+--out-of-core 时模板不整表载入内存：按行块读取模板文件、填充后直接写入最终结果文件，适合数百万行的模板。
+--template-store DIR 时解析后的模板保存到该目录的模板存储（见 template_store），各工作进程及之后的运行
+直接映射加载；默认不使用模板存储，不在输出目录以外写入文件。
+
+用法：
+    python batch_runner.py jobs.jsonl -o output --workers 0
+    python batch_runner.py jobs.jsonl -o output --out-of-core --final-format parquet
+    python batch_runner.py jobs.jsonl -o output --template-store /var/cache/tablegen_templates
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from config import Config
+from data_handler import (
+    create_template_from_upload,
+    make_blank_template,
+    generate_intermediate_result,
+    generate_adaptive_table_by_option,
+    process_to_final_result,
+)
+from exporter import EXPORT_FORMATS, export_to
+from multi_template import SheetTemplate, filled_workbook_bytes, load_templates
+from out_of_core import fill_template_file
+from result_cache import template_fingerprint_from_upload
+from template_store import TemplateStore
+
+cfg = Config()
+
+
+@dataclass
+class BatchJob:
+    job_id: str
+    texts: List[str] = field(default_factory=lambda: [""] * 5)
+    option: str = ""
+    final_param: str = ""
+    template: Optional[str] = None
+    rows: int = cfg.rows
+    cols: int = cfg.cols
+    sheets: Optional[str] = None
+
+
+def _job_from_record(record: Dict[str, str], line_no: int, base_dir: Path) -> BatchJob:
+    template = record.get("template") or None
+    if template is not None and not os.path.isabs(template):
+        template = str(base_dir / template)
+    return BatchJob(
+        job_id=str(record.get("job_id") or f"job{line_no:05d}"),
+        texts=[str(record.get(f"text{i}") or "") for i in range(1, 6)],
+        option=record.get("option") or cfg.dropdown_options[0],
+        final_param=str(record.get("final_param") or cfg.default_final_param),
+        template=template,
+        rows=int(record.get("rows") or cfg.rows),
+        cols=int(record.get("cols") or cfg.cols),
+        sheets=record.get("sheets") or None,
+    )
+
+
+def _check_job_ids(jobs: List[BatchJob]) -> None:
+    """job_id 用作输出子目录名：不能包含路径分隔符、不能为 . / ..，且不能重复（否则会写出 -o 目录或互相覆盖）"""
+    seen = set()
+    for job in jobs:
+        job_id = job.job_id
+        if job_id in ("", ".", "..") or "/" in job_id or "\\" in job_id:
+            raise ValueError(f"任务编号不能作为目录名: {job_id!r}")
+        if job_id in seen:
+            raise ValueError(f"任务编号重复: {job_id!r}")
+        seen.add(job_id)
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+    """读取 JSONL / CSV 任务清单；任务编号不合法或重复时抛出 ValueError"""
+    manifest = Path(path)
+    base_dir = manifest.resolve().parent
+    with open(manifest, encoding="utf-8", newline="") as f:
+        if manifest.suffix.lower() == ".csv":
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    jobs = [_job_from_record(record, i, base_dir) for i, record in enumerate(records, 1)]
+    _check_job_ids(jobs)
+    return jobs
+
+
+@lru_cache(maxsize=None)
+def _template_store(root: str) -> TemplateStore:
+    return TemplateStore(root, cfg.template_store_max_files, cfg.template_store_max_bytes)
+
+
+@lru_cache(maxsize=32)
+def _load_template(path: str, streaming: bool, store_dir: Optional[str] = None) -> Tuple[pd.DataFrame, int, int]:
+    """读取模板文件；同一工作进程内相同模板只解析一次，指定模板存储目录时各工作进程共用同一份映射文件"""
+    with open(path, "rb") as f:
+        if store_dir is not None:
+            template_df, rows, cols, error = _template_store(store_dir).load_or_ingest(
+                template_fingerprint_from_upload(f), f, streaming
+            )
+        else:
+            template_df, rows, cols, error = create_template_from_upload(f, streaming=streaming)
+    if error:
+        raise ValueError(f"模板读取错误 {path}: {error}")
+    return template_df, rows, cols
+
+
+@lru_cache(maxsize=8)
+def _load_workbook_templates(path: str, streaming: bool) -> Dict[str, SheetTemplate]:
+    """读取模板工作簿的全部工作表；同一工作进程内相同工作簿只解析一次"""
+    with open(path, "rb") as f:
+        templates, errors = load_templates([f], streaming=streaming)
+    if errors:
+        raise ValueError(f"模板读取错误 {path}: {errors[0]}")
+    return templates
+
+
+def _select_sheets(templates: Dict[str, SheetTemplate], sheets: str) -> Dict[str, SheetTemplate]:
+    if sheets.strip().lower() == "all":
+        return templates
+    names = [name.strip() for name in sheets.split(",") if name.strip()]
+    missing = [name for name in names if name not in templates]
+    if missing:
+        raise ValueError(f"模板中没有工作表: {', '.join(missing)}")
+    return {name: templates[name] for name in names}
+
+
+def run_job(job: BatchJob, output_dir: str, streaming: bool = True, out_of_core: bool = False,
+            final_format: str = "csv", store_dir: Optional[str] = None) -> Dict[str, object]:
+    """执行单个任务，返回任务状态（失败时记录错误信息而不抛出）"""
+    job_dir = Path(output_dir) / job.job_id
+    final_path = job_dir / f"final_result.{EXPORT_FORMATS[final_format][0]}"
+    try:
+        if job.template and job.sheets:
+            return _run_multi_sheet_job(job, job_dir, streaming)
+        if job.template and out_of_core:
+            return _run_out_of_core_job(job, job_dir, final_path, final_format)
+        if job.template:
+            df_template, rows, cols = _load_template(job.template, streaming, store_dir)
+        else:
+            rows, cols = job.rows, job.cols
+            df_template = make_blank_template(rows, cols)
+
+        df_stage = generate_intermediate_result(*job.texts)
+        df_adaptive = generate_adaptive_table_by_option(df_stage, job.option)
+        df_final = process_to_final_result(df_stage, df_adaptive, job.final_param, df_template, rows, cols)
+
+        job_dir.mkdir(parents=True, exist_ok=True)
+        df_stage.to_csv(job_dir / "stage_result.csv", index=False)
+        df_adaptive.to_csv(job_dir / "adaptive_table.csv", index=False)
+        with open(final_path, "wb") as f:
+            export_to(df_final, f, final_format)
+        return {"job_id": job.job_id, "status": "ok", "tokens": len(df_stage),
+                "rows": rows, "cols": cols, "output": str(job_dir)}
+    except Exception as e:
+        return {"job_id": job.job_id, "status": "error", "error": str(e)}
+
+
+def _run_multi_sheet_job(job: BatchJob, job_dir: Path, streaming: bool) -> Dict[str, object]:
+    """一次填充模板工作簿中的多个工作表，写入同一个 final_result.xlsx"""
+    templates = _select_sheets(_load_workbook_templates(job.template, streaming), job.sheets)
+    df_stage = generate_intermediate_result(*job.texts)
+    df_adaptive = generate_adaptive_table_by_option(df_stage, job.option)
+
+    job_dir.mkdir(parents=True, exist_ok=True)
+    df_stage.to_csv(job_dir / "stage_result.csv", index=False)
+    df_adaptive.to_csv(job_dir / "adaptive_table.csv", index=False)
+    with open(job_dir / "final_result.xlsx", "wb") as f:
+        f.write(filled_workbook_bytes(df_stage, df_adaptive, job.final_param, templates))
+    return {"job_id": job.job_id, "status": "ok", "tokens": len(df_stage),
+            "sheets": list(templates), "output": str(job_dir)}
+
+
+def _run_out_of_core_job(job: BatchJob, job_dir: Path, final_path: Path, final_format: str) -> Dict[str, object]:
+    """按行块读取模板文件并填充，最终结果直接写入文件，不在内存中构造完整的模板和结果"""
+    df_stage = generate_intermediate_result(*job.texts)
+    df_adaptive = generate_adaptive_table_by_option(df_stage, job.option)
+
+    job_dir.mkdir(parents=True, exist_ok=True)
+    df_stage.to_csv(job_dir / "stage_result.csv", index=False)
+    df_adaptive.to_csv(job_dir / "adaptive_table.csv", index=False)
+    layout = fill_template_file(job.template, df_stage, df_adaptive, job.final_param, final_path, final_format)
+    return {"job_id": job.job_id, "status": "ok", "tokens": len(df_stage),
+            "rows": layout.rows, "cols": layout.cols, "output": str(job_dir)}
+
+
+def _run_job_args(args: Tuple[BatchJob, str, bool, bool, str, Optional[str]]) -> Dict[str, object]:
+    return run_job(*args)
+
+
+def run_batch(jobs: List[BatchJob], output_dir: str, workers: int = 1, streaming: bool = True,
+              out_of_core: bool = False, final_format: str = "csv",
+              store_dir: Optional[str] = None) -> List[Dict[str, object]]:
+    """
+    批量执行任务，结果顺序与清单一致，并写出 summary.jsonl
+    workers: 工作进程数，1 为当前进程串行执行，0 为使用全部 CPU 核心
+    out_of_core: 按行块读取模板文件并直接写出最终结果（见 out_of_core）
+    final_format: 最终结果文件格式（csv / csv.gz / xlsx / parquet）
+    store_dir: 模板存储目录（None 为不使用模板存储）
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    args = [(job, output_dir, streaming, out_of_core, final_format, store_dir) for job in jobs]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        results = [_run_job_args(a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            results = list(pool.map(_run_job_args, args, chunksize=chunksize))
+
+    with open(Path(output_dir) / "summary.jsonl", "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="批量执行数据表格填充流程")
+    parser.add_argument("manifest", help="任务清单（.jsonl 或 .csv）")
+    parser.add_argument("-o", "--output", default="output", help="输出目录（默认 output）")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="工作进程数，0 表示使用全部 CPU 核心")
+    parser.add_argument("--no-streaming", action="store_true", help="整表读取模板（默认流式读取）")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="按行块读取模板文件并直接写出最终结果，不将整张模板载入内存")
+    parser.add_argument("--final-format", choices=list(EXPORT_FORMATS), default="csv", help="最终结果文件格式")
+    parser.add_argument("--template-store", metavar="DIR",
+                        help="将解析后的模板保存到该目录并在之后的运行中复用（默认不使用模板存储）")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except ValueError as e:
+        print(f"任务清单错误: {e}", file=sys.stderr)
+        return 2
+    results = run_batch(jobs, args.output, workers=args.workers, streaming=not args.no_streaming,
+                        out_of_core=args.out_of_core, final_format=args.final_format,
+                        store_dir=args.template_store)
+    failed = [r for r in results if r["status"] != "ok"]
+    print(f"完成 {len(results) - len(failed)}/{len(results)} 个任务，输出目录: {args.output}")
+    for r in failed:
+        print(f"   ✗ {r['job_id']}: {r['error']}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+性能基准测试
+对 data_handler 中的各个函数按模板尺寸和 token 数量组成的参数网格计时并统计峰值内存，
+另对已安装的各 xlsx 引擎（见 spreadsheet_io）比较同一模板的整表读取与写出（excel_read / excel_write），
+并对同一组输入比较整表填充（process_to_final_result）与核外填充（fill_template_file）。
+结果可保存为 JSON 基线，并可与已有基线比较以发现性能回退。
+
+用法：
+    python benchmark.py --quick                          # 小规模网格，快速检查
+    python benchmark.py --save bench_baseline.json       # 运行完整网格并保存基线
+    python benchmark.py --compare bench_baseline.json    # 与基线比较，出现回退时返回非零退出码
+"""
+import argparse
+import io
+import json
+import platform
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import spreadsheet_io
+from config import Config
+from data_handler import (
+    fill_table,
+    make_blank_template,
+    create_template_from_upload,
+    generate_intermediate_result,
+    generate_adaptive_table_by_option,
+    process_to_final_result,
+)
+from out_of_core import fill_template_file
+
+cfg = Config()
+
+# 参数网格：模板尺寸 (行, 列) 与 token 数量
+FULL_GRID = {
+    "templates": [(100, 10), (1_000, 20), (10_000, 50)],
+    "tokens": [1_000, 100_000, 1_000_000],
+}
+QUICK_GRID = {
+    "templates": [(50, 5), (500, 10)],
+    "tokens": [1_000, 10_000],
+}
+
+
+@dataclass
+class BenchCase:
+    """run(*setup()) 为计时的部分；setup 在该用例实际运行前才准备输入数据（--only 未选中的用例不会构造数据）"""
+    name: str
+    params: Dict[str, object]
+    run: Callable[..., object]
+    setup: Callable[[], tuple] = tuple
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{k}={v}" for k, v in self.params.items())
+        return f"{self.name}[{params}]"
+
+
+class _Upload(io.BytesIO):
+    """带文件名的内存文件，模拟 Streamlit 的上传对象"""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+def make_texts(n_tokens: int, vocab_size: int = 5_000, seed: int = 0) -> Tuple[str, str, str, str, str]:
+    """生成 n_tokens 个 token 的五段文本（词表固定，结果可复现）"""
+    rng = random.Random(seed)
+    vocab = [f"w{i}" for i in range(vocab_size)]
+    per_block = n_tokens // 5
+    blocks = []
+    for b in range(5):
+        count = per_block if b < 4 else n_tokens - per_block * 4
+        blocks.append(" ".join(rng.choices(vocab, k=count)))
+    return tuple(blocks)
+
+
+def _template_frame(rows: int, cols: int) -> pd.DataFrame:
+    """指定尺寸的模板内容（首行首列为参考信息）"""
+    data = {f"列{c}": [f"行{r}" if c == 0 else f"{r}-{c}" for r in range(rows)] for c in range(cols)}
+    return pd.DataFrame(data)
+
+
+def _template_bytes(rows: int, cols: int, fmt: str) -> bytes:
+    """生成指定尺寸的模板文件内容"""
+    df = _template_frame(rows, cols)
+    buf = io.BytesIO()
+    if fmt == "csv":
+        df.to_csv(buf, index=False)
+    else:
+        spreadsheet_io.write_sheets({"Sheet1": [df]}, buf)
+    return buf.getvalue()
+
+
+# 用例输入按需构造并缓存；同一组用例（相同模板尺寸 / token 数量）相邻，只保留最近用到的几份
+@lru_cache(maxsize=4)
+def _template_data(rows: int, cols: int, fmt: str) -> bytes:
+    return _template_bytes(rows, cols, fmt)
+
+
+_tmp_dir: Optional[tempfile.TemporaryDirectory] = None
+
+
+def _scratch_path(name: str) -> str:
+    """基准运行期间共用的临时目录下的文件路径（进程退出时删除）"""
+    global _tmp_dir
+    if _tmp_dir is None:
+        _tmp_dir = tempfile.TemporaryDirectory(prefix="tablegen_bench_")
+    return os.path.join(_tmp_dir.name, name)
+
+
+@lru_cache(maxsize=2)
+def _template_file(rows: int, cols: int) -> str:
+    """写入临时目录的 CSV 模板文件（核外填充直接读取磁盘上的模板）"""
+    path = _scratch_path(f"template_{rows}x{cols}.csv")
+    with open(path, "wb") as f:
+        f.write(_template_bytes(rows, cols, "csv"))
+    return path
+
+
+@lru_cache(maxsize=2)
+def _blank_template(rows: int, cols: int) -> pd.DataFrame:
+    return make_blank_template(rows, cols)
+
+
+@lru_cache(maxsize=1)
+def _texts(n_tokens: int) -> Tuple[str, str, str, str, str]:
+    return make_texts(n_tokens)
+
+
+@lru_cache(maxsize=1)
+def _stage(n_tokens: int) -> pd.DataFrame:
+    return generate_intermediate_result(*_texts(n_tokens))
+
+
+@lru_cache(maxsize=1)
+def _adaptive(n_tokens: int) -> pd.DataFrame:
+    return generate_adaptive_table_by_option(_stage(n_tokens), cfg.dropdown_options[0])
+
+
+def build_cases(grid: Dict[str, list]) -> List[BenchCase]:
+    cases: List[BenchCase] = []
+    for rows, cols in grid["templates"]:
+        size = {"rows": rows, "cols": cols}
+        cases.append(BenchCase("make_blank_template", size, make_blank_template, lambda r=rows, c=cols: (r, c)))
+        cases.append(BenchCase("fill_table", size, lambda t: fill_table(t, "文本1", "文本2"),
+                               lambda r=rows, c=cols: (_blank_template(r, c),)))
+        for fmt in ["csv", "xlsx"]:
+            for streaming in [False, True]:
+                cases.append(BenchCase(
+                    "create_template_from_upload",
+                    {**size, "format": fmt, "streaming": streaming},
+                    lambda d, f=fmt, s=streaming: create_template_from_upload(_Upload(d, f"t.{f}"), streaming=s),
+                    lambda r=rows, c=cols, f=fmt: (_template_data(r, c, f),),
+                ))
+        # 各 xlsx 引擎（仅已安装的）整表读取 / 写出同一模板的对比
+        for engine in spreadsheet_io.available_read_engines():
+            cases.append(BenchCase(
+                "excel_read", {**size, "engine": engine},
+                lambda d, e=engine: spreadsheet_io.read_excel(io.BytesIO(d), engine=e),
+                lambda r=rows, c=cols: (_template_data(r, c, "xlsx"),),
+            ))
+        for engine in spreadsheet_io.available_write_engines():
+            cases.append(BenchCase(
+                "excel_write", {**size, "engine": engine},
+                lambda f, e=engine: spreadsheet_io.write_sheets({"Sheet1": [f]}, io.BytesIO(), engine=e),
+                lambda r=rows, c=cols: (_template_frame(r, c),),
+            ))
+
+    for n_tokens in grid["tokens"]:
+        cases.append(BenchCase("generate_intermediate_result", {"tokens": n_tokens},
+                               generate_intermediate_result, lambda n=n_tokens: _texts(n)))
+        for option in cfg.dropdown_options:
+            cases.append(BenchCase("generate_adaptive_table_by_option", {"tokens": n_tokens, "option": option},
+                                   generate_adaptive_table_by_option, lambda n=n_tokens, o=option: (_stage(n), o)))
+        for rows, cols in grid["templates"]:
+            cases.append(BenchCase(
+                "process_to_final_result", {"tokens": n_tokens, "rows": rows, "cols": cols},
+                process_to_final_result,
+                lambda n=n_tokens, r=rows, c=cols: (_stage(n), _adaptive(n), "p", _blank_template(r, c), r, c),
+            ))
+            # 核外填充：从磁盘上的模板文件按块读取并直接写出到文件，与上面的整表填充对比耗时和峰值内存
+            cases.append(BenchCase(
+                "fill_template_file", {"tokens": n_tokens, "rows": rows, "cols": cols},
+                lambda path, stage, adaptive: fill_template_file(path, stage, adaptive, "p", _scratch_path("final.csv")),
+                lambda n=n_tokens, r=rows, c=cols: (_template_file(r, c), _stage(n), _adaptive(n)),
+            ))
+    return cases
+
+
+def measure(case: BenchCase, repeat: int = 3) -> Dict[str, object]:
+    """准备输入后计时，取多次运行的最小值与平均值；峰值内存单独运行一次，由 tracemalloc 统计"""
+    args = case.setup()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        case.run(*args)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        case.run(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "name": case.name,
+        "params": case.params,
+        "min_s": min(timings),
+        "mean_s": sum(timings) / len(timings),
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(grid: Dict[str, list], repeat: int = 3, only: Optional[str] = None,
+                   verbose: bool = True) -> Dict[str, Dict[str, object]]:
+    results = {}
+    for case in build_cases(grid):
+        if only and only not in case.name:
+            continue
+        result = measure(case, repeat)
+        results[case.key] = result
+        if verbose:
+            print(f"{case.key:<90} {result['min_s'] * 1000:10.2f} ms {result['peak_bytes'] / 1024 / 1024:10.2f} MB")
+    return results
+
+
+def compare(results: Dict[str, Dict[str, object]], baseline: Dict[str, Dict[str, object]],
+            threshold: float = 0.2) -> List[str]:
+    """返回相对基线的回退项：耗时或峰值内存超出基线的比例大于 threshold"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ["min_s", "peak_bytes"]:
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + threshold):
+                ratio = result[metric] / base[metric]
+                regressions.append(f"{key} {metric}: {base[metric]:.6g} → {result[metric]:.6g} (×{ratio:.2f})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="data_handler 性能基准测试")
+    parser.add_argument("--quick", action="store_true", help="使用小规模参数网格")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例的计时次数（默认 3）")
+    parser.add_argument("--only", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--save", help="将结果保存为 JSON 基线")
+    parser.add_argument("--compare", help="与指定的 JSON 基线比较")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定回退的相对阈值（默认 0.2）")
+    args = parser.parse_args(argv)
+
+    grid = QUICK_GRID if args.quick else FULL_GRID
+    results = run_benchmarks(grid, repeat=args.repeat, only=args.only)
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "results": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ 发现 {len(regressions)} 项性能回退（阈值 {args.threshold:.0%}）:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("✅ 未发现性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
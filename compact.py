@@ -0,0 +1,220 @@
+"""
+会话结果的紧凑存储
+阶段性结果等表格中大量重复的 token 以字符串列保存时，每个会话都要为每个单元格保留一份字符串。
+CompactTable 将表格转换为 Arrow 列存储：
+- 重复度高的字符串列做字典编码（去重后的字典 + 按字典大小选用 int8 / int16 / int32 的编号）
+- 内容全部是整数的字符串列（如阶段性结果的 index 列）保存为 int32，还原时再转换为字符串
+- 其余字符串列、数值列直接保存为 Arrow 数组
+- 默认的 RangeIndex 不占用存储；Arrow 无法表示的列（如混合类型的 object 列）原样保留
+- 长时间未访问的表格（compact_idle_seconds）可用 zstd 压缩为 Arrow IPC 字节串，下次访问时自动解压
+与稀疏模板相同，CompactTable 提供 len / columns / shape / slice / to_frame，预览和导出只按需生成用到的行；
+需要完整 DataFrame 时用 sparse_template.to_dense 转换，结果与原表一致
+未安装 pyarrow 时 compact_table 原样返回 DataFrame
+"""
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+import data_handler
+
+# 所有 CompactTable，用于压缩长时间未访问（闲置会话）的表格
+_instances: "weakref.WeakSet[CompactTable]" = weakref.WeakSet()
+
+
+def _as_int32(array):
+    """字符串列的内容全部是规范写法的整数（与 str(int) 一致）且在 int32 范围内时返回 int32 数组，否则返回 None"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    try:
+        integers = pc.cast(array, pa.int32())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+    if not pc.all(pc.equal(pc.cast(integers, array.type), array)).as_py():
+        return None
+    return integers
+
+
+def _dictionary_encode(array):
+    """字典编码，编号按字典大小选用最小的整数类型"""
+    import pyarrow as pa
+
+    array = array.dictionary_encode().combine_chunks()
+    size = len(array.dictionary)
+    index_type = pa.int8() if size <= 127 else pa.int16() if size <= 32767 else pa.int32()
+    indices = array.indices.cast(index_type)
+    return pa.chunked_array([pa.DictionaryArray.from_arrays(indices, array.dictionary)])
+
+
+class CompactTable:
+    """以 Arrow 列存储（字典编码 / 可选 zstd 压缩）保存的表格，按需还原为 DataFrame"""
+
+    def __init__(self, columns: pd.Index, dtypes: List[Any], arrow_columns: Dict[int, Any],
+                 raw_columns: Dict[int, pd.Series], index: Optional[pd.Index], n_rows: int):
+        self.columns = columns
+        self._dtypes = dtypes
+        self._arrow = arrow_columns        # 列序号 → pa.ChunkedArray（压缩后为 None）
+        self._raw = raw_columns            # 列序号 → 原样保留的 pandas 列
+        self._int_strings = set()          # 以 int32 保存的字符串列
+        self._index = index                # None 表示 RangeIndex(0, n_rows)
+        self._rows = n_rows
+        self._compressed: Optional[bytes] = None
+        self._lock = threading.Lock()
+        self.last_access = time.time()
+        _instances.add(self)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, dictionary_ratio: Optional[float] = None) -> "CompactTable":
+        """
+        转换 DataFrame；字符串列中不同值的个数不超过行数的 dictionary_ratio 时做字典编码
+        （默认取 Config.compact_dictionary_ratio）
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        ratio = data_handler.cfg.compact_dictionary_ratio if dictionary_ratio is None else dictionary_ratio
+        arrow_columns, raw_columns, int_strings = {}, {}, set()
+        for c in range(df.shape[1]):
+            column = df.iloc[:, c]
+            try:
+                if column.dtype == object:
+                    raise TypeError("object 列原样保留")
+                array = pa.chunked_array([pa.array(column, from_pandas=True)])
+            except (TypeError, ValueError, pa.ArrowException):
+                raw_columns[c] = column.reset_index(drop=True)
+                continue
+            if isinstance(column.dtype, pd.StringDtype) and len(column):
+                integers = _as_int32(array)
+                if integers is not None:
+                    array = integers
+                    int_strings.add(c)
+                elif pc.count_distinct(array, mode="all").as_py() <= len(column) * ratio:
+                    array = _dictionary_encode(array)
+            arrow_columns[c] = array
+        index = None if df.index.equals(pd.RangeIndex(len(df))) else df.index
+        table = cls(df.columns, list(df.dtypes), arrow_columns, raw_columns, index, len(df))
+        table._int_strings = int_strings
+        return table
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self._rows, len(self.columns)
+
+    @property
+    def compressed(self) -> bool:
+        return self._compressed is not None
+
+    @property
+    def nbytes(self) -> int:
+        """占用的内存（Arrow 缓冲区 / 压缩后的字节串，加上原样保留的列）"""
+        with self._lock:
+            size = len(self._compressed) if self._compressed is not None else sum(
+                array.nbytes for array in self._arrow.values())
+        size += sum(int(column.memory_usage(deep=True)) for column in self._raw.values())
+        if self._index is not None:
+            size += int(self._index.memory_usage(deep=True))
+        return size
+
+    def compress(self) -> None:
+        """以 zstd 压缩 Arrow 列（Arrow IPC 格式），访问时自动解压"""
+        import pyarrow as pa
+
+        with self._lock:
+            if self._compressed is not None or not self._arrow:
+                return
+            names = [str(c) for c in self._arrow]
+            table = pa.table(list(self._arrow.values()), names=names)
+            sink = pa.BufferOutputStream()
+            options = pa.ipc.IpcWriteOptions(compression="zstd")
+            with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            self._compressed = sink.getvalue().to_pybytes()
+            self._arrow = dict.fromkeys(self._arrow)
+
+    def _arrow_columns(self) -> Dict[int, Any]:
+        import pyarrow as pa
+
+        with self._lock:
+            self.last_access = time.time()
+            if self._compressed is not None:
+                table = pa.ipc.open_stream(self._compressed).read_all()
+                self._arrow = {c: table.column(i) for i, c in enumerate(self._arrow)}
+                self._compressed = None
+            return self._arrow
+
+    def _column(self, array, dtype) -> Any:
+        """将 Arrow 列（可能已字典编码或以 int32 保存）还原为原来的 dtype"""
+        import pyarrow as pa
+
+        if pa.types.is_dictionary(array.type):
+            array = array.cast(array.type.value_type)
+        elif isinstance(dtype, pd.StringDtype):
+            # 以 int32 保存的字符串列
+            array = array.cast(pa.large_string())
+        if isinstance(dtype, pd.StringDtype):
+            if dtype.storage == "pyarrow":
+                return pd.arrays.ArrowStringArray(array.cast(pa.large_string()))
+            return pd.array(array.to_numpy(zero_copy_only=False), dtype=dtype)
+        return array.to_pandas().astype(dtype, copy=False)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        """还原第 start 至 stop - 1 行，与原表的 iloc[start:stop] 一致（保留原行号）"""
+        start, stop = min(max(0, start), self._rows), min(max(0, stop), self._rows)
+        stop = max(start, stop)
+        arrow_columns = self._arrow_columns()
+        index = pd.RangeIndex(start, stop) if self._index is None else self._index[start:stop]
+        data = {}
+        for c, dtype in enumerate(self._dtypes):
+            if c in self._raw:
+                column = self._raw[c].iloc[start:stop]
+            else:
+                column = self._column(arrow_columns[c].slice(start, stop - start), dtype)
+            data[c] = pd.Series(column).set_axis(index)
+        df = pd.DataFrame(data, index=index)
+        df.columns = self.columns
+        return df
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.slice(0, self._rows)
+
+    def iter_frames(self, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        for start in range(0, self._rows, chunk_rows):
+            yield self.slice(start, start + chunk_rows)
+
+
+def compact_table(table: Any) -> Any:
+    """DataFrame 转换为 CompactTable；其他对象（稀疏表格、None 等）或未安装 pyarrow 时原样返回"""
+    if not isinstance(table, pd.DataFrame):
+        return table
+    try:
+        return CompactTable.from_frame(table)
+    except ImportError:
+        return table
+
+
+def compact_results(updates: Dict[str, Any], keys=("stage_result", "adaptive_result", "final_result",
+                                                    "template_df")) -> Dict[str, Any]:
+    """把要写入 session_state 的结果中的表格转换为紧凑存储（Config.compact_session_results 关闭时原样返回）"""
+    if not data_handler.cfg.compact_session_results:
+        return updates
+    return {name: compact_table(value) if name in keys else value for name, value in updates.items()}
+
+
+def compress_idle(idle_seconds: Optional[float] = None) -> int:
+    """压缩超过 idle_seconds 秒未访问的表格（默认取 Config.compact_idle_seconds），返回压缩的个数"""
+    idle_seconds = data_handler.cfg.compact_idle_seconds if idle_seconds is None else idle_seconds
+    if idle_seconds is None:
+        return 0
+    deadline = time.time() - idle_seconds
+    count = 0
+    for table in list(_instances):
+        if not table.compressed and table.last_access < deadline:
+            table.compress()
+            count += table.compressed
+    return count
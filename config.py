@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 @dataclass
 class Config:
@@ -9,8 +10,25 @@ class Config:
     default_text4: str = "bar"
     default_text5: str = "baz"
     
-    # 下拉框选项配置
+    # 下拉框选项配置（默认取自 adaptive_strategies 注册表）
     dropdown_options: list = None
+    # 自定义策略模块（如 ["examples.custom_data_handler"]），注册表加载时导入，
+    # 也可用环境变量 TABLEGEN_STRATEGY_MODULES 或入口点组 tablegen.adaptive_strategies 声明
+    strategy_modules: Optional[list] = None
+    
+    # 选项C 统计表格：保留前 N 个（None 为全部）、最小出现次数、排序方式（count / token / first）
+    stats_top_n: Optional[int] = None
+    stats_min_count: int = 1
+    stats_order: str = "count"
+
+    # 选项D 排序：是否去重、排序规则（None 为码点顺序 / "casefold" / locale 名称如 "zh_CN.UTF-8"，后者需要 PyICU）、
+    # 内存排序的字节上限（超过时分段写入临时文件做外部归并排序，None 为不限），以及临时文件目录
+    sort_unique: bool = False
+    sort_collation: Optional[str] = None
+    sort_memory_limit: Optional[int] = 256 * 1024 * 1024
+    sort_spill_dir: Optional[str] = None
+    # 可分块计算的策略（选项C / D）在阶段性结果超过该 token 数时逐块读取 token 列（None 为整列一次读取）
+    adaptive_chunk_tokens: Optional[int] = 1_000_000
     
     # 最终阶段参数默认值
     default_final_param: str = "final_param"
@@ -21,9 +39,81 @@ class Config:
     col_names: list = None
     # 占位符
     placeholder: str = "待填充"
+    
+    # 模板上传：是否流式读取（仅保留表头、首行和首列），以及 CSV 分块行数
+    streaming_template_ingest: bool = True
+    template_chunksize: int = 100_000
+
+    # 阶段性结果分词器（whitespace / delimiter / cjk，见 tokenization 注册表）；
+    # 配置抽取器（如 ["email", "date", "number", "keyword"]）时改为单次扫描抽取，并增加 kind 列
+    tokenizer: str = "whitespace"
+    extractors: Optional[list] = None
+
+    # 并行分词：文本总字符数达到阈值才启用进程池；进程数（0 为全部 CPU 核心，1 为始终串行）；超大文本块的分段字符数
+    parallel_tokenize_threshold: int = 32 * 1024 * 1024
+    parallel_tokenize_workers: int = 0
+    parallel_tokenize_chunk_size: int = 8 * 1024 * 1024
+
+    # 模板存储：上传模板解析后按内容指纹持久化到该目录（None 时使用系统临时目录下的 tablegen_templates），
+    # 以内存映射方式在会话和进程间共享；超出文件数 / 字节数上限时删除最久未用的模板（None 为不限）。
+    # 开关和目录只用于 Streamlit 应用，batch_runner 需用 --template-store 显式指定存储目录
+    template_store_enabled: bool = True
+    template_store_dir: Optional[str] = None
+    template_store_max_files: Optional[int] = 256
+    template_store_max_bytes: Optional[int] = 1024 * 1024 * 1024
+
+    # 稀疏模板：只保存表头、首行、首列和实际填入的数据，其余占位符在预览 / 导出时按需生成
+    sparse_templates: bool = True
+
+    # 会话结果紧凑存储：是否启用、字符串列做字典编码的不同值比例上限、闲置多少秒后以 zstd 压缩（None 为不压缩）
+    compact_session_results: bool = True
+    compact_dictionary_ratio: float = 0.5
+    compact_idle_seconds: Optional[float] = 300
+
+    # xlsx 读写引擎（见 spreadsheet_io）：auto 时读取优先 calamine、写出优先 xlsxwriter，未安装时使用 openpyxl；
+    # 也可指定为 calamine / openpyxl 及 xlsxwriter / openpyxl。流式读取模板始终使用 openpyxl 只读模式
+    excel_read_engine: str = "auto"
+    excel_write_engine: str = "auto"
+
+    # 字符串列存储方式：auto（已安装 pyarrow 时使用 Arrow 存储）/ pyarrow / python
+    string_storage: str = "auto"
+
+    # 阶段结果缓存（进程内共享）：是否启用、最大条目数、字节预算
+    cache_enabled: bool = True
+    cache_max_entries: int = 64
+    cache_max_bytes: int = 512 * 1024 * 1024
+
+    # 增量计算：各文本块分词结果及分块中间结果缓存的最大条目数与字节预算
+    block_cache_max_entries: int = 256
+    block_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # 结果导出：分块行数、导出内容缓存的最大条目数与字节预算
+    export_chunk_rows: int = 50_000
+    export_cache_max_entries: int = 16
+    export_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # 表格预览：每页行数、分页切片缓存的最大条目数与字节预算
+    preview_page_size: int = 200
+    preview_cache_max_entries: int = 256
+    preview_cache_max_bytes: int = 128 * 1024 * 1024
+
+    # 后台任务：线程数、页面轮询间隔（秒）、保留的已结束任务数，
+    # 以及排队任务数上限、每个会话未完成任务数上限（None 为不限；超出时页面提示稍后重试）
+    job_workers: int = 4
+    job_poll_interval: float = 0.5
+    job_max_finished: int = 256
+    job_max_pending: Optional[int] = 32
+    job_max_per_session: Optional[int] = 4
+
+    # 性能埋点：是否启用（也可设置环境变量 TABLEGEN_PERF=1）、是否统计内存分配、侧边栏性能面板及保留条数
+    perf_enabled: bool = False
+    perf_trace_memory: bool = False
+    perf_panel: bool = False
+    perf_max_records: int = 200
 
     def __post_init__(self):
         if self.col_names is None:
             self.col_names = [f"Col{i}" for i in range(self.cols)]
         if self.dropdown_options is None:
-            self.dropdown_options = ["选项A", "选项B", "选项C", "选项D"]
+            from adaptive_strategies import strategy_names
+            self.dropdown_options = strategy_names()
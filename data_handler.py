@@ -1,137 +1,284 @@
+import csv
+import io
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 import pandas as pd
+from adaptive_strategies import count_token_frequencies, get_adaptive_strategy  # noqa: F401
 from config import Config
-from typing import Optional, Tuple
+from perf import instrumented
+from spreadsheet_io import open_workbook, read_excel
+from tokenization import text_engine, tokenize_blocks
 
 cfg = Config()
 
+# 流式读取模板时用 pandas 内部接口推断 dtype，与整表读取（pd.read_csv 合并分块 / pd.read_excel）的规则完全一致；
+# 这些接口可能随 pandas 版本变化，不可用时退回公开接口（合并 dtype 用 np.result_type，解析单元格用 pd.to_numeric 逐列推断），
+# 此时个别类型（如 xlsx 中的日期单元格）的推断结果可能与整表读取不同
+try:
+    from pandas.core.dtypes.cast import find_common_type as _find_common_type
+except ImportError:
+    _find_common_type = None
+try:
+    from pandas.io.parsers import TextParser as _TextParser
+except ImportError:
+    _TextParser = None
+
+
+def _resolve_string_dtype(storage: str) -> pd.StringDtype:
+    """按配置选择字符串列的存储方式：auto 时优先使用 pyarrow（Streamlit 以 Arrow 序列化，免去再次转换）"""
+    if storage == "auto":
+        try:
+            import pyarrow  # noqa: F401
+            storage = "pyarrow"
+        except ImportError:
+            storage = "python"
+    return pd.StringDtype(storage)
+
+
+# data_handler 产出的所有字符串列统一使用该 dtype
+STRING_DTYPE = _resolve_string_dtype(cfg.string_storage)
+
 
 def _coerce_non_header_columns_to_string(df: pd.DataFrame) -> pd.DataFrame:
-    """将除首列外的所有列转换为 pandas 的 string dtype，避免 Arrow 序列化错误。"""
+    """
+    将除首列外的所有列转换为 STRING_DTYPE，避免 Arrow 序列化错误。
+    只转换尚未是目标 dtype 的列，其余列直接复用，不复制整表；全部已转换时原样返回
+    """
     if df.shape[1] <= 1:
         return df
-    df_str = df.copy()
-    non_header_cols = list(df_str.columns[1:])
-    # 使用 pandas 扩展字符串dtype，兼容 Arrow
-    df_str[non_header_cols] = df_str[non_header_cols].astype("string")
-    return df_str
+    df_str = None
+    for c in range(1, df.shape[1]):
+        if df.dtypes.iloc[c] != STRING_DTYPE:
+            if df_str is None:
+                df_str = df.copy(deep=False)
+            df_str.isetitem(c, df.iloc[:, c].astype(STRING_DTYPE))
+    return df if df_str is None else df_str
+
+
+def _fill_bounds(df: pd.DataFrame, rows: Optional[int] = None, cols: Optional[int] = None) -> Tuple[int, int]:
+    """按 rows/cols 截取后的实际行列数（不超出 DataFrame 边界）"""
+    n_rows = min(len(df) if rows is None else rows, len(df))
+    n_cols = min(len(df.columns) if cols is None else cols, len(df.columns))
+    return n_rows, n_cols
+
+
+def _fillable_cells(df: pd.DataFrame, rows: Optional[int] = None, cols: Optional[int] = None) -> int:
+    """可填充区域（第 1 行起、第 1 列起）的单元格数"""
+    n_rows, n_cols = _fill_bounds(df, rows, cols)
+    return max(0, n_rows - 1) * max(0, n_cols - 1)
+
+
+def _block_fill(df: pd.DataFrame, values: Union[str, Sequence[str]], rows: Optional[int] = None,
+                cols: Optional[int] = None, pad: Optional[str] = None) -> pd.DataFrame:
+    """
+    块填充引擎：将 values 按行优先顺序构造成一个二维 object 数组，按列一次性写入可填充区域
+    - 可填充区域为第 1 行起、第 1 列起（第一行和第一列保持不变），并受 rows/cols 限制
+    - values 为字符串时整块填充同一个值；为序列时按行优先顺序依次填充，不足部分用 pad 补齐
+    - 可填充区域所在列输出为 STRING_DTYPE；返回新的 DataFrame，不修改传入的 df
+    """
+    n_rows, n_cols = _fill_bounds(df, rows, cols)
+    height, width = max(0, n_rows - 1), max(0, n_cols - 1)
+    filled = df.copy(deep=False)
+    if height == 0 or width == 0:
+        return filled
+
+    size = height * width
+    if isinstance(values, str):
+        block = np.full(size, values, dtype=object)
+    else:
+        data = np.asarray(values, dtype=object)[:size]
+        if len(data) < size:
+            if pad is None:
+                raise ValueError(f"填充值数量不足: 需要{size}, 实际{len(data)}")
+            block = np.full(size, pad, dtype=object)
+            block[:len(data)] = data
+        else:
+            block = data
+    block = block.reshape(height, width)
 
+    # 逐列整体替换，避免 O(行×列) 次 iloc 单元格写入
+    for c in range(1, n_cols):
+        column = filled.iloc[:, c]
+        if column.dtype != STRING_DTYPE:
+            column = column.astype(STRING_DTYPE)
+        # python 存储的 StringArray.__array__ 直接返回底层 object 数组（不拷贝），显式 copy 后再写入
+        column = np.asarray(column.array, dtype=object).copy()
+        column[1:n_rows] = block[:, c - 1]
+        filled.isetitem(c, pd.array(column, dtype=STRING_DTYPE))
+    return filled
 
-def generate_intermediate_result(text1: str, text2: str, text3: str, text4: str, text5: str) -> pd.DataFrame:
+
+@instrumented
+def generate_intermediate_result(text1: str, text2: str, text3: str, text4: str, text5: str,
+                                 native_dtypes: bool = False) -> pd.DataFrame:
     """
     生成阶段性结果 Demo：
     - 将 5 段文本拆分为若干 token（以空白分隔）
     - 汇总为一个长表，包含来源列、序号列、token 列
     - 行列数自适应，无需固定
+    - 按列构造：source / index / token 作为平行数组一次性建表，不为每个 token 创建 dict
+    - native_dtypes=True 时保留原生类型（source 为 category，index 为 int32），否则统一为 string
+    - 文本总量超过 cfg.parallel_tokenize_threshold 时由进程池并行分词，结果顺序不变
+    - 分词方式由 cfg.tokenizer 决定；配置 cfg.extractors 时改为抽取数据，并增加 kind 列（抽取器名称）
     """
-    records = []
-    inputs = [("text1", text1), ("text2", text2), ("text3", text3), ("text4", text4), ("text5", text5)]
-    for name, content in inputs:
-        tokens = [t for t in str(content).split() if t]
-        for idx, token in enumerate(tokens):
-            records.append({
-                "source": name,
-                "index": idx,
-                "token": token,
-            })
-    df_mid = pd.DataFrame(records)
-    # 统一为 string 便于展示
-    for col in df_mid.columns:
-        df_mid[col] = df_mid[col].astype("string")
-    return df_mid
+    # 分词器和抽取器都不会产生空 token
+    token_lists = tokenize_blocks((text1, text2, text3, text4, text5), engine=text_engine(cfg))
+    return intermediate_result_from_blocks(token_lists, native_dtypes)
+
+
+def intermediate_result_from_blocks(token_lists: Sequence[list], native_dtypes: bool = False) -> pd.DataFrame:
+    """由五个文本块各自的分词（或抽取）结果组装阶段性结果，增量计算时复用已缓存的分块结果"""
+    names = ["text1", "text2", "text3", "text4", "text5"]
+    lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+    kinds = None
+    if cfg.extractors:
+        kinds = [kind for pairs in token_lists for kind, _ in pairs]
+        tokens = [value for pairs in token_lists for _, value in pairs]
+    else:
+        tokens = [token for tokens in token_lists for token in tokens]
+    
+    codes = np.repeat(np.arange(len(names), dtype=np.int8), lengths)
+    index = np.concatenate([np.arange(n, dtype=np.int32) for n in lengths])
+    if native_dtypes:
+        source = pd.Categorical.from_codes(codes, categories=names)
+    else:
+        # 统一为 string 便于展示；来源名与序号字符串各只创建一次，按编码取用
+        source = pd.array(np.array(names, dtype=object)[codes], dtype=STRING_DTYPE)
+        index_labels = np.array([str(i) for i in range(int(lengths.max(initial=0)))], dtype=object)
+        index = pd.array(index_labels[index], dtype=STRING_DTYPE)
+    data = {
+        "source": source,
+        "index": index,
+        "token": pd.array(tokens, dtype=STRING_DTYPE),
+    }
+    if kinds is not None:
+        data["kind"] = pd.Categorical(kinds) if native_dtypes else pd.array(kinds, dtype=STRING_DTYPE)
+    return pd.DataFrame(data)
 
 
+@instrumented
 def generate_adaptive_table_by_option(df_stage: pd.DataFrame, selected_option: str) -> pd.DataFrame:
     """
     基于阶段性结果和下拉框选项生成自适应表格
-    - 根据选项不同，生成不同形状和内容的表格
+    - 根据选项不同，生成不同形状和内容的表格（策略见 adaptive_strategies 注册表）
     - 表格尺寸自适应，无需固定行列
     """
+    strategy = get_adaptive_strategy(selected_option)
+    n_tokens = len(df_stage) if "token" in df_stage.columns else 0
+    chunk = cfg.adaptive_chunk_tokens
+    if getattr(strategy, "merge", None) is not None and chunk and n_tokens > chunk:
+        # 可分块计算的策略（选项C / D）逐块读取 token 列，不把整列一次转换为 Python 字符串
+        partials = [strategy.partial(stage_tokens(df_stage, start, start + chunk), cfg)
+                    for start in range(0, n_tokens, chunk)]
+        return _string_columns(strategy.merge(partials, cfg))
+
     # 获取阶段性结果中的token数据
-    tokens = []
+    tokens = np.empty(0, dtype=object)
     if "token" in df_stage.columns:
-        tokens = df_stage["token"].astype(str).tolist()
-    
-    # 根据选项生成不同的表格结构
-    if selected_option == "选项A":
-        # 选项A：生成2列表格，按奇偶分组
-        data = []
-        for i, token in enumerate(tokens):
-            data.append({
-                "奇数组": token if i % 2 == 0 else "",
-                "偶数组": token if i % 2 == 1 else ""
-            })
-        df_adaptive = pd.DataFrame(data)
-        
-    elif selected_option == "选项B":
-        # 选项B：生成3列表格，按模3分组
-        data = []
-        for i, token in enumerate(tokens):
-            row = {"组1": "", "组2": "", "组3": ""}
-            if i % 3 == 0:
-                row["组1"] = token
-            elif i % 3 == 1:
-                row["组2"] = token
-            else:
-                row["组3"] = token
-            data.append(row)
-        df_adaptive = pd.DataFrame(data)
-        
-    elif selected_option == "选项C":
-        # 选项C：生成统计表格
-        if tokens:
-            unique_tokens = list(set(tokens))
-            data = []
-            for token in unique_tokens:
-                count = tokens.count(token)
-                data.append({
-                    "token": token,
-                    "count": count,
-                    "percentage": f"{count/len(tokens)*100:.1f}%"
-                })
-            df_adaptive = pd.DataFrame(data)
-        else:
-            df_adaptive = pd.DataFrame(columns=["token", "count", "percentage"])
-            
-    else:  # 选项D 或其他
-        # 选项D：生成单列排序表格
-        sorted_tokens = sorted(tokens) if tokens else []
-        df_adaptive = pd.DataFrame({"sorted_tokens": sorted_tokens})
+        tokens = df_stage["token"].astype(str).to_numpy(dtype=object)
     
-    # 统一为 string 类型
+    # 根据选项从注册表取出对应策略生成表格结构（未注册的选项按选项D处理）
+    df_adaptive = strategy(tokens, cfg)
+    return _string_columns(df_adaptive)
+
+
+def stage_tokens(df_stage: pd.DataFrame, start: int, stop: int) -> List[str]:
+    """阶段性结果第 start 至 stop - 1 行的 token（字符串形式，与整列 astype(str) 一致）"""
+    return df_stage["token"].iloc[start:stop].astype(str).tolist()
+
+
+def _string_columns(df_adaptive: pd.DataFrame) -> pd.DataFrame:
+    """自适应表格统一为 string 类型"""
     for col in df_adaptive.columns:
-        df_adaptive[col] = df_adaptive[col].astype("string")
-    
+        df_adaptive[col] = df_adaptive[col].astype(STRING_DTYPE)
     return df_adaptive
 
 
+@instrumented
+def adaptive_table_from_blocks(partials: Sequence[Any], selected_option: str) -> pd.DataFrame:
+    """
+    由各文本块的分块中间结果（策略的 partial，按块顺序）合并生成自适应表格，
+    结果与 generate_adaptive_table_by_option 一致；仅适用于带 merge 的策略（见 adaptive_strategies.blockwise）
+    """
+    return _string_columns(get_adaptive_strategy(selected_option).merge(partials, cfg))
+
+
+def iter_text_tokens(*texts: str) -> Iterator[str]:
+    """惰性地按配置的分词器（或抽取器）切分各段文本，产出顺序与 generate_intermediate_result 的 token 列一致"""
+    engine = text_engine(cfg)
+    for content in texts:
+        yield from engine.iter_tokens(str(content))
+
+
+def _iter_column_values(df: pd.DataFrame, columns: Optional[Sequence] = None) -> Iterator[str]:
+    """按列优先顺序惰性产出单元格的字符串形式（与 astype(str) 一致），columns 为空时遍历全部列"""
+    for col in (df.columns if columns is None else columns):
+        for item in df[col]:
+            yield str(item)
+
+
+def _iter_adaptive_values(texts: Sequence[str], selected_option: str) -> Iterator[str]:
+    """
+    按列优先顺序惰性产出自适应表格的单元格
+    取模分组策略（如选项A/B）的分组列直接对 token 流按步长切片，只在需要时重新切分文本；
+    其他策略需要全量 token（统计、排序），退化为生成完整的自适应表格
+    """
+    groups = getattr(get_adaptive_strategy(selected_option), "groups", None)
+    if groups is not None:
+        for g in range(groups):
+            # 分组列中其余位置为空串，最终结果会将其跳过，因此只产出本组的 token
+            yield from islice(iter_text_tokens(*texts), g, None, groups)
+        return
+    df_stage = generate_intermediate_result(*texts)
+    yield from _iter_column_values(generate_adaptive_table_by_option(df_stage, selected_option))
+
+
+def _iter_final_values(values: Iterable[str], final_param: str) -> Iterator[str]:
+    """跳过空值，惰性地为各数据拼接最终参数"""
+    return (f"{item}-{final_param}" for item in values if item and item != "nan")
+
+
+def _take_final_values(values: Iterable[str], final_param: str, limit: int) -> List[str]:
+    """为前 limit 个数据拼接最终参数；只格式化实际会填入模板的部分"""
+    return list(islice(_iter_final_values(values, final_param), limit))
+
+
+@instrumented
 def process_to_final_result(df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str, df_template: pd.DataFrame, rows: int, cols: int) -> pd.DataFrame:
     """
     基于阶段性结果、自适应表格和最终参数生成最终结果表格
+    阶段性结果 token 在前、自适应表格按列在后，惰性合并，只取模板可填充单元格数量的数据
     """
     df_template = _coerce_non_header_columns_to_string(df_template)
     
-    # 合并两个表格的数据
-    stage_tokens = df_stage["token"].astype(str).tolist() if "token" in df_stage.columns else []
-    adaptive_data = []
-    for col in df_adaptive.columns:
-        adaptive_data.extend(df_adaptive[col].astype(str).tolist())
-    
-    # 合并所有数据并添加最终参数
-    all_data = stage_tokens + adaptive_data
-    processed_data = [f"{item}-{final_param}" for item in all_data if item and item != "nan"]
+    # 合并两个表格的数据并添加最终参数
+    stage_columns = ["token"] if "token" in df_stage.columns else []
+    values = chain(_iter_column_values(df_stage, stage_columns), _iter_column_values(df_adaptive))
+    processed_data = _take_final_values(values, final_param, _fillable_cells(df_template, rows, cols))
     
-    # 填充到模板中
-    filled = df_template.copy()
-    idx = 0
-    for r in range(1, min(rows, len(filled))):
-        for c in range(1, min(cols, len(filled.columns))):
-            value = processed_data[idx] if idx < len(processed_data) else cfg.placeholder
-            filled.iloc[r, c] = value
-            idx += 1
-    
-    return _coerce_non_header_columns_to_string(filled)
+    # 填充到模板中，数据不足的单元格使用占位符
+    return _block_fill(df_template, processed_data, rows, cols, pad=cfg.placeholder)
+
+
+@instrumented
+def stream_final_result(text1: str, text2: str, text3: str, text4: str, text5: str, selected_option: str,
+                        final_param: str, df_template: pd.DataFrame, rows: int, cols: int) -> pd.DataFrame:
+    """
+    流式模式：直接从五段文本生成最终结果，不构造阶段性结果和自适应表格
+    阶段 → 自适应 → 最终 全程以生成器串联，只产生并格式化模板可填充单元格数量的 token，
+    结果与依次调用三个阶段函数一致
+    """
+    texts = (text1, text2, text3, text4, text5)
+    df_template = _coerce_non_header_columns_to_string(df_template)
+    values = chain(iter_text_tokens(*texts), _iter_adaptive_values(texts, selected_option))
+    processed_data = _take_final_values(values, final_param, _fillable_cells(df_template, rows, cols))
+    return _block_fill(df_template, processed_data, rows, cols, pad=cfg.placeholder)
 
 
+@instrumented
 def fill_table(df: pd.DataFrame, text1: str, text2: str, rows: int = None, cols: int = None) -> pd.DataFrame:
     """
     智能填充逻辑：
@@ -150,19 +297,14 @@ def fill_table(df: pd.DataFrame, text1: str, text2: str, rows: int = None, cols:
     actual_rows = min(actual_rows, len(df_filled))
     actual_cols = min(actual_cols, len(df_filled.columns))
     
-    idx = 0
-    # 从第二行第二列开始填充（保持第一行和第一列不变）
-    for r in range(1, actual_rows):
-        for c in range(1, actual_cols):
-            if r < len(df_filled) and c < len(df_filled.columns):
-                df_filled.iloc[r, c] = f"{text1}-{text2}-{idx}"
-                idx += 1
-    
-    # 返回前再次确保 dtype
-    df_filled = _coerce_non_header_columns_to_string(df_filled)
-    return df_filled
+    # 从第二行第二列开始按行优先顺序填充（保持第一行和第一列不变）
+    prefix = f"{text1}-{text2}-"
+    n_cells = max(0, actual_rows - 1) * max(0, actual_cols - 1)
+    values = [prefix + str(idx) for idx in range(n_cells)]
+    return _block_fill(df_filled, values, actual_rows, actual_cols)
 
 
+@instrumented
 def make_blank_template(rows: int, cols: int, placeholder: Optional[str] = None) -> pd.DataFrame:
     ph = placeholder if placeholder is not None else cfg.placeholder
     rows = max(1, rows)
@@ -170,40 +312,264 @@ def make_blank_template(rows: int, cols: int, placeholder: Optional[str] = None)
     df = pd.DataFrame(columns=range(cols), index=range(rows))
     df = _coerce_non_header_columns_to_string(df)
     # 仅填充非首行首列
-    for r in range(1, rows):
-        for c in range(1, cols):
-            df.iloc[r, c] = ph
-    return df
+    return _block_fill(df, ph)
+
+
+def _assemble_template(head: pd.DataFrame, first_col: pd.Series, rows: int) -> pd.DataFrame:
+    """
+    由表头、首行数据和首列数据组装模板表格（其余单元格为占位符）
+    与整表读取后再填充占位符的结果一致，但无需在内存中保留原表的其他单元格
+    """
+    head = _coerce_non_header_columns_to_string(head)
+    columns = {0: first_col.reset_index(drop=True)}
+    for c in range(1, len(head.columns)):
+        column = np.full(rows, cfg.placeholder, dtype=object)
+        if rows > 0 and len(head) > 0:
+            column[0] = head.iloc[0, c]
+        columns[c] = pd.array(column, dtype=STRING_DTYPE)
+    template_df = pd.DataFrame(columns)
+    template_df.columns = head.columns
+    return template_df
+
+
+def _common_dtype(dtypes: Sequence[Any]) -> Any:
+    """各数据块同一列 dtype 合并后的 dtype（与 pandas 合并分块的规则一致）"""
+    if _find_common_type is not None:
+        return _find_common_type(list(dtypes))
+    dtypes = list(dtypes)
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return dtypes[0]
+    # 与 pandas 一致：布尔与其他类型合并为 object
+    if any(dtype == np.bool_ for dtype in dtypes):
+        return np.dtype(object)
+    try:
+        return np.result_type(*dtypes)
+    except TypeError:
+        return np.dtype(object)
+
+
+def _scan_csv_template(uploaded_file, first_col_parts: Optional[list] = None) -> Tuple[pd.DataFrame, list, int]:
+    """
+    分块扫描 CSV 模板，返回 (首行（已转换为各列合并后的 dtype）, 各列合并后的 dtype, 数据行数)
+    各列的最终 dtype 按 pandas 合并分块的规则推断；first_col_parts 不为 None 时同时收集各块的首列
+    """
+    uploaded_file.seek(0)
+    head = None
+    col_dtypes = None
+    rows = 0
+    for chunk in pd.read_csv(uploaded_file, chunksize=cfg.template_chunksize):
+        rows += len(chunk)
+        if first_col_parts is not None:
+            # 拷贝切片，避免视图引用整个数据块导致其无法释放
+            first_col_parts.append(chunk.iloc[:, 0].to_numpy(copy=True))
+        if head is None:
+            head = chunk.iloc[:1].copy()
+            col_dtypes = [[dtype] for dtype in chunk.dtypes]
+        else:
+            for dtypes, dtype in zip(col_dtypes, chunk.dtypes):
+                dtypes.append(dtype)
+    if head is None:
+        uploaded_file.seek(0)
+        head = pd.read_csv(uploaded_file, nrows=0)
+        col_dtypes = [[dtype] for dtype in head.dtypes]
+
+    common = [_common_dtype(dtypes) for dtypes in col_dtypes]
+    for c, dtype in enumerate(common):
+        if head.dtypes.iloc[c] != dtype:
+            head.isetitem(c, head.iloc[:, c].astype(dtype))
+    return head, common, rows
+
+
+def _ingest_csv_template(uploaded_file) -> Tuple[pd.DataFrame, int, int]:
+    """
+    分块流式读取 CSV 模板：每块只保留首列和该块的首行，其余单元格解析后即丢弃
+    各列的最终 dtype 按 pandas 合并分块的规则推断，保证首行转字符串后与整表读取一致
+    """
+    first_col_parts = []
+    head, common, rows = _scan_csv_template(uploaded_file, first_col_parts)
+    first_col = pd.Series(
+        np.concatenate(first_col_parts) if first_col_parts else [],
+        name=head.columns[0],
+    ).astype(common[0])
+    return _assemble_template(head, first_col, rows), rows, len(head.columns)
+
+
+def _convert_xlsx_cell(value):
+    """与 pandas openpyxl 读取器的单元格转换保持一致：空单元格转为空串，整数值浮点转为 int"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _ingest_xlsx_template(uploaded_file) -> Tuple[pd.DataFrame, int, int]:
+    """使用 openpyxl 只读迭代器流式读取 xlsx 模板的第一个工作表"""
+    with open_workbook(uploaded_file) as wb:
+        return _ingest_xlsx_sheet(wb.worksheets[0])
+
+
+def _parse_xlsx_rows(data: list, header: Optional[int], dtype=None) -> pd.DataFrame:
+    """与 pd.read_excel 相同的方式解析 openpyxl 读出的单元格值"""
+    if _TextParser is not None:
+        return _TextParser(data, header=header, skip_blank_lines=False, dtype=dtype).read()
+    # 公开接口：列名按 pd.read_csv 的规则生成（重名、空列名），单元格保留原值，空串视为缺失后逐列推断数值类型
+    columns = None
+    if header is not None:
+        buf = io.StringIO()
+        csv.writer(buf).writerow(data[header])
+        columns = pd.read_csv(io.StringIO(buf.getvalue()), nrows=0).columns
+        data = data[header + 1:]
+    df = pd.DataFrame([[np.nan if v == "" else v for v in values] for values in data], columns=columns, dtype=object)
+    if dtype is not None:
+        return df.astype(dtype)
+    for c in range(df.shape[1]):
+        try:
+            df.isetitem(c, pd.to_numeric(df.iloc[:, c]))
+        except (ValueError, TypeError):
+            pass
+    return df.infer_objects()
+
+
+def _scan_xlsx_sheet(ws, first_col: Optional[list] = None) -> Tuple[Optional[pd.DataFrame], list, int]:
+    """
+    流式扫描一个工作表（openpyxl 只读模式），返回 (首行（已转换为各列合并后的 dtype）, 首列各块的 dtype, 数据行数)
+    其余单元格按块解析出各列 dtype 后即丢弃；空工作表返回 (None, [], 0)
+    first_col 不为 None 时同时收集首列的单元格值
+    """
+    def flush(buffer):
+        if buffer:
+            chunk_width = max(len(values) for values in buffer)
+            padded = [values + [""] * (chunk_width - len(values)) for values in buffer]
+            chunk_dtypes.append(list(_parse_xlsx_rows(padded, None).dtypes))
+            buffer.clear()
+
+    ws.reset_dimensions()
+    head_rows = []
+    chunk_dtypes = []
+    buffer = []
+    pending_empty = 0
+    width = 0
+    last_row_with_data = -1
+    for row_number, row in enumerate(ws.iter_rows(values_only=True)):
+        values = [_convert_xlsx_cell(v) for v in row]
+        # 与 pandas 一致：去掉行尾的空单元格，末尾的全空行不计入模板
+        while values and values[-1] == "":
+            values.pop()
+        if row_number < 2:
+            head_rows.append(values)
+        if row_number > 0 and first_col is not None:
+            first_col.append(values[0] if values else "")
+        if not values:
+            pending_empty += 1
+            continue
+        last_row_with_data = row_number
+        width = max(width, len(values))
+        if row_number > 0:
+            # 空行只有在其后还有数据时才参与 dtype 推断
+            buffer.extend([] for _ in range(pending_empty))
+            buffer.append(values)
+            if len(buffer) >= cfg.template_chunksize:
+                flush(buffer)
+        pending_empty = 0
+    flush(buffer)
+
+    if last_row_with_data < 0:
+        return None, [], 0
+    rows = last_row_with_data
+    head_rows = [values + [""] * (width - len(values)) for values in head_rows[:rows + 1]]
+    head = _parse_xlsx_rows(head_rows, 0)
+    for c in range(1, width):
+        # 某一块中缺失的列全部为空值，按 float64（NaN）参与合并
+        dtypes = [dtypes[c] if c < len(dtypes) else np.dtype("float64") for dtypes in chunk_dtypes]
+        common = _common_dtype(dtypes) if dtypes else head.dtypes.iloc[c]
+        if head.dtypes.iloc[c] != common:
+            head.isetitem(c, head.iloc[:, c].astype(common))
+    return head, [dtypes[0] for dtypes in chunk_dtypes], rows
+
+
+def _ingest_xlsx_sheet(ws) -> Tuple[pd.DataFrame, int, int]:
+    """
+    流式读取一个工作表（openpyxl 只读模式），仅保留表头、首行和首列
+    其余单元格按块解析出各列 dtype 后即丢弃，保证首行转字符串后与 pd.read_excel 整表读取一致
+    """
+    first_col = []
+    head, _, rows = _scan_xlsx_sheet(ws, first_col)
+    if head is None:
+        # 空工作表：与 pd.read_excel 一致，返回空表
+        return pd.DataFrame(), 0, 0
+    col_data = [[head.columns[0]]] + [[value] for value in first_col[:rows]]
+    first_col = _parse_xlsx_rows(col_data, 0).iloc[:, 0]
+    return _assemble_template(head, first_col, rows), rows, len(head.columns)
 
 
-def create_template_from_upload(uploaded_file) -> Tuple[pd.DataFrame, int, int, Optional[str]]:
+@instrumented
+def create_template_from_upload(uploaded_file, streaming: bool = False) -> Tuple[pd.DataFrame, int, int, Optional[str]]:
     """
     从上传的文件创建模板表格
     第一行和第一列作为参考信息，其他部分用占位符填充
+    streaming=True 时仅流式读取表头、首行和首列（CSV 按块读取，xlsx 使用只读迭代器），
+    适合大体积模板，避免解析并保留随后会被占位符覆盖的单元格
+    整表读取 xlsx 时按 Config.excel_read_engine 选择引擎（见 spreadsheet_io）
     
     返回: (template_df, rows, cols, error_message)
     """
     try:
+        if streaming:
+            if uploaded_file.name.endswith(".csv"):
+                template_df, rows, cols = _ingest_csv_template(uploaded_file)
+            else:
+                template_df, rows, cols = _ingest_xlsx_template(uploaded_file)
+            return template_df, rows, cols, None
+
         if uploaded_file.name.endswith(".csv"):
             df = pd.read_csv(uploaded_file)
         else:
-            df = pd.read_excel(uploaded_file, engine="openpyxl")
-        
-        # 获取实际的行数和列数
-        rows = len(df)
-        cols = len(df.columns)
-        
-        # 创建新的模板表格（保持第一行第一列）
-        template_df = _coerce_non_header_columns_to_string(df)
+            df = read_excel(uploaded_file)
         
-        # 除了第一行和第一列，其他部分用占位符填充
-        for r in range(1, rows):
-            for c in range(1, cols):
-                template_df.iloc[r, c] = cfg.placeholder
-        
-        # 返回前确保 dtype
-        template_df = _coerce_non_header_columns_to_string(template_df)
+        template_df, rows, cols = _template_from_frame(df)
         return template_df, rows, cols, None
         
     except Exception as e:
         return None, 0, 0, str(e)
+
+
+def _template_from_frame(df: pd.DataFrame) -> Tuple[pd.DataFrame, int, int]:
+    # 获取实际的行数和列数
+    rows = len(df)
+    cols = len(df.columns)
+    
+    # 创建新的模板表格（保持第一行第一列）
+    template_df = _coerce_non_header_columns_to_string(df)
+    
+    # 除了第一行和第一列，其他部分用占位符填充
+    template_df = _block_fill(template_df, cfg.placeholder)
+    return template_df, rows, cols
+
+
+@instrumented
+def create_templates_from_workbook(uploaded_file, streaming: bool = False
+                                   ) -> Tuple[Dict[str, Tuple[pd.DataFrame, int, int]], Optional[str]]:
+    """
+    一次解析工作簿中的全部工作表，每个工作表生成一个模板（规则同 create_template_from_upload）
+    CSV 文件视为只有一个工作表（以文件名命名）
+    
+    返回: ({工作表名: (template_df, rows, cols)}, error_message)
+    """
+    try:
+        if uploaded_file.name.endswith(".csv"):
+            template_df, rows, cols, error = create_template_from_upload(uploaded_file, streaming=streaming)
+            if error:
+                return {}, error
+            return {Path(uploaded_file.name).stem: (template_df, rows, cols)}, None
+
+        uploaded_file.seek(0)
+        if streaming:
+            with open_workbook(uploaded_file) as wb:
+                return {ws.title: _ingest_xlsx_sheet(ws) for ws in wb.worksheets}, None
+
+        sheets = read_excel(uploaded_file, sheet_name=None)
+        return {name: _template_from_frame(df) for name, df in sheets.items()}, None
+
+    except Exception as e:
+        return {}, str(e)
@@ -3,10 +3,22 @@
 这个文件展示了如何替换默认的数据处理逻辑
 """
 
+import os
+import sys
 import pandas as pd
 import re
 from typing import List, Dict
 
+# 允许从项目根目录外直接运行本示例
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adaptive_strategies import register_adaptive_strategy
+from tokenization import compile_extractors
+
+_NUMBER_PATTERN = re.compile(r'(\d+)')
+# 各类别分别预编译：合并为一个正则时重叠的匹配只归入一个类别，这里每个类别单独扫描，保留重叠的结果
+_EXTRACTORS = {name: compile_extractors((name,)) for name in ("keyword", "number", "date", "email")}
+
 def advanced_fill_table(df: pd.DataFrame, text1: str, text2: str) -> pd.DataFrame:
     """
     高级数据处理逻辑示例
@@ -47,31 +59,15 @@ def advanced_fill_table(df: pd.DataFrame, text1: str, text2: str) -> pd.DataFram
 def extract_data_from_text(text: str) -> Dict[str, List[str]]:
     """
     从文本中提取结构化数据
+    各类别独立匹配，结果可以重叠：日期中的数字也计入数字，邮箱中的大写单词也计入关键词
+    （Config.extractors 的单次扫描抽取则不重叠，见 tokenization.ExtractorSet）
     """
-    result = {
-        'keywords': [],
-        'numbers': [],
-        'dates': [],
-        'emails': []
+    return {
+        'keywords': _EXTRACTORS['keyword'].extract(text)['keyword'],
+        'numbers': _EXTRACTORS['number'].extract(text)['number'],
+        'dates': _EXTRACTORS['date'].extract(text)['date'],
+        'emails': _EXTRACTORS['email'].extract(text)['email'],
     }
-    
-    # 提取关键词（假设是大写字母开头的单词）
-    keywords = re.findall(r'\b[A-Z][a-z]+\b', text)
-    result['keywords'] = keywords
-    
-    # 提取数字
-    numbers = re.findall(r'\d+', text)
-    result['numbers'] = numbers
-    
-    # 提取日期（简单格式）
-    dates = re.findall(r'\d{4}-\d{2}-\d{2}', text)
-    result['dates'] = dates
-    
-    # 提取邮箱
-    emails = re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)
-    result['emails'] = emails
-    
-    return result
 
 def create_summary_table(df: pd.DataFrame, text1: str, text2: str) -> pd.DataFrame:
     """
@@ -100,6 +96,19 @@ def create_summary_table(df: pd.DataFrame, text1: str, text2: str) -> pd.DataFra
     
     return pd.DataFrame(summary_data)
 
+@register_adaptive_strategy("数字提取")
+def numeric_token_strategy(tokens, options) -> pd.DataFrame:
+    """
+    自定义自适应表格策略示例：提取 token 中的数字
+    注册后即出现在下拉框中（Config.dropdown_options 取自注册表），无需修改 data_handler
+    """
+    numbers = pd.Series(tokens, dtype=object).str.extract(_NUMBER_PATTERN, expand=False)
+    mask = numbers.notna().to_numpy()
+    return pd.DataFrame({
+        'token': tokens[mask],
+        'number': numbers.to_numpy()[mask],
+    })
+
 # 使用示例：
 if __name__ == "__main__":
     # 测试数据
@@ -123,4 +132,9 @@ if __name__ == "__main__":
     data1 = extract_data_from_text(test_text1)
     data2 = extract_data_from_text(test_text2)
     print("文本1提取结果:", data1)
-    print("文本2提取结果:", data2) 
\ No newline at end of file
+    print("文本2提取结果:", data2)
+    
+    from data_handler import generate_intermediate_result, generate_adaptive_table_by_option
+    print("\n自定义策略 \"数字提取\" 的自适应表格:")
+    stage_df = generate_intermediate_result("订单A12 数量30", "价格25元", "", "", "")
+    print(generate_adaptive_table_by_option(stage_df, "数字提取")) 
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+结果导出
+- 按块增量序列化 DataFrame，支持 CSV、gzip 压缩的 CSV、xlsx（xlsxwriter / openpyxl 逐行写出，见 spreadsheet_io）
+  和 Parquet（需要 pyarrow）
+- 只在请求下载时才生成文件内容，并按结果版本（内容指纹）+ 格式缓存，重复下载不再重新序列化
+- write_frames 直接写出依次产生的数据块，用于无法整表放入内存的结果（见 out_of_core）
+"""
+import gzip
+import io
+from itertools import chain
+from typing import BinaryIO, Dict, Iterable, Iterator, Tuple
+
+import pandas as pd
+
+from config import Config
+from result_cache import ResultCache
+from sparse_template import Table, row_slice
+from spreadsheet_io import write_sheets
+
+cfg = Config()
+
+# 格式 → (文件扩展名, MIME 类型)
+EXPORT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "csv": ("csv", "text/csv"),
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+export_cache = ResultCache(cfg.export_cache_max_entries, cfg.export_cache_max_bytes)
+
+
+def _iter_frames(df: Table, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """按块取行；稀疏表格只在此时逐块生成完整的行"""
+    for start in range(0, len(df), chunk_rows):
+        yield row_slice(df, start, start + chunk_rows)
+
+
+def _with_header(df: Table, chunk_rows: int = None) -> Iterator[pd.DataFrame]:
+    """首块为空表（只含表头及各列 dtype），其后为各数据块"""
+    return chain([row_slice(df, 0, 0)], _iter_frames(df, chunk_rows or cfg.export_chunk_rows))
+
+
+def _csv_blocks(frames: Iterable[pd.DataFrame]) -> Iterator[bytes]:
+    # 只有第一块写出表头
+    for i, frame in enumerate(frames):
+        yield frame.to_csv(index=False, header=i == 0).encode("utf-8")
+
+
+def iter_csv_chunks(df: Table, chunk_rows: int = None) -> Iterator[bytes]:
+    """按块产出 UTF-8 编码的 CSV 内容（首块包含表头），与 df.to_csv(index=False) 的结果一致"""
+    return _csv_blocks(_with_header(df, chunk_rows))
+
+
+def _write_csv_frames(frames: Iterable[pd.DataFrame], fileobj: BinaryIO, compress: bool = False) -> None:
+    if compress:
+        with gzip.GzipFile(fileobj=fileobj, mode="wb") as gz:
+            for block in _csv_blocks(frames):
+                gz.write(block)
+    else:
+        for block in _csv_blocks(frames):
+            fileobj.write(block)
+
+
+def write_csv(df: Table, fileobj: BinaryIO, compress: bool = False, chunk_rows: int = None) -> None:
+    """将 CSV 按块写入文件对象，compress=True 时以 gzip 压缩"""
+    _write_csv_frames(_with_header(df, chunk_rows), fileobj, compress)
+
+
+def write_xlsx(df: Table, fileobj: BinaryIO, sheet_name: str = "Sheet1", chunk_rows: int = None) -> None:
+    """按块逐行写出 xlsx（引擎由 Config.excel_write_engine 选择），不构建整张工作表的单元格对象"""
+    write_workbook({sheet_name: df}, fileobj, chunk_rows)
+
+
+def write_workbook(sheets: Dict[str, Table], fileobj: BinaryIO, chunk_rows: int = None) -> None:
+    """将多个表格写入同一个 xlsx 文件（每个表格一个工作表，按字典顺序），按块逐行写出"""
+    write_sheets({name: _with_header(df, chunk_rows) for name, df in sheets.items()}, fileobj)
+
+
+def write_parquet(df: Table, fileobj: BinaryIO, chunk_rows: int = None) -> None:
+    """按块写出 Parquet（每块一个 row group），需要安装 pyarrow"""
+    _write_parquet_frames(_with_header(df, chunk_rows), fileobj)
+
+
+def _write_parquet_frames(frames: Iterable[pd.DataFrame], fileobj: BinaryIO) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("导出 Parquet 需要安装 pyarrow") from e
+
+    frames = iter(frames)
+    first = next(frames)
+    # Parquet 要求列名为字符串
+    names = [str(col) for col in first.columns]
+    schema = pa.Schema.from_pandas(first.iloc[:0].set_axis(names, axis=1), preserve_index=False)
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        # 跳过空块；全部为空时写出一个空的 row group
+        wrote = False
+        for frame in chain([first], frames):
+            if len(frame):
+                writer.write_table(pa.Table.from_pandas(frame.set_axis(names, axis=1), schema=schema,
+                                                        preserve_index=False))
+                wrote = True
+        if not wrote:
+            writer.write_table(pa.Table.from_pandas(first.set_axis(names, axis=1), schema=schema,
+                                                    preserve_index=False))
+
+
+def write_frames(frames: Iterable[pd.DataFrame], fileobj: BinaryIO, fmt: str = "csv",
+                 sheet_name: str = "Sheet1") -> None:
+    """
+    将依次产生的数据块（列相同，至少一块，可为空表）写出为指定格式，只在内存中保留当前块
+    结果与把各块拼接成一张表后导出一致
+    """
+    if fmt in ("csv", "csv.gz"):
+        _write_csv_frames(frames, fileobj, compress=fmt == "csv.gz")
+    elif fmt == "xlsx":
+        write_sheets({sheet_name: frames}, fileobj)
+    elif fmt == "parquet":
+        _write_parquet_frames(frames, fileobj)
+    else:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+
+def export_to(df: Table, fileobj: BinaryIO, fmt: str = "csv") -> None:
+    """将表格按指定格式写入文件对象"""
+    if fmt == "csv":
+        write_csv(df, fileobj)
+    elif fmt == "csv.gz":
+        write_csv(df, fileobj, compress=True)
+    elif fmt == "xlsx":
+        write_xlsx(df, fileobj)
+    elif fmt == "parquet":
+        write_parquet(df, fileobj)
+    else:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+
+
+def export_bytes(df: Table, fmt: str = "csv") -> bytes:
+    """将 DataFrame 序列化为指定格式的文件内容"""
+    buf = io.BytesIO()
+    export_to(df, buf, fmt)
+    return buf.getvalue()
+
+
+def cached_export(result_key: str, df: Table, fmt: str = "csv") -> bytes:
+    """按结果版本和格式缓存导出内容，同一版本的结果只序列化一次"""
+    return export_cache.get_or_compute(f"{result_key}:{fmt}", lambda: export_bytes(df, fmt))
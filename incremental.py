@@ -0,0 +1,157 @@
+"""
+增量计算：编辑者通常每次只改动一个文本块，只重新处理内容发生变化的文本块
+- 各文本块的分词结果按块内容指纹缓存（进程内共享），阶段性结果由各块结果拼接，未变化的块不再重新分词
+- 支持分块计算的策略（选项C 计数、选项D 排序，见 adaptive_strategies.blockwise）按块缓存中间结果，
+  自适应表格由各块结果合并得到；其他策略退化为按阶段性结果整体计算
+- 最终结果只用到能填满模板的前若干个 token：若这些 token 全部来自未变化的前几个文本块，直接复用上一次的结果
+- 各函数可传入 report(进度 0~1, 说明)（如后台任务的 JobContext.report），逐块汇报进度；
+  report 抛出的异常（如任务已取消时的 JobCancelled）会中止计算
+"""
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import data_handler
+from adaptive_strategies import get_adaptive_strategy, strategy_options_key
+from config import Config
+from data_handler import (
+    _fillable_cells,
+    adaptive_table_from_blocks,
+    intermediate_result_from_blocks,
+    stage_tokens,
+)
+from result_cache import ResultCache, _cached, cached_adaptive_table, cached_final_result, fingerprint
+from sparse_template import Table, final_result
+from tokenization import text_engine, tokenize_blocks
+
+cfg = Config()
+
+block_cache = ResultCache(cfg.block_cache_max_entries, cfg.block_cache_max_bytes)
+
+Report = Callable[[float, Optional[str]], None]
+
+
+def _no_report(progress: float, message: Optional[str] = None) -> None:
+    pass
+
+
+@dataclass(frozen=True)
+class StageBlocks:
+    """阶段性结果的分块信息（体积很小，可直接保存在 session_state 中）"""
+    keys: Tuple[str, ...]      # 各文本块的内容指纹（含分词配置）
+    lengths: Tuple[int, ...]   # 各文本块的 token 数
+    filled: Tuple[int, ...]    # 各文本块中会被填入最终结果的 token 数（"nan" 会被跳过）
+
+    @property
+    def key(self) -> str:
+        return fingerprint("stage-blocks", *self.keys)
+
+
+def _block_key(text: str) -> str:
+    dh_cfg = data_handler.cfg
+    return fingerprint("block", text, dh_cfg.tokenizer, dh_cfg.extractors)
+
+
+def _block_tokens(keys: Sequence[str], texts: Sequence[str], report: Report = _no_report) -> list:
+    """
+    取出各文本块的分词结果，只对缓存中没有的块分词
+    可并行的大文本块一起交给 tokenize_blocks，其余逐块分词，每块之间汇报进度（可在此中止）
+    """
+    results = [block_cache.get(key) for key in keys]
+    missing = [i for i, tokens in enumerate(results) if tokens is None]
+    engine = text_engine(data_handler.cfg)
+    threshold = data_handler.cfg.parallel_tokenize_threshold
+    # 达到并行阈值时全部缺失的块一起分词，由进程池并行
+    groups = [missing] if missing and sum(len(texts[i]) for i in missing) >= threshold else [[i] for i in missing]
+    for n, group in enumerate(groups):
+        report(n / len(groups), f"分词：文本块 {group[0] + 1}" if len(group) == 1 else f"分词（{len(group)} 个文本块）")
+        computed = tokenize_blocks([texts[i] for i in group], engine=engine)
+        for i, tokens in zip(group, computed):
+            block_cache.put(keys[i], tokens)
+            results[i] = tokens
+    return results
+
+
+def _token_values(tokens: list) -> list:
+    """抽取模式下分块结果为 (类别, 值)，只取值"""
+    return [value for _, value in tokens] if data_handler.cfg.extractors else tokens
+
+
+def incremental_intermediate_result(text1: str, text2: str, text3: str, text4: str,
+                                    text5: str, report: Report = _no_report) -> Tuple[StageBlocks, pd.DataFrame]:
+    """返回 (分块信息, 阶段性结果)，结果与 generate_intermediate_result 一致，只对内容变化的文本块重新分词"""
+    texts = [str(t) for t in (text1, text2, text3, text4, text5)]
+    keys = tuple(_block_key(text) for text in texts)
+    token_lists = _block_tokens(keys, texts, lambda p, m=None: report(0.9 * p, m))
+    report(0.9, "合并文本块")
+    values = [_token_values(tokens) for tokens in token_lists]
+    blocks = StageBlocks(
+        keys=keys,
+        lengths=tuple(len(v) for v in values),
+        filled=tuple(len(v) - v.count("nan") for v in values),
+    )
+    return blocks, _cached(blocks.key, lambda: intermediate_result_from_blocks(token_lists))
+
+
+def incremental_adaptive_table(blocks: StageBlocks, df_stage: pd.DataFrame, selected_option: str,
+                               report: Report = _no_report) -> Tuple[str, pd.DataFrame]:
+    """
+    返回 (自适应表格指纹, 自适应表格)
+    支持分块计算的策略只为内容变化的文本块重算中间结果（如选项C 的计数），再按块顺序合并
+    """
+    strategy = get_adaptive_strategy(selected_option)
+    if getattr(strategy, "merge", None) is None:
+        report(0.0, selected_option)
+        return cached_adaptive_table(blocks.key, df_stage, selected_option)
+
+    dh_cfg = data_handler.cfg
+    key = fingerprint("adaptive", blocks.key, selected_option, *strategy_options_key(dh_cfg))
+
+    def compute() -> pd.DataFrame:
+        bounds = np.concatenate([[0], np.cumsum(blocks.lengths)])
+        partials = []
+        for i, block in enumerate(blocks.keys):
+            report(0.9 * i / len(blocks.keys), f"{selected_option}：文本块 {i + 1}")
+            # 分块中间结果与选项及策略配置相关（如选项D 的排序规则）
+            partials.append(block_cache.get_or_compute(
+                fingerprint("partial", block, selected_option, *strategy_options_key(dh_cfg)),
+                # 只读取该块的 token，不把整列一次转换为 Python 字符串
+                lambda: strategy.partial(stage_tokens(df_stage, bounds[i], bounds[i + 1]), dh_cfg),
+            ))
+        report(0.9, f"{selected_option}：合并")
+        return adaptive_table_from_blocks(partials, selected_option)
+
+    return key, _cached(key, compute)
+
+
+def _prefix_blocks(blocks: StageBlocks, limit: int) -> Optional[int]:
+    """只用前几个文本块的 token 就能填满模板时返回所需块数，否则返回 None"""
+    filled = 0
+    for i, n in enumerate(blocks.filled):
+        filled += n
+        if filled >= limit:
+            return i + 1
+    return None
+
+
+def incremental_final_result(blocks: StageBlocks, adaptive_key: str, df_stage: pd.DataFrame,
+                             df_adaptive: pd.DataFrame, final_param: str, template_key: str,
+                             df_template: Table, rows: int, cols: int,
+                             report: Report = _no_report) -> Tuple[str, Table]:
+    """
+    返回 (最终结果指纹, 最终结果)
+    模板只需阶段性结果的前若干个 token 即可填满时，指纹只由这些 token 所在的文本块决定，
+    修改其后的文本块或更换选项都不会触发重新填充
+    """
+    n_blocks = _prefix_blocks(blocks, _fillable_cells(df_template, rows, cols))
+    report(0.0, "填充模板")
+    if n_blocks is None:
+        return cached_final_result(adaptive_key, df_stage, df_adaptive, final_param,
+                                   template_key, df_template, rows, cols)
+    key = fingerprint("final-prefix", n_blocks, *blocks.keys[:n_blocks], final_param, template_key, rows, cols,
+                      data_handler.cfg.placeholder)
+    return key, _cached(
+        key, lambda: final_result(df_stage, df_adaptive, final_param, df_template, rows, cols)
+    )
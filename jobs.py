@@ -0,0 +1,314 @@
+"""
+后台任务队列
+- 耗时的阶段计算提交到后台线程池执行，Streamlit 脚本线程只负责提交任务和轮询结果，页面不再卡住
+- 每个任务有任务号、状态、进度和说明，可随时取消：尚未开始的任务直接取消，
+  执行中的任务在下一次调用 ctx.check() / ctx.report() 时中止；取消后任务函数仍正常返回的，结果丢弃，状态仍为已取消
+- 任务函数的第一个参数为 JobContext；任务运行在后台线程中，不能访问 st.session_state，
+  需要的参数应在提交前取出
+- 使用线程池而非进程池：任务需要共享进程内的结果缓存和模板存储，且分词本身已可使用进程池并行
+
+多用户共用一个队列（进程内只有一个 job_queue）：
+- 排队任务数有上限（max_pending），每个会话未结束的任务数也有上限（max_per_owner），超出时 submit 抛出 QueueFull，
+  页面据此提示稍后重试，而不是无限制地堆积计算
+- 公平调度：空闲线程按会话轮流取任务，一个会话提交再多任务也不会让其他会话一直排队
+- 合并相同请求：提交时给出 key（输入的指纹）且已有相同 key 的未结束任务时，直接共享该任务，
+  计算只做一次；共享任务在所有提交者都取消后才真正取消，所有提交者都取走结果后才释放
+- 提交者不再关心结果时调用 release（取消按钮、重新提交同一步骤）：未结束的任务按 cancel 处理，
+  无人等待的任务结束后直接丢弃；已结束的任务按 pop 处理。已取消但仍在执行的任务在结束前仍计入会话上限
+"""
+import contextvars
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from config import Config
+
+cfg = Config()
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+CANCELLED = "cancelled"
+
+FINISHED = (DONE, ERROR, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务被取消时由 JobContext.check() 抛出"""
+
+
+class QueueFull(Exception):
+    """排队任务过多（全局或当前会话）时由 JobQueue.submit 抛出，调用方应稍后重试"""
+
+
+@dataclass
+class Job:
+    job_id: str
+    name: str
+    owner: Optional[str] = None
+    key: Optional[str] = None
+    status: str = PENDING
+    progress: float = 0.0
+    message: str = ""
+    result: Any = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    # 共享该任务的提交者数（合并相同请求时大于 1）
+    subscribers: int = 1
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+
+class JobContext:
+    """传给任务函数，用于汇报进度和响应取消"""
+
+    def __init__(self, job: Job, cancel_event: threading.Event):
+        self._job = job
+        self._cancel_event = cancel_event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check(self) -> None:
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, progress: float, message: Optional[str] = None) -> None:
+        """汇报进度（0~1）及当前步骤说明，同时检查是否已被取消"""
+        self.check()
+        self._job.progress = min(max(progress, 0.0), 1.0)
+        if message is not None:
+            self._job.message = message
+
+    def scaled(self, start: float, end: float) -> Callable[[float, Optional[str]], None]:
+        """返回把子步骤进度（0~1）映射到 start~end 的 report，供分步骤的计算逐块汇报"""
+        return lambda progress, message=None: self.report(start + (end - start) * progress, message)
+
+
+@dataclass
+class _Task:
+    job: Job
+    cancel_event: threading.Event
+    context: contextvars.Context
+    func: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+
+
+class JobQueue:
+    """进程内共享的后台任务队列（所有会话共用一组工作线程，按会话轮流调度）"""
+
+    def __init__(self, max_workers: int = 4, max_finished: int = 256, max_pending: Optional[int] = None,
+                 max_per_owner: Optional[int] = None):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self.max_pending = max_pending
+        self.max_per_owner = max_per_owner
+        self._jobs: Dict[str, Job] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._by_key: Dict[str, str] = {}
+        # 所有提交者都已放弃、结束后不再保留的执行中任务
+        self._abandoned: set = set()
+        # 各会话的待执行任务，以及轮流调度的会话顺序
+        self._pending: Dict[Optional[str], Deque[_Task]] = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        self._workers: List[threading.Thread] = []
+
+    def submit(self, name: str, func: Callable[..., Any], *args, owner: Optional[str] = None,
+               key: Optional[str] = None, **kwargs) -> str:
+        """
+        提交任务 func(ctx, *args, **kwargs)，返回任务号
+        owner: 提交者（会话）标识，用于公平调度和按会话限流；key: 输入指纹，相同 key 的未结束任务直接共享
+        排队已满时抛出 QueueFull
+        """
+        with self._lock:
+            shared = self._jobs.get(self._by_key.get(key)) if key is not None else None
+            if shared is not None and not shared.done and not self._cancel_events[shared.job_id].is_set():
+                shared.subscribers += 1
+                return shared.job_id
+            self._admit(owner)
+            job_id = f"job-{next(self._ids)}"
+            job = Job(job_id, name, owner, key)
+            cancel_event = threading.Event()
+            self._jobs[job_id] = job
+            self._cancel_events[job_id] = cancel_event
+            if key is not None:
+                self._by_key[key] = job_id
+            # 在提交时的上下文中执行，任务产生的性能记录仍归入提交任务的会话
+            task = _Task(job, cancel_event, contextvars.copy_context(), func, args, kwargs)
+            self._pending.setdefault(owner, deque()).append(task)
+            self._prune()
+            self._start_worker()
+            self._cond.notify()
+        return job_id
+
+    def _admit(self, owner: Optional[str]) -> None:
+        if self.max_pending is not None and self.pending_count() >= self.max_pending:
+            raise QueueFull(f"当前排队任务已达上限（{self.max_pending}），请稍后重试")
+        if self.max_per_owner is not None and owner is not None:
+            # 已取消但仍在执行的任务同样占用工作线程，结束前照样计入
+            active = sum(1 for job in self._jobs.values() if job.owner == owner and not job.done)
+            if active >= self.max_per_owner:
+                raise QueueFull(f"当前会话未完成的任务已达上限（{self.max_per_owner}），请等待已提交的任务完成")
+
+    def _start_worker(self) -> None:
+        # 按需启动工作线程，最多 max_workers 个；线程常驻，空闲时等待新任务
+        if len(self._workers) < min(self.max_workers, self.pending_count() + self.running_count()):
+            worker = threading.Thread(target=self._work, name=f"tablegen-job-{len(self._workers) + 1}", daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _next_task(self) -> _Task:
+        """取出下一个任务：轮到的会话取其最早提交的任务，该会话随后排到末尾"""
+        owner, tasks = next(iter(self._pending.items()))
+        task = tasks.popleft()
+        del self._pending[owner]
+        if tasks:
+            self._pending[owner] = tasks
+        return task
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                task = self._next_task()
+                if task.cancel_event.is_set():
+                    continue
+                task.job.status = RUNNING
+            task.context.run(self._run, task)
+
+    def _run(self, task: _Task) -> None:
+        job, cancel_event = task.job, task.cancel_event
+        status = CANCELLED
+        try:
+            result = task.func(JobContext(job, cancel_event), *task.args, **task.kwargs)
+            # 取消后任务函数未再检查就返回了：丢弃结果，仍记为已取消
+            if not cancel_event.is_set():
+                job.result = result
+                job.progress = 1.0
+                status = DONE
+        except JobCancelled:
+            pass
+        except Exception as e:
+            if not cancel_event.is_set():
+                job.error = str(e)
+                status = ERROR
+        with self._lock:
+            # 先记录结束时间再更新状态，状态为已结束的任务总有结束时间
+            job.finished = time.time()
+            job.status = status
+            if self._by_key.get(job.key) == job.job_id:
+                del self._by_key[job.key]
+            if job.job_id in self._abandoned:
+                self._forget(job.job_id)
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """排队中的任务前面还有多少个待执行任务（按轮流调度的顺序估算），不在排队时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != PENDING:
+                return None
+            queues = [list(tasks) for tasks in self._pending.values()]
+            order = [task.job for row in itertools.zip_longest(*queues) for task in row if task is not None]
+            return next((i for i, queued in enumerate(order) if queued is job), None)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return sum(len(tasks) for tasks in self._pending.values())
+
+    def running_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        请求取消任务，返回任务是否存在且尚未结束
+        共享的任务只减少一个提交者，所有提交者都取消后才真正取消
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.subscribers -= 1
+            if job.subscribers > 0:
+                return True
+            self._cancel_events[job_id].set()
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+            tasks = self._pending.get(job.owner)
+            if job.status == PENDING and tasks is not None:
+                # 尚未开始执行，从队列中移除，不会再进入 _run
+                remaining = deque(task for task in tasks if task.job is not job)
+                if remaining:
+                    self._pending[job.owner] = remaining
+                else:
+                    del self._pending[job.owner]
+                job.finished = time.time()
+                job.status = CANCELLED
+        return True
+
+    def pop(self, job_id: str) -> Optional[Job]:
+        """取走已结束的任务（共享的任务在所有提交者都取走后不再保留）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.done:
+                return job
+            job.subscribers -= 1
+            if job.subscribers <= 0:
+                self._forget(job_id)
+            return job
+
+    def release(self, job_id: str) -> None:
+        """
+        提交者放弃任务、不再取走结果：未结束的任务按 cancel 处理，已结束的任务按 pop 处理
+        所有提交者都放弃后，任务（及其结果）在结束时即被丢弃，不等到 _prune
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if job.done:
+                self.pop(job_id)
+                return
+            self.cancel(job_id)
+            if job.subscribers > 0:
+                return
+            if job.done:
+                self._forget(job_id)
+            else:
+                self._abandoned.add(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _forget(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+        self._cancel_events.pop(job_id, None)
+        self._abandoned.discard(job_id)
+
+    def _prune(self) -> None:
+        # 会话关闭后无人取走的结果：已结束的任务超过上限时丢弃最早结束的
+        finished = [job for job in self._jobs.values() if job.done]
+        if len(finished) > self.max_finished:
+            finished.sort(key=lambda job: job.finished)
+            for job in finished[:len(finished) - self.max_finished]:
+                self._forget(job.job_id)
+
+
+job_queue = JobQueue(cfg.job_workers, cfg.job_max_finished, cfg.job_max_pending, cfg.job_max_per_session)
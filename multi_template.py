@@ -0,0 +1,94 @@
+"""
+多工作表 / 多模板批量填充
+- 每个上传的工作簿只解析一次（create_templates_from_workbook），得到其中全部工作表的模板
+- 同一份阶段性结果和自适应表格一次性填充全部模板：最终数据流只生成一遍（取所有模板中最多的可填充单元格数），
+  各模板按自身尺寸截取前缀，结果与逐个调用 process_to_final_result 一致
+- 全部填充结果写入同一个 xlsx 文件，每个模板一个工作表
+"""
+import io
+import re
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+import data_handler
+from data_handler import (
+    _block_fill,
+    _coerce_non_header_columns_to_string,
+    _fillable_cells,
+    _iter_column_values,
+    _take_final_values,
+    create_templates_from_workbook,
+    instrumented,
+)
+from exporter import write_workbook
+from sparse_template import SparseTable, Table
+
+# 工作表：(模板, 行数, 列数)
+SheetTemplate = Tuple[Table, int, int]
+
+_INVALID_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+def sheet_name(name: str, used: Iterable[str]) -> str:
+    """转换为合法且不重复的工作表名（去掉 Excel 不允许的字符，最长 31 个字符）"""
+    base = _INVALID_SHEET_CHARS.sub("_", str(name)).strip("'") or "Sheet"
+    used = {u.lower() for u in used}
+    candidate = base[:31]
+    n = 1
+    while candidate.lower() in used:
+        n += 1
+        suffix = f"_{n}"
+        candidate = base[:31 - len(suffix)] + suffix
+    return candidate
+
+
+def load_templates(uploaded_files: List, streaming: bool = True,
+                   sparse: bool = False) -> Tuple[Dict[str, SheetTemplate], List[str]]:
+    """
+    读取多个模板文件中的全部工作表，返回 ({工作表名: (模板, 行数, 列数)}, 错误信息列表)
+    多个文件时工作表名为 "文件名-工作表名"；空工作表跳过；sparse=True 时转换为稀疏模板
+    """
+    templates: Dict[str, SheetTemplate] = {}
+    errors = []
+    for uploaded_file in uploaded_files:
+        sheets, error = create_templates_from_workbook(uploaded_file, streaming=streaming)
+        if error:
+            errors.append(f"{uploaded_file.name}: {error}")
+            continue
+        for name, (template_df, rows, cols) in sheets.items():
+            if cols == 0:
+                continue
+            label = name if len(uploaded_files) == 1 else f"{uploaded_file.name.rsplit('.', 1)[0]}-{name}"
+            template = SparseTable.from_template(template_df) if sparse else template_df
+            templates[sheet_name(label, templates)] = (template, rows, cols)
+    return templates, errors
+
+
+@instrumented
+def fill_templates(df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str,
+                   templates: Dict[str, SheetTemplate]) -> Dict[str, Table]:
+    """用同一份阶段性结果和自适应表格填充全部模板，最终数据只生成一次"""
+    limit = max((_fillable_cells(t, rows, cols) for t, rows, cols in templates.values()), default=0)
+    stage_columns = ["token"] if "token" in df_stage.columns else []
+    values = chain(_iter_column_values(df_stage, stage_columns), _iter_column_values(df_adaptive))
+    processed_data = _take_final_values(values, final_param, limit)
+
+    pad = data_handler.cfg.placeholder
+    results = {}
+    for name, (template, rows, cols) in templates.items():
+        data = processed_data[:_fillable_cells(template, rows, cols)]
+        if isinstance(template, SparseTable):
+            results[name] = template.fill(data, rows, cols, pad=pad)
+        else:
+            results[name] = _block_fill(_coerce_non_header_columns_to_string(template), data, rows, cols, pad=pad)
+    return results
+
+
+def filled_workbook_bytes(df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str,
+                          templates: Dict[str, SheetTemplate], chunk_rows: Optional[int] = None) -> bytes:
+    """填充全部模板并写入同一个 xlsx 文件"""
+    buf = io.BytesIO()
+    write_workbook(fill_templates(df_stage, df_adaptive, final_param, templates), buf, chunk_rows)
+    return buf.getvalue()
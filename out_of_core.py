@@ -0,0 +1,173 @@
+"""
+超大模板的核外（out-of-core）填充
+模板有数百万行时，process_to_final_result 需要整张模板及其拷贝常驻内存。本模块改为直接处理磁盘上的模板文件：
+- 第一遍流式扫描模板，只取得表头、首行、行数和各列 dtype（与 create_template_from_upload 的推断规则一致）
+- 第二遍按行块只读取首列，每块从数据流中取出对应数量的最终数据，生成填充后的数据块并立即写入输出文件
+- 内存中只保留当前数据块；输出文件内容与 process_to_final_result 的结果导出后一致
+"""
+from dataclasses import dataclass
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import data_handler
+from data_handler import (
+    STRING_DTYPE,
+    _coerce_non_header_columns_to_string,
+    _common_dtype,
+    _convert_xlsx_cell,
+    _iter_column_values,
+    _iter_final_values,
+    _parse_xlsx_rows,
+    _scan_csv_template,
+    _scan_xlsx_sheet,
+    instrumented,
+)
+from exporter import write_frames
+from spreadsheet_io import open_workbook
+
+PathLike = Union[str, Path]
+
+
+@dataclass
+class TemplateLayout:
+    """模板文件的结构：列名、首行（第 1 列起，已转换为字符串）、首列 dtype 及行数"""
+    columns: pd.Index
+    head: List[Any]
+    first_dtype: Any
+    rows: int
+    sheet: Optional[str] = None
+
+    @property
+    def cols(self) -> int:
+        return len(self.columns)
+
+
+def _is_csv(path: PathLike) -> bool:
+    return str(path).endswith(".csv")
+
+
+def _layout(head: pd.DataFrame, first_dtype, rows: int, sheet: Optional[str] = None) -> TemplateLayout:
+    # 与 _assemble_template 相同：首行除首列外转换为字符串
+    head = _coerce_non_header_columns_to_string(head)
+    values = head.iloc[0, 1:].tolist() if rows > 0 else [pd.NA] * (len(head.columns) - 1)
+    return TemplateLayout(head.columns, values, first_dtype, rows, sheet)
+
+
+def scan_template(path: PathLike, sheet: Optional[str] = None) -> TemplateLayout:
+    """流式扫描模板文件（CSV 或 xlsx 的第一个 / 指定工作表），不保留首行以外的单元格"""
+    if _is_csv(path):
+        with open(path, "rb") as f:
+            head, common, rows = _scan_csv_template(f)
+        return _layout(head, common[0], rows)
+
+    with open_workbook(path) as wb:
+        ws = wb[sheet] if sheet is not None else wb.worksheets[0]
+        head, first_dtypes, rows = _scan_xlsx_sheet(ws)
+        title = ws.title
+    if head is None:
+        raise ValueError(f"模板工作表为空: {path}")
+    first_dtype = _common_dtype(first_dtypes) if first_dtypes else head.dtypes.iloc[0]
+    return _layout(head, first_dtype, rows, title)
+
+
+def _iter_xlsx_first_column(path: PathLike, layout: TemplateLayout, chunk_rows: int) -> Iterator[pd.Series]:
+    with open_workbook(path) as wb:
+        ws = wb[layout.sheet]
+        ws.reset_dimensions()
+        # 第 1 行为表头，数据行为第 2 行至第 rows + 1 行（末尾的全空行不计入模板）
+        cells = ws.iter_rows(min_row=2, max_row=layout.rows + 1, max_col=1, values_only=True)
+        # 整列为 object 时保留单元格原值（如整数不因同一块中的空值转为浮点数），与整列一次解析一致
+        dtype = object if layout.first_dtype == np.dtype(object) else None
+        while True:
+            block = [[_convert_xlsx_cell(row[0] if row else None)] for row in islice(cells, chunk_rows)]
+            if not block:
+                return
+            yield _parse_xlsx_rows(block, None, dtype).iloc[:, 0]
+
+
+def iter_first_column(path: PathLike, layout: TemplateLayout, chunk_rows: int) -> Iterator[pd.Series]:
+    """按块只读取模板首列，转换为扫描得到的 dtype（与整表读取一致）"""
+    if _is_csv(path):
+        blocks = pd.read_csv(path, usecols=[0], chunksize=chunk_rows)
+        blocks = (block.iloc[:, 0] for block in blocks)
+    else:
+        blocks = _iter_xlsx_first_column(path, layout, chunk_rows)
+    read = 0
+    for block in blocks:
+        block = block.astype(layout.first_dtype).reset_index(drop=True)
+        read += len(block)
+        yield block
+    if read < layout.rows:
+        # xlsx 只读模式可能不产出末尾的空行，首列补为空值
+        yield pd.Series([np.nan] * (layout.rows - read)).astype(layout.first_dtype)
+
+
+def iter_filled_frames(path: PathLike, values: Iterable[str], rows: Optional[int] = None,
+                       cols: Optional[int] = None, chunk_rows: Optional[int] = None,
+                       layout: Optional[TemplateLayout] = None) -> Iterator[pd.DataFrame]:
+    """
+    按行块产出填充后的模板：首行、首列保持不变，可填充区域（受 rows / cols 限制）按行优先顺序依次取 values，
+    不足部分为占位符；第一块为空表（只含表头和各列 dtype），便于写出表头
+    """
+    layout = layout or scan_template(path)
+    chunk_rows = chunk_rows or data_handler.cfg.export_chunk_rows
+    placeholder = data_handler.cfg.placeholder
+    n_rows = min(layout.rows if rows is None else rows, layout.rows)
+    n_cols = min(layout.cols if cols is None else cols, layout.cols)
+    width = max(0, n_cols - 1)
+    values = iter(values)
+
+    def frame(first_col: pd.Series, start: int) -> pd.DataFrame:
+        stop = start + len(first_col)
+        index = pd.RangeIndex(start, stop)
+        block = np.full((stop - start, layout.cols - 1), placeholder, dtype=object)
+        if start == 0 and stop > 0:
+            block[0] = layout.head
+        r0, r1 = max(start, 1), min(stop, n_rows)
+        if width and r0 < r1:
+            data = np.full((r1 - r0) * width, placeholder, dtype=object)
+            taken = list(islice(values, len(data)))
+            data[:len(taken)] = taken
+            block[r0 - start:r1 - start, :width] = data.reshape(r1 - r0, width)
+        data = {0: first_col.set_axis(index)}
+        for c in range(1, layout.cols):
+            data[c] = pd.array(block[:, c - 1], dtype=STRING_DTYPE)
+        df = pd.DataFrame(data, index=index)
+        df.columns = layout.columns
+        return df
+
+    yield frame(pd.Series([], dtype=layout.first_dtype), 0)
+    start = 0
+    for first_col in iter_first_column(path, layout, chunk_rows):
+        yield frame(first_col, start)
+        start += len(first_col)
+
+
+@instrumented
+def fill_template_file(template_path: PathLike, df_stage: pd.DataFrame, df_adaptive: pd.DataFrame,
+                       final_param: str, output: Union[PathLike, BinaryIO], fmt: Optional[str] = None,
+                       rows: Optional[int] = None, cols: Optional[int] = None,
+                       chunk_rows: Optional[int] = None) -> TemplateLayout:
+    """
+    核外版的 process_to_final_result：按块读取模板文件、填充并直接写入 output（路径或文件对象），
+    格式由 fmt 或输出文件扩展名决定（csv / csv.gz / xlsx / parquet）；返回模板结构
+    """
+    if fmt is None:
+        name = str(output)
+        fmt = next((f for f in ("csv.gz", "csv", "xlsx", "parquet") if name.endswith("." + f)), "csv")
+    layout = scan_template(template_path)
+    stage_columns = ["token"] if "token" in df_stage.columns else []
+    values = _iter_final_values(
+        chain(_iter_column_values(df_stage, stage_columns), _iter_column_values(df_adaptive)), final_param
+    )
+    frames = iter_filled_frames(template_path, values, rows, cols, chunk_rows, layout)
+    if isinstance(output, (str, Path)):
+        with open(output, "wb") as f:
+            write_frames(frames, f, fmt)
+    else:
+        write_frames(frames, output, fmt)
+    return layout
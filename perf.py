@@ -0,0 +1,130 @@
+"""
+轻量性能埋点
+- instrumented 装饰器记录每次调用的耗时、结果行列数、输入行数，以及（可选）内存分配量
+- 每条记录以结构化 JSON 日志输出（logger: tablegen.perf），并追加到当前绑定的收集器中
+- 未启用时装饰器只做一次布尔判断后直接调用原函数，几乎没有额外开销
+- tracemalloc 作用于整个进程：同一时刻只有一个调用（多个会话 / 后台任务线程中的最外层调用之一）统计内存，
+  其余并发调用的 alloc_bytes 记为 None，避免互相重置峰值或中途停止对方的统计
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+
+import pandas as pd
+
+from config import Config
+
+cfg = Config()
+logger = logging.getLogger("tablegen.perf")
+
+
+class _PerfState:
+    enabled: bool = cfg.perf_enabled or os.environ.get("TABLEGEN_PERF", "") not in ("", "0")
+    trace_memory: bool = cfg.perf_trace_memory
+
+
+_state = _PerfState()
+_local = threading.local()
+_collector: ContextVar[Optional[Any]] = ContextVar("perf_collector", default=None)
+# 持有者独占 tracemalloc（开始 / 重置峰值 / 停止），其他线程不等待，直接跳过内存统计
+_trace_slot = threading.Lock()
+
+
+def configure(enabled: Optional[bool] = None, trace_memory: Optional[bool] = None) -> None:
+    """开启 / 关闭埋点；trace_memory 为 True 时使用 tracemalloc 统计分配字节数（开销较大）"""
+    if enabled is not None:
+        _state.enabled = enabled
+    if trace_memory is not None:
+        _state.trace_memory = trace_memory
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+def bind_collector(records) -> None:
+    """将当前上下文（如一次 Streamlit 脚本运行）产生的记录追加到 records（list 或 deque）"""
+    _collector.set(records)
+
+
+def _shape(value: Any) -> Optional[pd.DataFrame]:
+    """从返回值中取出表格（create_template_from_upload 返回元组；稀疏表格带有二维 shape）"""
+    if isinstance(value, pd.DataFrame) or len(getattr(value, "shape", ())) == 2:
+        return value
+    if isinstance(value, tuple) and value and isinstance(value[0], pd.DataFrame):
+        return value[0]
+    return None
+
+
+def _input_rows(args, kwargs) -> Optional[int]:
+    for value in list(args) + list(kwargs.values()):
+        if isinstance(value, pd.DataFrame):
+            return len(value)
+    return None
+
+
+def _emit(record: Dict[str, Any]) -> None:
+    logger.info(json.dumps(record, ensure_ascii=False))
+    records = _collector.get()
+    if records is not None:
+        records.append(record)
+
+
+def instrumented(func: Callable) -> Callable:
+    """为 data_handler 入口函数添加性能埋点"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return func(*args, **kwargs)
+
+        # 嵌套调用（如流式模式内部生成自适应表格）只有最外层统计内存
+        depth = getattr(_local, "depth", 0)
+        trace = _state.trace_memory and depth == 0 and _trace_slot.acquire(blocking=False)
+        started_tracing = False
+        if trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            mem_before = tracemalloc.get_traced_memory()[0]
+
+        _local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            wall_ms = (time.perf_counter() - start) * 1000
+            _local.depth = depth
+            alloc_bytes = None
+            if trace:
+                alloc_bytes = tracemalloc.get_traced_memory()[1] - mem_before
+                if started_tracing:
+                    tracemalloc.stop()
+                _trace_slot.release()
+
+        df = _shape(result)
+        _emit({
+            "stage": func.__name__,
+            "wall_ms": round(wall_ms, 3),
+            "rows": None if df is None else int(df.shape[0]),
+            "cols": None if df is None else int(df.shape[1]),
+            "input_rows": _input_rows(args, kwargs),
+            "alloc_bytes": alloc_bytes,
+            "depth": depth,
+        })
+        return result
+
+    return wrapper
+
+
+def records_frame(records) -> pd.DataFrame:
+    """将记录转换为便于展示的表格"""
+    columns = ["stage", "wall_ms", "rows", "cols", "input_rows", "alloc_bytes", "depth"]
+    return pd.DataFrame(list(records), columns=columns)
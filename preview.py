@@ -0,0 +1,57 @@
+"""
+大表分页预览
+只把当前页的行发送给浏览器；同一结果同一页的切片（已转换为 Arrow 表）在进程内缓存，
+页面上多处展示同一结果时直接复用，不重复切片和转换
+"""
+import math
+from typing import Any
+
+import pandas as pd
+
+from config import Config
+from result_cache import ResultCache
+from sparse_template import Table, row_slice
+
+cfg = Config()
+
+preview_cache = ResultCache(cfg.preview_cache_max_entries, cfg.preview_cache_max_bytes)
+
+
+def page_count(n_rows: int, page_size: int) -> int:
+    """总页数（空表也算 1 页）"""
+    return max(1, math.ceil(n_rows / page_size))
+
+
+def page_slice(df: Table, page: int, page_size: int) -> pd.DataFrame:
+    """取第 page 页（从 1 开始）的行，保留原行号；页码越界时取最近的有效页（稀疏表格只生成该页的行）"""
+    page = min(max(1, page), page_count(len(df), page_size))
+    start = (page - 1) * page_size
+    return row_slice(df, start, start + page_size)
+
+
+def _to_display_table(df: pd.DataFrame) -> Any:
+    """
+    转换为 Arrow 表（行号按 pandas 元数据保留，与 Streamlit 内部转换方式一致），未安装 pyarrow 时返回 DataFrame
+    混合类型的 object 列（如上传模板首列为 [1, "行二", 3.5]）无法直接转换，与 Streamlit 一样转为字符串后显示
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return df
+    # Arrow 要求列名为字符串
+    df = df.set_axis([str(col) for col in df.columns], axis=1)
+    try:
+        return pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy(deep=False)
+        for c in range(df.shape[1]):
+            if df.dtypes.iloc[c] == object:
+                df.isetitem(c, df.iloc[:, c].astype("string"))
+        return pa.Table.from_pandas(df)
+
+
+def cached_page_table(result_key: str, df: Table, page: int, page_size: int) -> Any:
+    """按 (结果指纹, 页码, 每页行数) 缓存当前页的展示表"""
+    page = min(max(1, page), page_count(len(df), page_size))
+    key = f"{result_key}:{page}:{page_size}"
+    return preview_cache.get_or_compute(key, lambda: _to_display_table(page_slice(df, page, page_size)))
@@ -0,0 +1,236 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import data_handler
+from adaptive_strategies import strategy_options_key
+from config import Config
+from data_handler import (
+    generate_intermediate_result,
+    generate_adaptive_table_by_option,
+    make_blank_template,
+    create_template_from_upload,
+)
+from sparse_template import SparseTable, Table, final_result, sparse_blank_template, to_dense
+from template_store import template_store
+
+cfg = Config()
+
+
+def fingerprint(*parts: Any) -> str:
+    """
+    计算内容指纹：对各部分依次做带长度前缀的哈希，字符串按 UTF-8 编码，bytes 原样使用，其余对象使用 repr
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode("utf-8")
+        else:
+            data = repr(part).encode("utf-8")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def _estimate_bytes(value: Any) -> int:
+    """估算缓存条目占用的内存字节数"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_estimate_bytes(item) for item in value)
+    # 分块缓存中的 token 列表、计数和 object 数组：容器本身加上其中的字符串
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(_estimate_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(key) for key in value)
+    if isinstance(value, np.ndarray) and value.dtype == object:
+        return value.nbytes + sum(sys.getsizeof(item) for item in value)
+    # pyarrow.Table 等带 nbytes 属性的对象
+    return int(getattr(value, "nbytes", 0))
+
+
+class ResultCache:
+    """
+    进程内共享的 LRU 结果缓存（同一进程内的所有 Streamlit 会话共用）
+    - 以内容指纹为键，同时受条目数上限和字节预算限制，超出时淘汰最久未使用的条目
+    - 记录命中 / 未命中 / 淘汰次数
+    - 缓存的 DataFrame 为共享对象，调用方不得原地修改
+    """
+
+    def __init__(self, max_entries: int = 64, max_bytes: int = 512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        """取出缓存值，未命中时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # 计算在锁外进行，避免阻塞其他会话
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        size = _estimate_bytes(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+pipeline_cache = ResultCache(cfg.cache_max_entries, cfg.cache_max_bytes)
+
+
+def _cached(key: str, compute: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    if not cfg.cache_enabled:
+        return compute()
+    return pipeline_cache.get_or_compute(key, compute)
+
+
+def template_fingerprint_from_upload(uploaded_file) -> str:
+    """按上传文件的名称和内容计算模板指纹（分块读取，不复制整个文件）"""
+    h = hashlib.blake2b(digest_size=16)
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(1024 * 1024), b""):
+        h.update(block)
+    uploaded_file.seek(0)
+    return fingerprint("upload", uploaded_file.name, h.digest())
+
+
+def _stored_template_key(store_key: str, placeholder: str) -> str:
+    return fingerprint("template", store_key, placeholder)
+
+
+def cached_template_from_upload(uploaded_file, streaming: bool = False,
+                                store_key: Optional[str] = None) -> Tuple[str, tuple]:
+    """
+    返回 (模板指纹, create_template_from_upload 的结果元组)
+    启用模板存储时，解析结果按上传内容指纹（store_key，未提供时现算）持久化，其他会话 / 进程直接映射加载
+    """
+    store_key = store_key or template_fingerprint_from_upload(uploaded_file)
+    placeholder = data_handler.cfg.placeholder
+    if cfg.template_store_enabled:
+        compute = lambda: template_store.load_or_ingest(store_key, uploaded_file, streaming, placeholder)
+    else:
+        compute = lambda: create_template_from_upload(uploaded_file, streaming=streaming)
+    key = _stored_template_key(store_key, placeholder)
+    return key, _cached(key, compute)
+
+
+def cached_stored_template(store_key: str) -> Tuple[str, Optional[pd.DataFrame]]:
+    """按上传内容指纹从模板存储取回模板，返回 (模板指纹, 模板表格)；存储中没有时模板为 None"""
+    placeholder = data_handler.cfg.placeholder
+    key = _stored_template_key(store_key, placeholder)
+    if not cfg.template_store_enabled:
+        return key, None
+
+    def load():
+        template_df = template_store.load(store_key, placeholder)
+        if template_df is None:
+            raise KeyError(store_key)
+        return template_df, template_df.shape[0], template_df.shape[1], None
+
+    # 与上传时共用同一缓存键；加载失败时不缓存。缓存命中时也记录使用，存储不会先于缓存淘汰仍在用的模板
+    try:
+        template_df = _cached(key, load)[0]
+    except KeyError:
+        return key, None
+    template_store.touch(store_key)
+    return key, template_df
+
+
+def cached_blank_template(rows: int, cols: int, placeholder: str, sparse: bool = False) -> Tuple[str, Table]:
+    """返回 (模板指纹, 默认空白模板)，sparse=True 时为稀疏模板"""
+    if sparse:
+        key = fingerprint("blank-sparse", rows, cols, placeholder)
+        return key, _cached(key, lambda: sparse_blank_template(rows, cols, placeholder))
+    key = fingerprint("blank", rows, cols, placeholder)
+    return key, _cached(key, lambda: make_blank_template(rows, cols, placeholder))
+
+
+def cached_sparse_template(template_key: str, template_df: Table) -> Tuple[str, SparseTable]:
+    """返回 (稀疏模板指纹, 稀疏模板)：由模板表格取出表头、首行和首列（紧凑存储的模板只在未命中缓存时转换）"""
+    key = fingerprint("sparse", template_key, data_handler.cfg.placeholder)
+    return key, _cached(key, lambda: SparseTable.from_template(to_dense(template_df)))
+
+
+def cached_intermediate_result(text1: str, text2: str, text3: str, text4: str, text5: str) -> Tuple[str, pd.DataFrame]:
+    """返回 (阶段性结果指纹, 阶段性结果)，指纹由五段文本及分词 / 抽取配置决定"""
+    dh_cfg = data_handler.cfg
+    key = fingerprint("stage", text1, text2, text3, text4, text5, dh_cfg.tokenizer, dh_cfg.extractors)
+    return key, _cached(key, lambda: generate_intermediate_result(text1, text2, text3, text4, text5))
+
+
+def cached_adaptive_table(stage_key: str, df_stage: pd.DataFrame, selected_option: str) -> Tuple[str, pd.DataFrame]:
+    """返回 (自适应表格指纹, 自适应表格)，指纹由阶段性结果指纹、选项及策略配置（统计参数、排序设置）决定"""
+    dh_cfg = data_handler.cfg
+    key = fingerprint("adaptive", stage_key, selected_option, *strategy_options_key(dh_cfg))
+    return key, _cached(key, lambda: generate_adaptive_table_by_option(df_stage, selected_option))
+
+
+def cached_final_result(adaptive_key: str, df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str,
+                        template_key: str, df_template: Table, rows: int, cols: int) -> Tuple[str, Table]:
+    """
+    返回 (最终结果指纹, 最终结果)，指纹由自适应表格指纹、最终参数、模板指纹及尺寸决定
+    模板为稀疏模板时结果也是稀疏的
+    """
+    key = fingerprint("final", adaptive_key, final_param, template_key, rows, cols, data_handler.cfg.placeholder)
+    return key, _cached(
+        key, lambda: final_result(df_stage, df_adaptive, final_param, df_template, rows, cols)
+    )
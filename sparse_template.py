@@ -0,0 +1,151 @@
+"""
+稀疏模板表示
+模板中除表头、首行、首列外都是占位符，填充结果也只有开头一段是数据。SparseTable 只保存：
+- 表头（列名）、首列、首行（第 1 列起）
+- 按行优先顺序填入的数据（只保存实际填入的部分），以及可填充区域的边界
+其余单元格隐含为占位符（可填充区域内数据不足的部分为 pad），只在预览、导出时按需生成对应行的 DataFrame
+"""
+from itertools import chain
+from typing import Iterator, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+import data_handler
+from data_handler import (
+    STRING_DTYPE,
+    _fill_bounds,
+    _fillable_cells,
+    _iter_column_values,
+    _take_final_values,
+    instrumented,
+)
+
+
+class SparseTable:
+    """表头 + 首列 + 首行 + 已填充区域，其余单元格为隐含的占位符"""
+
+    def __init__(self, columns: Sequence, first_col: pd.Series, head: Sequence, placeholder: str,
+                 values: Optional[np.ndarray] = None, fill_rows: int = 0, fill_cols: int = 0,
+                 pad: Optional[str] = None):
+        self.columns = pd.Index(columns) if not isinstance(columns, pd.Index) else columns
+        self.first_col = first_col.reset_index(drop=True)
+        self.head = np.asarray(head, dtype=object)
+        self.placeholder = placeholder
+        # 可填充区域为第 1 行至 fill_rows - 1 行、第 1 列至 fill_cols - 1 列，按行优先顺序填入 values，其后为 pad
+        self.values = np.empty(0, dtype=object) if values is None else values
+        self.fill_rows = fill_rows
+        self.fill_cols = fill_cols
+        self.pad = placeholder if pad is None else pad
+
+    @classmethod
+    def from_template(cls, template_df: pd.DataFrame, placeholder: Optional[str] = None) -> "SparseTable":
+        """由模板表格（非首行首列均为占位符，如 make_blank_template / create_template_from_upload 的结果）构造"""
+        placeholder = data_handler.cfg.placeholder if placeholder is None else placeholder
+        head = template_df.iloc[0, 1:].tolist() if len(template_df) else [None] * (template_df.shape[1] - 1)
+        first_col = template_df.iloc[:, 0] if template_df.shape[1] else pd.Series([], dtype=object)
+        return cls(template_df.columns, first_col, head, placeholder)
+
+    def __len__(self) -> int:
+        return len(self.first_col)
+
+    @property
+    def shape(self):
+        return len(self), len(self.columns)
+
+    @property
+    def nbytes(self) -> int:
+        """估算占用的内存（仅首列、首行和已填入的数据）"""
+        strings = sum(len(str(v)) for v in self.values)
+        return int(self.first_col.memory_usage(deep=True) + self.head.nbytes + self.values.nbytes + strings)
+
+    def fill(self, values: Sequence[str], rows: Optional[int] = None, cols: Optional[int] = None,
+             pad: Optional[str] = None) -> "SparseTable":
+        """按行优先顺序填充可填充区域，语义同 data_handler._block_fill，返回新的 SparseTable"""
+        n_rows, n_cols = _fill_bounds(self, rows, cols)
+        size = max(0, n_rows - 1) * max(0, n_cols - 1)
+        data = np.asarray(values, dtype=object)[:size]
+        if len(data) < size and pad is None:
+            raise ValueError(f"填充值数量不足: 需要{size}, 实际{len(data)}")
+        return SparseTable(self.columns, self.first_col, self.head, self.placeholder,
+                           data, n_rows, n_cols, pad)
+
+    def _column(self, c: int, start: int, stop: int) -> pd.api.extensions.ExtensionArray:
+        column = np.full(stop - start, self.placeholder, dtype=object)
+        if start == 0 and stop > 0:
+            column[0] = self.head[c - 1]
+        r0, r1 = max(start, 1), min(stop, self.fill_rows)
+        if c < self.fill_cols and r0 < r1:
+            cells = (np.arange(r0, r1) - 1) * (self.fill_cols - 1) + (c - 1)
+            block = np.full(r1 - r0, self.pad, dtype=object)
+            mask = cells < len(self.values)
+            block[mask] = self.values[cells[mask]]
+            column[r0 - start:r1 - start] = block
+        return pd.array(column, dtype=STRING_DTYPE)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        """生成第 start 至 stop - 1 行的 DataFrame（保留原行号），与完整表格的 iloc[start:stop] 一致"""
+        start, stop = min(max(0, start), len(self)), min(max(0, stop), len(self))
+        stop = max(start, stop)
+        index = pd.RangeIndex(start, stop)
+        data = {}
+        if len(self.columns):
+            data[0] = self.first_col.iloc[start:stop].set_axis(index)
+        for c in range(1, len(self.columns)):
+            data[c] = self._column(c, start, stop)
+        df = pd.DataFrame(data, index=index)
+        df.columns = self.columns
+        return df
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.slice(0, len(self))
+
+    def iter_frames(self, chunk_rows: int) -> Iterator[pd.DataFrame]:
+        for start in range(0, len(self), chunk_rows):
+            yield self.slice(start, start + chunk_rows)
+
+
+Table = Union[pd.DataFrame, SparseTable]
+
+
+def row_slice(table: Table, start: int, stop: int) -> pd.DataFrame:
+    """
+    取第 start 至 stop - 1 行，稠密表格和稀疏表格通用（稀疏表格只生成这些行）
+    其他提供 slice / to_frame 的表格（如 compact.CompactTable）同样适用
+    """
+    if isinstance(table, pd.DataFrame):
+        return table.iloc[start:stop]
+    return table.slice(start, stop)
+
+
+def to_dense(table: Table) -> pd.DataFrame:
+    return table if isinstance(table, pd.DataFrame) else table.to_frame()
+
+
+def sparse_blank_template(rows: int, cols: int, placeholder: Optional[str] = None) -> SparseTable:
+    """与 make_blank_template 内容一致的稀疏模板"""
+    placeholder = data_handler.cfg.placeholder if placeholder is None else placeholder
+    rows, cols = max(1, rows), max(1, cols)
+    first_col = pd.Series(np.full(rows, np.nan, dtype=object))
+    return SparseTable(pd.RangeIndex(cols), first_col, [pd.NA] * (cols - 1), placeholder)
+
+
+@instrumented
+def sparse_final_result(df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str,
+                        template: SparseTable, rows: int, cols: int) -> SparseTable:
+    """稀疏版的 process_to_final_result：只保存实际填入的数据，不为其余单元格写入占位符"""
+    stage_columns = ["token"] if "token" in df_stage.columns else []
+    values = chain(_iter_column_values(df_stage, stage_columns), _iter_column_values(df_adaptive))
+    processed_data = _take_final_values(values, final_param, _fillable_cells(template, rows, cols))
+    return template.fill(processed_data, rows, cols, pad=data_handler.cfg.placeholder)
+
+
+def final_result(df_stage: pd.DataFrame, df_adaptive: pd.DataFrame, final_param: str, template: Table,
+                 rows: int, cols: int) -> Table:
+    """
+    按模板类型生成最终结果：稀疏模板得到稀疏结果，其他模板（含紧凑存储的模板）转换为 DataFrame
+    后使用 process_to_final_result
+    """
+    if isinstance(template, SparseTable):
+        return sparse_final_result(df_stage, df_adaptive, final_param, template, rows, cols)
+    return data_handler.process_to_final_result(df_stage, df_adaptive, final_param, to_dense(template), rows, cols)
@@ -0,0 +1,150 @@
+"""
+xlsx 读写引擎
+- 整表读取（read_excel）按 Config.excel_read_engine 选择引擎：auto 时优先使用 calamine（python-calamine，
+  Rust 实现，大工作表的解析速度为 openpyxl 的数倍），未安装时使用 openpyxl；解析结果与 pd.read_excel 一致
+- 逐块写出（write_sheets）按 Config.excel_write_engine 选择引擎：auto 时优先使用 xlsxwriter（constant_memory 模式，
+  逐行写入临时文件），未安装时使用 openpyxl 只写模式；两者都只在内存中保留当前数据块，不构建整张工作表
+- 流式读取（open_workbook）使用 openpyxl 只读模式逐行读取；calamine 需要把整个工作表载入内存，不适合超大模板
+- calamine 与 xlsxwriter 均为可选依赖；显式指定未安装的引擎时抛出 ImportError
+"""
+import importlib.util
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+cfg = Config()
+
+
+@lru_cache(maxsize=None)
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def _cell_value(value):
+    """写出前转换单元格值：缺失值为空单元格，NumPy 标量转为 Python 标量（各引擎写出的类型一致）"""
+    if value is pd.NA or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        value = value.item()
+        return None if isinstance(value, float) and value != value else value
+    return value
+
+
+def _sheet_rows(frames: Iterable[pd.DataFrame]) -> Iterator[List[Any]]:
+    """依次产出表头（取第一块的列名）和各数据块的行"""
+    for i, frame in enumerate(frames):
+        if i == 0:
+            yield [str(col) for col in frame.columns]
+        for row in frame.itertuples(index=False, name=None):
+            yield [_cell_value(v) for v in row]
+
+
+def _write_openpyxl(sheets: Dict[str, Iterable[pd.DataFrame]], fileobj: BinaryIO) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    for sheet_name, frames in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+        for values in _sheet_rows(frames):
+            ws.append(values)
+    wb.save(fileobj)
+
+
+def _write_xlsxwriter(sheets: Dict[str, Iterable[pd.DataFrame]], fileobj: BinaryIO) -> None:
+    import xlsxwriter
+
+    # 与 openpyxl 一致：字符串不自动转换为超链接，日期时间使用相同的显示格式
+    wb = xlsxwriter.Workbook(fileobj, {
+        "constant_memory": True,
+        "strings_to_urls": False,
+        "default_date_format": "yyyy-mm-dd h:mm:ss",
+    })
+    try:
+        for sheet_name, frames in sheets.items():
+            ws = wb.add_worksheet(sheet_name)
+            for r, values in enumerate(_sheet_rows(frames)):
+                ws.write_row(r, 0, values)
+    finally:
+        wb.close()
+
+
+# 引擎名 → 需要安装的模块（按 auto 时的优先顺序）
+READ_ENGINES: Dict[str, str] = {
+    "calamine": "python_calamine",
+    "openpyxl": "openpyxl",
+}
+
+# 引擎名 → (需要安装的模块, 写出函数)
+WRITE_ENGINES: Dict[str, tuple] = {
+    "xlsxwriter": ("xlsxwriter", _write_xlsxwriter),
+    "openpyxl": ("openpyxl", _write_openpyxl),
+}
+
+
+def _module(engines: Dict[str, Any], name: str) -> str:
+    entry = engines[name]
+    return entry[0] if isinstance(entry, tuple) else entry
+
+
+def _resolve(engine: str, engines: Dict[str, Any], kind: str) -> str:
+    if engine == "auto":
+        for name in engines:
+            if _installed(_module(engines, name)):
+                return name
+        raise ImportError(f"{kind} xlsx 需要安装 {' 或 '.join(_module(engines, name) for name in engines)}")
+    if engine not in engines:
+        raise ValueError(f"不支持的 xlsx {kind}引擎: {engine}")
+    if not _installed(_module(engines, engine)):
+        raise ImportError(f"xlsx {kind}引擎 {engine} 需要安装 {_module(engines, engine)}")
+    return engine
+
+
+def available_read_engines() -> List[str]:
+    return [name for name in READ_ENGINES if _installed(_module(READ_ENGINES, name))]
+
+
+def available_write_engines() -> List[str]:
+    return [name for name in WRITE_ENGINES if _installed(_module(WRITE_ENGINES, name))]
+
+
+def read_engine(engine: Optional[str] = None) -> str:
+    """实际使用的读取引擎（engine 缺省时取 Config.excel_read_engine）"""
+    return _resolve(engine or cfg.excel_read_engine, READ_ENGINES, "读取")
+
+
+def write_engine(engine: Optional[str] = None) -> str:
+    """实际使用的写出引擎（engine 缺省时取 Config.excel_write_engine）"""
+    return _resolve(engine or cfg.excel_write_engine, WRITE_ENGINES, "写出")
+
+
+def read_excel(source, sheet_name=0, engine: Optional[str] = None, **kwargs):
+    """整表读取 xlsx，参数与返回值同 pd.read_excel（sheet_name=None 时返回 {工作表名: DataFrame}）"""
+    return pd.read_excel(source, sheet_name=sheet_name, engine=read_engine(engine), **kwargs)
+
+
+def write_sheets(sheets: Dict[str, Iterable[pd.DataFrame]], fileobj: BinaryIO, engine: Optional[str] = None) -> None:
+    """
+    将多个工作表写入同一个 xlsx 文件（按字典顺序），每个工作表为依次产生的数据块（列相同，第一块提供表头）
+    只在内存中保留当前数据块
+    """
+    writer: Callable[[Dict[str, Iterable[pd.DataFrame]], BinaryIO], None] = WRITE_ENGINES[write_engine(engine)][1]
+    writer(sheets, fileobj)
+
+
+@contextmanager
+def open_workbook(source):
+    """以 openpyxl 只读模式打开工作簿（逐行流式读取，不整表载入内存），退出时关闭"""
+    from openpyxl import load_workbook
+
+    if hasattr(source, "seek"):
+        source.seek(0)
+    wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+    try:
+        yield wb
+    finally:
+        wb.close()
@@ -0,0 +1,195 @@
+"""
+服务端模板存储
+- 上传模板解析后，仅持久化表头、首行、首列和尺寸（其余单元格都是占位符），以 Arrow IPC 文件保存，按内容指纹命名
+- 加载时以内存映射方式打开文件；占位符列共用同一段只读的 Arrow 缓冲区，不再为每列、每个会话各存一份
+- 同一台机器上的多个进程（Streamlit 会话、批量运行的工作进程）上传 / 使用相同模板时直接复用存储，无需重新解析
+- 未安装 pyarrow 或模板无法无损保存（如首列混合类型）时不落盘，调用方照常使用解析结果
+- 存储受文件数和字节数上限约束：写入新模板后按最近使用时间（文件 mtime，加载及缓存命中时更新）
+  删除最久未用的模板，与进程内结果缓存一样按 LRU 淘汰；同时清理写入中断遗留的临时文件
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from data_handler import STRING_DTYPE, create_template_from_upload
+
+cfg = Config()
+
+_META_KEY = b"tablegen_template"
+
+
+class TemplateStore:
+    """以内容指纹为键的模板存储，每个模板一个 <key>.arrow 文件"""
+
+    # 超过该时间（秒）仍未完成替换的临时文件视为写入中断遗留
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self, root: Optional[str] = None, max_files: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.root = Path(root or os.path.join(tempfile.gettempdir(), "tablegen_templates"))
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.arrow"
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def touch(self, key: str) -> None:
+        """记录模板被使用（更新 mtime），淘汰时最近用过的模板最后删除"""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        超出文件数 / 字节数上限时删除最久未用的模板（keep 除外），返回删除的个数
+        已映射该文件的进程不受影响；之后再使用需重新上传（load_or_ingest 会重新解析并写入）
+        """
+        now = time.time()
+        entries = []
+        try:
+            paths = list(self.root.iterdir())
+        except FileNotFoundError:
+            return 0
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".tmp":
+                if now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                    _unlink(path)
+            elif path.suffix == ".arrow":
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        keep_path = self._path(keep) if keep is not None else None
+        count, total = len(entries), sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            over_files = self.max_files is not None and count > self.max_files
+            over_bytes = self.max_bytes is not None and total > self.max_bytes
+            if not (over_files or over_bytes):
+                break
+            if path == keep_path:
+                continue
+            if _unlink(path):
+                count -= 1
+                total -= size
+                removed += 1
+        return removed
+
+    def save(self, key: str, template_df: pd.DataFrame) -> bool:
+        """持久化模板的表头、首行、首列和尺寸，返回是否保存成功"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return False
+        rows, cols = template_df.shape
+        if cols == 0:
+            return False
+        columns = list(template_df.columns)
+        head = [None if pd.isna(v) else str(v) for v in template_df.iloc[0, 1:]] if rows else [None] * (cols - 1)
+        first_col = template_df.iloc[:, 0]
+        meta = {"columns": columns, "head": head, "rows": rows, "first_dtype": str(first_col.dtype)}
+        try:
+            encoded = json.dumps(meta, ensure_ascii=False)
+            if json.loads(encoded)["columns"] != columns:
+                return False
+            table = pa.table({"first": pa.array(first_col, from_pandas=True)})
+        except (TypeError, ValueError, pa.ArrowException):
+            return False
+        table = table.replace_schema_metadata({_META_KEY: encoded.encode("utf-8")})
+
+        # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+                os.replace(tmp, self._path(key))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            self.evict(keep=key)
+        return True
+
+    def load(self, key: str, placeholder: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """内存映射读取模板并组装为模板表格；不存在、无法读取或与当前环境不兼容时返回 None"""
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return None
+        placeholder = cfg.placeholder if placeholder is None else placeholder
+        try:
+            # 读出的列直接引用映射区域，映射在列被释放前保持有效
+            table = pa.ipc.open_file(pa.memory_map(str(self._path(key)), "r")).read_all()
+        except (FileNotFoundError, pa.ArrowException):
+            return None
+        self.touch(key)
+        meta = json.loads(table.schema.metadata[_META_KEY])
+
+        first_col = table.column(0).to_pandas()
+        if str(first_col.dtype) != meta["first_dtype"]:
+            return None
+        if first_col.dtype == object:
+            # Arrow 的空值读回为 None，还原为 pandas 读取时的 NaN
+            first_col = first_col.where(first_col.notna(), np.nan)
+
+        rows = meta["rows"]
+        data = {0: first_col}
+        if STRING_DTYPE.storage == "pyarrow" and rows > 0:
+            # 各列只有首行不同，第 2 行起共用同一段占位符缓冲区
+            fill = pa.repeat(pa.scalar(placeholder, pa.large_string()), rows - 1)
+            for c, value in enumerate(meta["head"], start=1):
+                chunks = [pa.array([value], pa.large_string()), fill]
+                data[c] = pd.arrays.ArrowStringArray(pa.chunked_array(chunks, pa.large_string()))
+        else:
+            for c, value in enumerate(meta["head"], start=1):
+                column = np.full(rows, placeholder, dtype=object)
+                if rows > 0:
+                    column[0] = value
+                data[c] = pd.array(column, dtype=STRING_DTYPE)
+        template_df = pd.DataFrame(data)
+        template_df.columns = meta["columns"]
+        return template_df
+
+    def load_or_ingest(self, key: str, uploaded_file, streaming: bool = False,
+                       placeholder: Optional[str] = None) -> Tuple[Optional[pd.DataFrame], int, int, Optional[str]]:
+        """
+        优先从存储加载模板，未命中时解析上传文件并写入存储
+        返回值与 create_template_from_upload 相同: (template_df, rows, cols, error_message)
+        """
+        template_df = self.load(key, placeholder)
+        if template_df is None:
+            template_df, rows, cols, error = create_template_from_upload(uploaded_file, streaming=streaming)
+            if template_df is None or not self.save(key, template_df):
+                return template_df, rows, cols, error
+            # 改用映射加载的版本，占位符列不再各占一份内存
+            stored = self.load(key, placeholder)
+            if stored is not None:
+                template_df = stored
+        return template_df, template_df.shape[0], template_df.shape[1], None
+
+
+def _unlink(path: Path) -> bool:
+    # 其他进程可能已删除该文件；Windows 上正在映射的文件无法删除，留待下次淘汰
+    try:
+        path.unlink()
+        return True
+    except OSError:
+        return False
+
+
+template_store = TemplateStore(cfg.template_store_dir, cfg.template_store_max_files, cfg.template_store_max_bytes)
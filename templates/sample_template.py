@@ -25,7 +25,8 @@ def create_sample_xlsx():
     
     # 保存为XLSX文件
     output_path = 'templates/sample_template.xlsx'
-    df.to_excel(output_path, index=False, engine='openpyxl')
+    # 不指定引擎：已安装 xlsxwriter 时由 pandas 优先使用，否则使用 openpyxl
+    df.to_excel(output_path, index=False)
     
     print(f"✅ 示例XLSX模板已创建: {output_path}")
     print(f"   表格尺寸: {len(df)}行 × {len(df.columns)}列")
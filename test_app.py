@@ -2,9 +2,15 @@
 """
 测试脚本 - 验证应用核心功能
 """
+import io
 import pandas as pd
 from config import Config
-from data_handler import fill_table, create_template_from_upload
+from data_handler import (
+    STRING_DTYPE, _coerce_non_header_columns_to_string,
+    fill_table, create_template_from_upload, make_blank_template, _block_fill,
+    generate_intermediate_result, generate_adaptive_table_by_option, count_token_frequencies,
+    process_to_final_result, stream_final_result
+)
 
 def test_config():
     """测试配置类"""
@@ -88,6 +94,1099 @@ def test_new_fill_logic():
     
     print("   ✓ 新填充逻辑测试通过")
 
+def test_block_fill_engine():
+    """测试块填充引擎（与逐单元格填充结果一致）"""
+    print("\n5. 测试块填充引擎...")
+    
+    template = make_blank_template(6, 5, "占位")
+    values = [f"v{i}" for i in range(6)]
+    result_df = _block_fill(template, values, 4, 4, pad="空")
+    
+    # 逐单元格参考实现
+    expected = template.copy()
+    idx = 0
+    for r in range(1, 4):
+        for c in range(1, 4):
+            expected.iloc[r, c] = values[idx] if idx < len(values) else "空"
+            idx += 1
+    
+    print(f"   块填充结果:\n{result_df}")
+    pd.testing.assert_frame_equal(result_df, expected)
+    assert template.iloc[1, 1] == "占位", "块填充不应修改原表格"
+    assert result_df.iloc[4, 1] == "占位", "超出 rows 的行应保持不变"
+    assert str(result_df.dtypes.iloc[1]) == "string", "可填充区域应为 string dtype"
+    
+    print("   ✓ 块填充引擎测试通过")
+
+def _named_buffer(data: bytes, name: str) -> io.BytesIO:
+    """构造带文件名的内存文件，模拟 Streamlit 的上传对象"""
+    buf = io.BytesIO(data)
+    buf.name = name
+    return buf
+
+def test_streaming_template_ingest():
+    """测试流式模板读取（与整表读取结果一致）"""
+    print("\n6. 测试流式模板读取...")
+    from openpyxl import Workbook
+    
+    csv_data = "项目,负责人,预算\n项目A,张三,100\n项目B,,150.5\n项目C,王五,\n".encode("utf-8")
+    wb = Workbook()
+    for row in [["项目", "负责人", "预算"], ["项目A", "张三", 100], ["项目B", None, 150.5], [None, None, None], ["项目C", 1]]:
+        wb.active.append(row)
+    xlsx_buf = io.BytesIO()
+    wb.save(xlsx_buf)
+    
+    for data, name in [(csv_data, "t.csv"), (xlsx_buf.getvalue(), "t.xlsx")]:
+        full = create_template_from_upload(_named_buffer(data, name))
+        streamed = create_template_from_upload(_named_buffer(data, name), streaming=True)
+        print(f"   {name} 流式读取结果:\n{streamed[0]}")
+        assert streamed[3] is None, f"流式读取失败: {streamed[3]}"
+        assert streamed[1:3] == full[1:3], "流式读取的尺寸应与整表读取一致"
+        pd.testing.assert_frame_equal(streamed[0], full[0])
+    
+    # pandas 内部接口不可用时退回公开接口，这些模板的结果不变
+    import data_handler
+    internals = (data_handler._find_common_type, data_handler._TextParser)
+    data_handler._find_common_type = data_handler._TextParser = None
+    try:
+        for data, name in [(csv_data, "t.csv"), (xlsx_buf.getvalue(), "t.xlsx")]:
+            full = create_template_from_upload(_named_buffer(data, name))
+            streamed = create_template_from_upload(_named_buffer(data, name), streaming=True)
+            assert streamed[3] is None and streamed[1:3] == full[1:3]
+            pd.testing.assert_frame_equal(streamed[0], full[0])
+    finally:
+        data_handler._find_common_type, data_handler._TextParser = internals
+    
+    print("   ✓ 流式模板读取测试通过")
+
+def test_token_frequencies():
+    """测试选项C 的 token 频次统计"""
+    print("\n7. 测试 token 频次统计...")
+    
+    tokens = ["b", "a", "c", "a", "b", "a"]
+    by_count = count_token_frequencies(tokens)
+    print(f"   按次数排序:\n{by_count}")
+    assert by_count["token"].tolist() == ["a", "b", "c"], "应按次数降序排列"
+    assert by_count["count"].tolist() == [3, 2, 1]
+    assert by_count["percentage"].tolist() == ["50.0%", "33.3%", "16.7%"]
+    
+    assert count_token_frequencies(tokens, order="first")["token"].tolist() == ["b", "a", "c"]
+    assert count_token_frequencies(tokens, order="token", min_count=2)["token"].tolist() == ["a", "b"]
+    assert count_token_frequencies(tokens, top_n=1)["token"].tolist() == ["a"]
+    
+    stage_df = generate_intermediate_result("a b", "a", "", "c a", "")
+    adaptive_df = generate_adaptive_table_by_option(stage_df, "选项C")
+    assert list(adaptive_df.columns) == ["token", "count", "percentage"]
+    assert adaptive_df.iloc[0].tolist() == ["a", "3", "60.0%"]
+    empty_df = generate_adaptive_table_by_option(stage_df.iloc[:0], "选项C")
+    assert list(empty_df.columns) == ["token", "count", "percentage"] and len(empty_df) == 0
+    
+    print("   ✓ token 频次统计测试通过")
+
+def test_intermediate_result_columns():
+    """测试阶段性结果的列式构造"""
+    print("\n8. 测试阶段性结果列式构造...")
+    
+    stage_df = generate_intermediate_result("a b", "", "c", "d e f", "g")
+    print(f"   阶段性结果:\n{stage_df}")
+    assert list(stage_df.columns) == ["source", "index", "token"]
+    assert all(str(dtype) == "string" for dtype in stage_df.dtypes), "默认应统一为 string"
+    assert stage_df["source"].tolist() == ["text1", "text1", "text3", "text4", "text4", "text4", "text5"]
+    assert stage_df["index"].tolist() == ["0", "1", "0", "0", "1", "2", "0"]
+    
+    native_df = generate_intermediate_result("a b", "", "c", "d e f", "g", native_dtypes=True)
+    assert str(native_df["source"].dtype) == "category"
+    assert str(native_df["index"].dtype) == "int32"
+    assert native_df["token"].tolist() == stage_df["token"].tolist()
+    
+    empty_df = generate_intermediate_result("", "", "", "", "")
+    assert len(empty_df) == 0 and "token" in empty_df.columns
+    
+    print("   ✓ 阶段性结果列式构造测试通过")
+
+def test_result_cache():
+    """测试内容寻址的结果缓存"""
+    print("\n9. 测试结果缓存...")
+    from result_cache import ResultCache, fingerprint, cached_intermediate_result, pipeline_cache
+    
+    assert fingerprint("a", "bc") != fingerprint("ab", "c"), "指纹应区分各部分边界"
+    
+    cache = ResultCache(max_entries=2, max_bytes=10 ** 9)
+    calls = []
+    def compute(value):
+        calls.append(value)
+        return pd.DataFrame({"v": [value]})
+    for key in ["a", "b", "a", "c", "b"]:
+        cache.get_or_compute(key, lambda: compute(key))
+    stats = cache.stats()
+    print(f"   缓存统计: {stats}")
+    assert calls == ["a", "b", "c", "b"], "命中时不应重新计算，超出条目数应淘汰最久未使用的条目"
+    assert stats["hits"] == 1 and stats["misses"] == 4 and stats["entries"] == 2
+    
+    small = ResultCache(max_entries=10, max_bytes=1)
+    small.get_or_compute("big", lambda: compute("big"))
+    assert small.stats()["entries"] == 0, "超出字节预算的结果不应缓存"
+    
+    hits_before = pipeline_cache.stats()["hits"]
+    key1, df1 = cached_intermediate_result("a b", "c", "", "", "")
+    key2, df2 = cached_intermediate_result("a b", "c", "", "", "")
+    assert key1 == key2 and df1 is df2
+    assert pipeline_cache.stats()["hits"] == hits_before + 1
+    
+    print("   ✓ 结果缓存测试通过")
+
+def test_batch_runner():
+    """测试批量运行器"""
+    print("\n10. 测试批量运行器...")
+    import json
+    import tempfile
+    from pathlib import Path
+    from batch_runner import load_manifest, run_batch
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "tpl.csv").write_text("项目,A,B\n行1,1,2\n行2,3,4\n", encoding="utf-8")
+        jobs = [
+            {"job_id": "blank", "text1": "a b c", "option": "选项C", "final_param": "p", "rows": 3, "cols": 3},
+            {"job_id": "upload", "text1": "x y", "text2": "z", "option": "选项A", "template": "tpl.csv"},
+            {"job_id": "missing", "template": "nope.csv"},
+        ]
+        manifest = tmp / "jobs.jsonl"
+        manifest.write_text("\n".join(json.dumps(j, ensure_ascii=False) for j in jobs), encoding="utf-8")
+        
+        results = run_batch(load_manifest(str(manifest)), str(tmp / "out"), workers=2)
+        print(f"   批量结果: {results}")
+        assert [r["status"] for r in results] == ["ok", "ok", "error"]
+        final_df = pd.read_csv(tmp / "out" / "upload" / "final_result.csv")
+        assert list(final_df.columns) == ["项目", "A", "B"]
+        assert final_df.iloc[1, 1:].tolist() == ["x-final_param", "y-final_param"], "应使用清单中的模板和默认最终参数"
+        assert (tmp / "out" / "summary.jsonl").exists()
+        assert not (tmp / "store").exists(), "未指定模板存储目录时不应写入模板存储"
+        
+        # 指定模板存储目录时模板写入该目录，再次运行直接复用
+        for _ in range(2):
+            results = run_batch(load_manifest(str(manifest)), str(tmp / "out"), store_dir=str(tmp / "store"))
+            assert [r["status"] for r in results] == ["ok", "ok", "error"]
+            assert len(list((tmp / "store").glob("*.arrow"))) == 1
+            pd.testing.assert_frame_equal(pd.read_csv(tmp / "out" / "upload" / "final_result.csv"), final_df)
+        
+        # 任务编号用作输出目录名：含路径分隔符或重复时拒绝整个清单
+        for bad in [[{"job_id": "../x"}], [{"job_id": "a\\b"}], [{"job_id": ".."}], [{"job_id": "a"}, {"job_id": "a"}]]:
+            manifest.write_text("\n".join(json.dumps(j) for j in bad), encoding="utf-8")
+            try:
+                load_manifest(str(manifest))
+                assert False, f"应拒绝任务编号: {bad}"
+            except ValueError:
+                pass
+    
+    print("   ✓ 批量运行器测试通过")
+
+def test_stream_final_result():
+    """测试流式最终结果（与逐阶段生成结果一致）"""
+    print("\n11. 测试流式最终结果...")
+    
+    texts = ("a b c", "d", "", "e f a", "b")
+    for option in Config().dropdown_options:
+        for rows, cols in [(3, 3), (4, 5), (8, 6)]:
+            template = make_blank_template(rows, cols, "待填充")
+            stage_df = generate_intermediate_result(*texts)
+            adaptive_df = generate_adaptive_table_by_option(stage_df, option)
+            expected = process_to_final_result(stage_df, adaptive_df, "p", template, rows, cols)
+            streamed = stream_final_result(*texts, option, "p", template, rows, cols)
+            pd.testing.assert_frame_equal(streamed, expected)
+    print(f"   流式最终结果:\n{streamed}")
+    
+    print("   ✓ 流式最终结果测试通过")
+
+def test_benchmark_runner():
+    """测试基准测试运行器与基线比较"""
+    print("\n12. 测试基准测试运行器...")
+    from benchmark import run_benchmarks, compare
+    
+    grid = {"templates": [(5, 3)], "tokens": [20]}
+    results = run_benchmarks(grid, repeat=1, only="process_to_final_result", verbose=False)
+    assert list(results) == ["process_to_final_result[tokens=20,rows=5,cols=3]"]
+    result = results["process_to_final_result[tokens=20,rows=5,cols=3]"]
+    assert result["min_s"] > 0 and result["peak_bytes"] > 0
+    
+    baseline = {key: {**r, "min_s": r["min_s"] / 10} for key, r in results.items()}
+    assert len(compare(results, baseline, threshold=0.2)) == 1, "耗时超出阈值应判定为回退"
+    assert compare(results, results, threshold=0.2) == []
+    
+    print("   ✓ 基准测试运行器测试通过")
+
+def test_perf_instrumentation():
+    """测试性能埋点"""
+    print("\n13. 测试性能埋点...")
+    import perf
+    
+    records = []
+    perf.bind_collector(records)
+    try:
+        generate_intermediate_result("a b", "c", "", "", "")
+        assert records == [], "未启用时不应产生记录"
+        
+        perf.configure(enabled=True, trace_memory=True)
+        stage_df = generate_intermediate_result("a b", "c", "", "", "")
+        generate_adaptive_table_by_option(stage_df, "选项A")
+    finally:
+        perf.configure(enabled=False, trace_memory=False)
+        perf.bind_collector(None)
+    
+    print(f"   埋点记录:\n{perf.records_frame(records)}")
+    assert [r["stage"] for r in records] == ["generate_intermediate_result", "generate_adaptive_table_by_option"]
+    assert records[0]["rows"] == 3 and records[0]["cols"] == 3
+    assert records[1]["input_rows"] == 3
+    assert records[0]["wall_ms"] >= 0 and records[0]["alloc_bytes"] > 0
+    
+    # 并发调用：只有一个调用统计内存，且另一个调用结束时不会停止正在进行的统计
+    import threading
+    import tracemalloc
+    entered, release = threading.Event(), threading.Event()
+    
+    @perf.instrumented
+    def slow():
+        entered.set()
+        release.wait(5)
+        return pd.DataFrame({"a": [1]})
+    
+    @perf.instrumented
+    def fast():
+        return pd.DataFrame({"a": [1, 2]})
+    
+    records = []
+    perf.configure(enabled=True, trace_memory=True)
+    try:
+        perf.bind_collector(records)
+        worker = threading.Thread(target=lambda: (perf.bind_collector(records), slow()))
+        worker.start()
+        entered.wait(5)
+        fast()
+        assert tracemalloc.is_tracing(), "其他调用结束时不应停止正在进行的内存统计"
+        release.set()
+        worker.join()
+    finally:
+        perf.configure(enabled=False, trace_memory=False)
+        perf.bind_collector(None)
+    by_stage = {r["stage"]: r for r in records}
+    assert by_stage["fast"]["alloc_bytes"] is None and by_stage["slow"]["alloc_bytes"] is not None
+    assert not tracemalloc.is_tracing()
+    
+    print("   ✓ 性能埋点测试通过")
+
+def test_string_dtype_conversion():
+    """测试字符串列只转换一次"""
+    print("\n14. 测试字符串列转换...")
+    
+    df = pd.DataFrame({"首列": [1, 2], "A": [1, None], "B": ["x", "y"]})
+    converted = _coerce_non_header_columns_to_string(df)
+    print(f"   字符串存储: {STRING_DTYPE.storage}")
+    assert list(converted.dtypes.iloc[1:]) == [STRING_DTYPE, STRING_DTYPE]
+    assert df["A"].dtype == "float64", "不应修改原表"
+    assert _coerce_non_header_columns_to_string(converted) is converted, "已转换的表不应再复制"
+    
+    filled = fill_table(converted, "a", "b")
+    assert list(filled.dtypes.iloc[1:]) == [STRING_DTYPE, STRING_DTYPE]
+    assert converted.iloc[1, 1] is pd.NA, "填充不应修改输入表"
+    
+    print("   ✓ 字符串列转换测试通过")
+
+def test_exporter():
+    """测试分块导出与导出缓存"""
+    print("\n15. 测试结果导出...")
+    import gzip
+    from exporter import export_bytes, cached_export, export_cache, iter_csv_chunks
+    
+    df = fill_table(make_blank_template(7, 3, "待填充"), "a", "b")
+    expected_csv = df.to_csv(index=False).encode("utf-8")
+    assert b"".join(iter_csv_chunks(df, chunk_rows=2)) == expected_csv, "分块 CSV 应与整表 CSV 一致"
+    assert export_bytes(df, "csv") == expected_csv
+    assert gzip.decompress(export_bytes(df, "csv.gz")) == expected_csv
+    
+    xlsx_df = pd.read_excel(io.BytesIO(export_bytes(df, "xlsx")), engine="openpyxl")
+    assert xlsx_df.shape == df.shape and xlsx_df.iloc[1, 1] == df.iloc[1, 1]
+    try:
+        parquet_df = pd.read_parquet(io.BytesIO(export_bytes(df, "parquet")))
+        assert parquet_df.shape == df.shape and parquet_df.iloc[1, 1] == df.iloc[1, 1]
+    except ImportError:
+        print("   未安装 pyarrow，跳过 Parquet 导出")
+    
+    misses_before = export_cache.stats()["misses"]
+    first = cached_export("result-v1", df, "csv")
+    second = cached_export("result-v1", df, "csv")
+    assert first is second and export_cache.stats()["misses"] == misses_before + 1, "同一版本只应序列化一次"
+    
+    print("   ✓ 结果导出测试通过")
+
+def test_paginated_preview():
+    """测试分页预览切片与缓存"""
+    print("\n16. 测试分页预览...")
+    from preview import page_count, page_slice, cached_page_table, preview_cache
+    
+    df = generate_intermediate_result(" ".join(f"t{i}" for i in range(25)), "", "", "", "")
+    assert page_count(len(df), 10) == 3 and page_count(0, 10) == 1
+    assert page_slice(df, 3, 10).index.tolist() == list(range(20, 25)), "应保留原行号"
+    assert page_slice(df, 9, 10).index.tolist() == list(range(20, 25)), "页码越界时取最后一页"
+    
+    hits_before = preview_cache.stats()["hits"]
+    first = cached_page_table("stage-v1", df, 2, 10)
+    second = cached_page_table("stage-v1", df, 2, 10)
+    assert first is second and preview_cache.stats()["hits"] == hits_before + 1, "多处展示应复用同一页切片"
+    n_rows = first.num_rows if hasattr(first, "num_rows") else len(first)
+    assert n_rows == 10, "每页应只包含 page_size 行"
+    
+    # 首列为混合类型的上传模板也能预览（object 列转为字符串显示）
+    buf = io.BytesIO()
+    pd.DataFrame({"项目": [1, "行二", 3.5], "A": ["x", "y", "z"]}).to_excel(buf, index=False)
+    template_df = create_template_from_upload(_named_buffer(buf.getvalue(), "t.xlsx"))[0]
+    table = cached_page_table("mixed-template", template_df, 1, 10)
+    if hasattr(table, "num_rows"):
+        assert table.num_rows == 3 and table.column("项目").to_pylist() == ["1", "行二", "3.5"]
+    
+    print("   ✓ 分页预览测试通过")
+
+def test_adaptive_strategy_registry():
+    """测试自适应表格策略注册表"""
+    print("\n17. 测试自适应表格策略注册表...")
+    import adaptive_strategies
+    from adaptive_strategies import register_adaptive_strategy, strategy_names
+    
+    assert strategy_names()[:4] == ["选项A", "选项B", "选项C", "选项D"]
+    assert Config().dropdown_options == strategy_names(), "下拉选项应取自注册表"
+    
+    stage_df = generate_intermediate_result("a b c d e", "", "", "", "")
+    option_b = generate_adaptive_table_by_option(stage_df, "选项B")
+    print(f"   选项B:\n{option_b}")
+    assert option_b["组1"].tolist() == ["a", "", "", "d", ""]
+    assert option_b["组3"].tolist() == ["", "", "c", "", ""]
+    
+    @register_adaptive_strategy("测试策略")
+    def reversed_tokens(tokens, options):
+        return pd.DataFrame({"reversed": tokens[::-1]})
+    try:
+        assert "测试策略" in Config().dropdown_options
+        custom = generate_adaptive_table_by_option(stage_df, "测试策略")
+        assert custom["reversed"].tolist() == ["e", "d", "c", "b", "a"]
+        assert str(custom.dtypes.iloc[0]) == "string"
+    finally:
+        adaptive_strategies._STRATEGIES.pop("测试策略")
+    
+    # 策略模块由注册表按配置导入，核心代码无需 import
+    try:
+        assert adaptive_strategies.load_strategy_plugins(["examples.custom_data_handler"])
+        assert "数字提取" in Config().dropdown_options
+        numbers = generate_adaptive_table_by_option(generate_intermediate_result("a1 b 22", "", "", "", ""), "数字提取")
+        assert numbers["number"].tolist() == ["1", "22"]
+    finally:
+        adaptive_strategies._STRATEGIES.pop("数字提取", None)
+    try:
+        adaptive_strategies.load_strategy_plugins(["no_such_strategy_module"])
+        assert False, "无法导入的策略模块应报错"
+    except ImportError:
+        pass
+    
+    print("   ✓ 自适应表格策略注册表测试通过")
+
+def test_parallel_tokenization():
+    """测试并行分词"""
+    print("\n18. 测试并行分词...")
+    import tokenization
+    from tokenization import chunk_bounds, tokenize_blocks
+    
+    text = "alpha beta\tgamma\n  delta epsilon zeta eta theta"
+    bounds = chunk_bounds(text, 8)
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(text)
+    assert all(text[end].isspace() for _, end in bounds[:-1]), "切分点应落在空白字符上"
+    assert [tok for s, e in bounds for tok in text[s:e].split()] == text.split()
+    
+    texts = [text * 50, "", "x " * 300, "单个", text]
+    expected = [t.split() for t in texts]
+    parallel = tokenize_blocks(texts, workers=2, threshold=0, chunk_size=64)
+    assert parallel == expected, "并行分词结果及顺序应与串行一致"
+    
+    # 低于阈值时串行，不创建进程池
+    pool = tokenization._pool
+    assert tokenize_blocks(["a b", "c"], workers=3, threshold=10_000) == [["a", "b"], ["c"]]
+    assert tokenization._pool is pool and tokenization._pool_workers == 2
+    
+    print("   ✓ 并行分词测试通过")
+
+def test_tokenizers_and_extractors():
+    """测试可插拔分词器与抽取器"""
+    print("\n19. 测试分词器与抽取器...")
+    import data_handler
+    from tokenization import compile_extractors, get_tokenizer, tokenize_blocks
+    
+    assert get_tokenizer("delimiter").findall("New York, 北京；  东京 ,,") == ["New York", "北京", "东京"]
+    assert get_tokenizer("cjk").findall("订单A12，价格25元") == ["订", "单", "A12", "价", "格", "25", "元"]
+    
+    extractors = compile_extractors(("email", "date", "number", "keyword"))
+    assert compile_extractors(("email", "date", "number", "keyword")) is extractors, "同一组合只应编译一次"
+    text = "Alice sent 3 files to bob@example.com on 2024-01-15"
+    assert extractors.extract(text) == {
+        "email": ["bob@example.com"], "date": ["2024-01-15"], "number": ["3"], "keyword": ["Alice"],
+    }
+    # 合并后的正则单次扫描，重叠的匹配只归入先注册的类别；示例中的 extract_data_from_text 各类别独立匹配，保留重叠
+    overlapping = "Mail Bob@Example.com on 2024-01-15"
+    assert extractors.extract(overlapping) == {
+        "email": ["Bob@Example.com"], "date": ["2024-01-15"], "number": [], "keyword": ["Mail"],
+    }
+    import adaptive_strategies
+    try:
+        from examples.custom_data_handler import extract_data_from_text
+    finally:
+        adaptive_strategies._STRATEGIES.pop("数字提取", None)
+    assert extract_data_from_text(overlapping) == {
+        "keywords": ["Mail", "Bob", "Example"], "numbers": ["2024", "01", "15"],
+        "dates": ["2024-01-15"], "emails": ["Bob@Example.com"],
+    }
+    parallel = tokenize_blocks([text * 20, text], workers=2, threshold=0, chunk_size=40, engine=extractors)
+    assert parallel == [extractors.findall(text * 20), extractors.findall(text)]
+    
+    original = (data_handler.cfg.tokenizer, data_handler.cfg.extractors)
+    try:
+        data_handler.cfg.tokenizer = "delimiter"
+        stage_df = generate_intermediate_result("a b, c", "d", "", "", "")
+        assert stage_df["token"].tolist() == ["a b", "c", "d"]
+        
+        data_handler.cfg.extractors = ["number", "date"]
+        stage_df = generate_intermediate_result("on 2024-01-15 buy 3", "", "", "", "x 7")
+        print(f"   抽取结果:\n{stage_df}")
+        assert list(stage_df.columns) == ["source", "index", "token", "kind"]
+        assert stage_df["token"].tolist() == ["2024-01-15", "3", "7"]
+        assert stage_df["kind"].tolist() == ["date", "number", "number"]
+        assert stage_df["source"].tolist() == ["text1", "text1", "text5"]
+        template = make_blank_template(2, 3)
+        texts = ("on 2024-01-15 buy 3", "", "", "", "x 7")
+        expected = process_to_final_result(
+            generate_intermediate_result(*texts),
+            generate_adaptive_table_by_option(generate_intermediate_result(*texts), "选项A"), "p", template, 2, 3
+        )
+        pd.testing.assert_frame_equal(stream_final_result(*texts, "选项A", "p", template, 2, 3), expected)
+    finally:
+        data_handler.cfg.tokenizer, data_handler.cfg.extractors = original
+    
+    print("   ✓ 分词器与抽取器测试通过")
+
+def test_template_store():
+    """测试服务端模板存储"""
+    print("\n20. 测试模板存储...")
+    import os
+    import tempfile
+    from pathlib import Path
+    from openpyxl import Workbook
+    from result_cache import fingerprint
+    from template_store import TemplateStore
+    
+    csv_data = "项目,负责人,预算\n项目A,张三,100\n,,150.5\n项目C,王五,\n".encode("utf-8")
+    wb = Workbook()
+    for row in [["编号", "名称"], [1, "甲"], [2, None], [3, "丙"]]:
+        wb.active.append(row)
+    xlsx_buf = io.BytesIO()
+    wb.save(xlsx_buf)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp)
+        for data, name in [(csv_data, "t.csv"), (xlsx_buf.getvalue(), "t.xlsx")]:
+            key = fingerprint(name, data)
+            expected = create_template_from_upload(_named_buffer(data, name))
+            result = store.load_or_ingest(key, _named_buffer(data, name), streaming=True)
+            assert key in store, "解析结果应写入存储"
+            assert result[1:] == expected[1:]
+            pd.testing.assert_frame_equal(result[0], expected[0])
+            
+            # 其他会话 / 进程直接从存储加载，不再读取上传文件
+            loaded = TemplateStore(tmp).load_or_ingest(key, None)
+            print(f"   {name} 从存储加载:\n{loaded[0]}")
+            pd.testing.assert_frame_equal(loaded[0], expected[0])
+            relabeled = store.load(key, placeholder="空")
+            assert relabeled.iloc[1:, 1:].eq("空").all().all()
+        
+        if STRING_DTYPE.storage == "pyarrow":
+            stored = store.load(fingerprint("t.csv", csv_data))
+            fills = [stored[c].array._pa_array.chunk(1) for c in ["负责人", "预算"]]
+            assert fills[0].buffers()[2].address == fills[1].buffers()[2].address, "占位符部分应共用同一段缓冲区"
+        
+        mixed = pd.DataFrame({"a": [1, "x"], "b": ["h", "待填充"]})
+        assert not store.save("mixed", mixed), "无法无损保存的模板不应落盘"
+        assert store.load("mixed") is None and store.load("missing") is None
+    
+    # 超出上限时按最近使用时间淘汰，刚写入和最近用过的模板保留
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TemplateStore(tmp, max_files=2)
+        template_df = create_template_from_upload(_named_buffer(csv_data, "t.csv"))[0]
+        for i, key in enumerate(["a", "b"]):
+            assert store.save(key, template_df)
+            os.utime(store._path(key), (1_000 + i, 1_000 + i))
+        stale = Path(tmp) / "left.tmp"
+        stale.write_bytes(b"x")
+        os.utime(stale, (1_000, 1_000))
+        store.touch("a")
+        assert store.save("c", template_df)
+        assert "a" in store and "c" in store and "b" not in store, "应淘汰最久未用的模板"
+        assert not stale.exists(), "应清理写入中断遗留的临时文件"
+        assert store.load("b") is None
+    
+    print("   ✓ 模板存储测试通过")
+
+def test_incremental_computation():
+    """测试增量计算"""
+    print("\n21. 测试增量计算...")
+    import data_handler
+    from incremental import (
+        block_cache, incremental_intermediate_result, incremental_adaptive_table, incremental_final_result
+    )
+    
+    texts = ["inc a b a nan c", "inc d e f g h i", "inc x y x", "", "inc a z"]
+    before = block_cache.stats()
+    blocks, stage_df = incremental_intermediate_result(*texts)
+    pd.testing.assert_frame_equal(stage_df, generate_intermediate_result(*texts))
+    assert block_cache.stats()["misses"] - before["misses"] == 5
+    
+    edited = texts[:2] + ["inc x y x w nan"] + texts[3:]
+    before = block_cache.stats()
+    new_blocks, new_stage = incremental_intermediate_result(*edited)
+    pd.testing.assert_frame_equal(new_stage, generate_intermediate_result(*edited))
+    assert block_cache.stats()["misses"] - before["misses"] == 1, "只应重新切分变化的文本块"
+    assert new_blocks.keys[:2] == blocks.keys[:2] and new_blocks.keys[2] != blocks.keys[2]
+    
+    original = data_handler.cfg.stats_order
+    try:
+        for order in ["count", "token", "first"]:
+            data_handler.cfg.stats_order = order
+            for option in ["选项A", "选项C", "选项D"]:
+                _, table = incremental_adaptive_table(new_blocks, new_stage, option)
+                pd.testing.assert_frame_equal(table, generate_adaptive_table_by_option(new_stage, option))
+    finally:
+        data_handler.cfg.stats_order = original
+    
+    # 模板只需前两个文本块即可填满：修改第 3 块后最终结果直接复用
+    template = make_blank_template(3, 4)
+    results = []
+    for b, df in [(blocks, stage_df), (new_blocks, new_stage)]:
+        adaptive_key, adaptive = incremental_adaptive_table(b, df, "选项C")
+        results.append(incremental_final_result(b, adaptive_key, df, adaptive, "p", "t", template, 3, 4))
+        expected = process_to_final_result(df, adaptive, "p", template, 3, 4)
+        pd.testing.assert_frame_equal(results[-1][1], expected)
+    assert results[0][0] == results[1][0] and results[0][1] is results[1][1]
+    print(f"   增量最终结果:\n{results[1][1]}")
+    
+    print("   ✓ 增量计算测试通过")
+
+def test_job_queue():
+    """测试后台任务队列"""
+    print("\n22. 测试后台任务队列...")
+    import threading
+    import time
+    import perf
+    from jobs import CANCELLED, DONE, ERROR, JobQueue
+    
+    queue = JobQueue(max_workers=1, max_finished=2)
+    
+    def wait(job_id, timeout=5):
+        deadline = time.time() + timeout
+        while not queue.get(job_id).done:
+            assert time.time() < deadline, "任务超时"
+            time.sleep(0.01)
+        return queue.get(job_id)
+    
+    def stage_job(ctx, *texts):
+        ctx.report(0.5, "分词")
+        return generate_intermediate_result(*texts)
+    
+    records = []
+    perf.bind_collector(records)
+    perf.configure(enabled=True)
+    try:
+        job = wait(queue.submit("阶段性结果", stage_job, "a b", "c", "", "", ""))
+    finally:
+        perf.configure(enabled=False)
+        perf.bind_collector(None)
+    assert job.status == DONE and job.progress == 1.0
+    assert job.result["token"].tolist() == ["a", "b", "c"]
+    assert [r["stage"] for r in records] == ["generate_intermediate_result"], "任务应在提交时的上下文中执行"
+    
+    started, release = threading.Event(), threading.Event()
+    def blocking(ctx):
+        started.set()
+        while not release.wait(0.01):
+            ctx.check()
+    running = queue.submit("阻塞", blocking)
+    started.wait(5)
+    pending = queue.submit("排队", stage_job, "x", "", "", "", "")
+    assert queue.cancel(pending) and queue.get(pending).status == CANCELLED, "未开始的任务应直接取消"
+    assert queue.cancel(running)
+    assert wait(running).status == CANCELLED, "执行中的任务应在检查点中止"
+    
+    # 取消后任务函数没有再检查就返回：结果丢弃，仍记为已取消
+    started.clear()
+    cancelled = threading.Event()
+    def unchecked(ctx):
+        started.set()
+        cancelled.wait(5)
+        return "R"
+    ignored = queue.submit("不检查取消", unchecked)
+    started.wait(5)
+    assert queue.cancel(ignored)
+    cancelled.set()
+    job = wait(ignored)
+    assert job.status == CANCELLED and job.result is None, "取消后返回的结果不应记为完成"
+    
+    # 增量计算逐块汇报进度，可在文本块之间中止
+    from incremental import incremental_adaptive_table, incremental_intermediate_result
+    from jobs import JobCancelled
+    progress = []
+    blocks, stage_df = incremental_intermediate_result(
+        "q1 q2", "q3", "q4 q5", "", "q6", report=lambda p, m=None: progress.append((p, m)))
+    assert len(progress) >= 5 and all(0 <= p <= 1 for p, _ in progress)
+    assert [p for p, _ in progress] == sorted(p for p, _ in progress), "进度应递增"
+    def cancel_at_block_3(p, m=None):
+        if m and m.endswith("文本块 3"):
+            raise JobCancelled()
+    try:
+        incremental_adaptive_table(blocks, stage_df, "选项C", report=cancel_at_block_3)
+        assert False, "report 抛出 JobCancelled 时应中止"
+    except JobCancelled:
+        pass
+    
+    failed = wait(queue.submit("出错", lambda ctx: 1 / 0))
+    assert failed.status == ERROR and "division" in failed.error
+    assert queue.pop(failed.job_id) is failed and queue.get(failed.job_id) is None
+    assert len(queue.jobs()) <= 3, "已结束的任务应按上限清理"
+    
+    print("   ✓ 后台任务队列测试通过")
+
+def test_sparse_template():
+    """测试稀疏模板"""
+    print("\n23. 测试稀疏模板...")
+    from exporter import export_bytes
+    from preview import page_slice
+    from sparse_template import SparseTable, sparse_blank_template, sparse_final_result
+    
+    stage_df = generate_intermediate_result("a b nan c", "d e", "", "", "f g h")
+    adaptive_df = generate_adaptive_table_by_option(stage_df, "选项C")
+    for rows, cols in [(1, 1), (4, 3), (30, 5)]:
+        dense = make_blank_template(rows, cols)
+        sparse = sparse_blank_template(rows, cols)
+        pd.testing.assert_frame_equal(sparse.to_frame(), dense)
+        for fill_rows, fill_cols in [(rows, cols), (2, 2)]:
+            expected = process_to_final_result(stage_df, adaptive_df, "p", dense, fill_rows, fill_cols)
+            result = sparse_final_result(stage_df, adaptive_df, "p", sparse, fill_rows, fill_cols)
+            assert len(result.values) <= len(stage_df) + adaptive_df.size, "只应保存实际填入的数据"
+            pd.testing.assert_frame_equal(result.to_frame(), expected)
+            pd.testing.assert_frame_equal(page_slice(result, 2, 3), page_slice(expected, 2, 3))
+            for fmt in ["csv", "parquet"]:
+                assert export_bytes(result, fmt) == export_bytes(expected, fmt)
+            # xlsx 文件内含生成时间，比较读回的内容
+            pd.testing.assert_frame_equal(
+                pd.read_excel(io.BytesIO(export_bytes(result, "xlsx"))),
+                pd.read_excel(io.BytesIO(export_bytes(expected, "xlsx"))),
+            )
+    
+    uploaded = create_template_from_upload(_named_buffer("项目,负责人,预算\n项目A,张三,100\n项目B,,\n".encode(), "t.csv"))[0]
+    sparse = SparseTable.from_template(uploaded)
+    pd.testing.assert_frame_equal(sparse.to_frame(), uploaded)
+    result = sparse.fill(["x"], pad="待填充")
+    print(f"   稀疏模板填充结果:\n{result.to_frame()}")
+    pd.testing.assert_frame_equal(result.to_frame(), _block_fill(uploaded, ["x"], pad="待填充"))
+    
+    print("   ✓ 稀疏模板测试通过")
+
+def test_multi_template_fill():
+    """测试多工作表 / 多模板批量填充"""
+    print("\n24. 测试多工作表 / 多模板批量填充...")
+    from multi_template import fill_templates, filled_workbook_bytes, load_templates, sheet_name
+    from sparse_template import to_dense
+    
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        pd.DataFrame({"项目": ["A", "B", "C"], "负责人": ["张三", None, None], "预算": [1, None, None]}).to_excel(
+            writer, sheet_name="预算", index=False)
+        pd.DataFrame({"名称": ["x"] * 6, "值": [None] * 6}).to_excel(writer, sheet_name="明细", index=False)
+        pd.DataFrame().to_excel(writer, sheet_name="空表", index=False)
+    workbook = _named_buffer(buf.getvalue(), "book.xlsx")
+    csv_file = _named_buffer("a,b,c,d\n1,,,\n2,,,\n".encode(), "extra.csv")
+    
+    stage_df = generate_intermediate_result("a b nan c", "d e f", "", "g", "h i j k")
+    adaptive_df = generate_adaptive_table_by_option(stage_df, "选项C")
+    for streaming in [False, True]:
+        for sparse in [False, True]:
+            templates, errors = load_templates([workbook], streaming=streaming, sparse=sparse)
+            assert not errors and list(templates) == ["预算", "明细"], "应读出全部非空工作表"
+            results = fill_templates(stage_df, adaptive_df, "p", templates)
+            for name, (template, rows, cols) in templates.items():
+                expected = process_to_final_result(stage_df, adaptive_df, "p", to_dense(template), rows, cols)
+                pd.testing.assert_frame_equal(to_dense(results[name]), expected)
+    
+    templates, errors = load_templates([workbook, csv_file])
+    assert list(templates) == ["book-预算", "book-明细", "extra-extra"], f"多文件工作表命名错误: {list(templates)}"
+    sheets = pd.read_excel(io.BytesIO(filled_workbook_bytes(stage_df, adaptive_df, "p", templates)), sheet_name=None)
+    assert list(sheets) == list(templates), "输出工作簿应包含全部工作表"
+    print(f"   输出工作表: {list(sheets)}")
+    assert sheet_name("a/b:c" * 10, ["x"]) == ("a_b_c" * 10)[:31]
+    assert sheet_name("Sheet", ["sheet"]) == "Sheet_2"
+    
+    print("   ✓ 多工作表 / 多模板批量填充测试通过")
+
+def test_external_sort():
+    """测试选项D 排序引擎（内存排序 / 外部归并排序、去重、排序规则）"""
+    print("\n25. 测试选项D 排序引擎...")
+    import os
+    import random
+    import tempfile
+    import data_handler
+    from incremental import incremental_adaptive_table, incremental_intermediate_result
+    from token_sort import SPILL_BATCH, external_sort, sort_in_memory
+    
+    rng = random.Random(0)
+    tokens = [rng.choice(["b", "B", "a", "A", "中文", "é", "z1", "Z", ""]) + str(rng.randint(0, 50))
+              for _ in range(SPILL_BATCH + 5000)]
+    spill_dir = tempfile.mkdtemp()
+    for unique in [False, True]:
+        for collation, key in [(None, None), ("casefold", str.casefold), ("C", None)]:
+            reference = list(dict.fromkeys(tokens)) if unique else tokens
+            expected = sorted(reference, key=key)
+            assert list(sort_in_memory(tokens, unique, collation)) == expected
+            result = external_sort(tokens, 50_000, unique, collation, spill_dir)
+            assert list(result) == expected, f"外部排序结果不一致: unique={unique}, collation={collation}"
+    assert not os.listdir(spill_dir), "临时文件应在排序后删除"
+    
+    # 惰性输入边读取边分段；已排好序的各段直接归并
+    from token_sort import merge_sorted, sort_tokens
+    options = Config(sort_memory_limit=50_000, sort_spill_dir=spill_dir)
+    assert list(sort_tokens(iter(tokens), options)) == sorted(tokens)
+    assert list(sort_tokens(iter(tokens[:10]), Config())) == sorted(tokens[:10])
+    for unique in [False, True]:
+        for collation, key in [(None, None), ("casefold", str.casefold)]:
+            runs = [sort_in_memory(tokens[i:i + 7000], unique, collation) for i in range(0, len(tokens), 7000)]
+            reference = list(dict.fromkeys(tokens)) if unique else tokens
+            assert list(merge_sorted(runs, unique, collation)) == sorted(reference, key=key)
+    assert not os.listdir(spill_dir)
+    
+    # locale 排序规则由 ICU 生成排序键，不修改进程的 locale 设置
+    import locale
+    before = locale.setlocale(locale.LC_COLLATE)
+    try:
+        import icu  # noqa: F401
+        assert list(sort_in_memory(["b", "A", "a", "B"], collation="en_US.UTF-8")) == ["a", "A", "b", "B"]
+    except ImportError:
+        try:
+            sort_in_memory(["b", "a"], collation="en_US.UTF-8")
+            assert False, "未安装 PyICU 时 locale 排序规则应报错"
+        except ImportError as e:
+            print(f"   跳过 ICU 排序规则: {e}")
+    assert locale.setlocale(locale.LC_COLLATE) == before
+    
+    texts = (" ".join(tokens[:3000]), "x y x", "", "A a b", " ".join(tokens[3000:6000]))
+    stage_df = generate_intermediate_result(*texts)
+    original = (data_handler.cfg.sort_memory_limit, data_handler.cfg.sort_unique, data_handler.cfg.adaptive_chunk_tokens)
+    try:
+        expected = generate_adaptive_table_by_option(stage_df, "选项D")
+        assert expected["sorted_tokens"].tolist() == sorted(stage_df["token"].tolist())
+        data_handler.cfg.sort_memory_limit = 10_000
+        pd.testing.assert_frame_equal(generate_adaptive_table_by_option(stage_df, "选项D"), expected)
+        data_handler.cfg.sort_unique = True
+        result = generate_adaptive_table_by_option(stage_df, "选项D")
+        assert result["sorted_tokens"].tolist() == sorted(set(stage_df["token"])), "去重结果不正确"
+        blocks, _ = incremental_intermediate_result(*texts)
+        pd.testing.assert_frame_equal(incremental_adaptive_table(blocks, stage_df, "选项D")[1], result)
+        
+        # 阶段性结果按块读取 token 列（可分块计算的策略），结果与整列一次读取一致
+        for unique in [False, True]:
+            data_handler.cfg.sort_unique = unique
+            expected = {option: generate_adaptive_table_by_option(stage_df, option) for option in ["选项C", "选项D"]}
+            data_handler.cfg.adaptive_chunk_tokens = 700
+            for option in ["选项C", "选项D"]:
+                pd.testing.assert_frame_equal(generate_adaptive_table_by_option(stage_df, option), expected[option])
+            data_handler.cfg.adaptive_chunk_tokens = original[2]
+    finally:
+        (data_handler.cfg.sort_memory_limit, data_handler.cfg.sort_unique,
+         data_handler.cfg.adaptive_chunk_tokens) = original
+    
+    print("   ✓ 选项D 排序引擎测试通过")
+
+def test_out_of_core_fill():
+    """测试核外填充（按行块读取模板文件并直接写出结果）"""
+    print("\n26. 测试核外填充...")
+    import gzip
+    import tempfile
+    from pathlib import Path
+    from openpyxl import Workbook
+    from batch_runner import BatchJob, run_job
+    from exporter import export_bytes
+    from out_of_core import fill_template_file, scan_template
+    
+    stage_df = generate_intermediate_result("a b c d e f g h i j k", "l m nan n", "", "o p", "q")
+    adaptive_df = generate_adaptive_table_by_option(stage_df, "选项C")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        pd.DataFrame({"a": [1, 2, None, 4] * 30, "b": ["x", None, "y", "z"] * 30, "c": [None] * 120}).to_csv(
+            tmp / "tpl.csv", index=False)
+        wb = Workbook()
+        ws = wb.active
+        for row in [["名称", "数量", "备注"], [1, "x", None], [None, None, None], ["s", 2, None]]:
+            ws.append(row)
+        for i in range(40):
+            ws.append([i, None, None])
+        ws.append([None, None, "end"])
+        wb.save(tmp / "tpl.xlsx")
+        
+        for name in ["tpl.csv", "tpl.xlsx"]:
+            path = tmp / name
+            with open(path, "rb") as f:
+                template_df, rows, cols, _ = create_template_from_upload(_named_buffer(f.read(), name), streaming=True)
+            assert scan_template(path).rows == rows
+            for fill_rows, fill_cols in [(None, None), (5, 2), (1, 1)]:
+                expected = process_to_final_result(stage_df, adaptive_df, "p", template_df,
+                                                   fill_rows or rows, fill_cols or cols)
+                for fmt in ["csv", "csv.gz", "xlsx", "parquet"]:
+                    if fmt == "parquet" and name.endswith("xlsx"):
+                        continue  # 首列混合类型，无法写出 Parquet
+                    out = tmp / f"out.{fmt}"
+                    fill_template_file(path, stage_df, adaptive_df, "p", out, rows=fill_rows, cols=fill_cols,
+                                       chunk_rows=7)
+                    data, reference = out.read_bytes(), export_bytes(expected, fmt)
+                    if fmt == "csv":
+                        assert data == reference, f"核外填充结果不一致: {name}"
+                    elif fmt == "csv.gz":
+                        assert gzip.decompress(data) == gzip.decompress(reference)
+                    else:
+                        read = pd.read_excel if fmt == "xlsx" else pd.read_parquet
+                        pd.testing.assert_frame_equal(read(out), read(io.BytesIO(reference)))
+        
+        job = BatchJob("big", texts=["a b c", "", "", "", ""], final_param="p", template=str(tmp / "tpl.csv"))
+        result = run_job(job, str(tmp / "out"), out_of_core=True, final_format="parquet")
+        assert result["status"] == "ok" and result["rows"] == 120
+        assert pd.read_parquet(tmp / "out" / "big" / "final_result.parquet").iloc[1, 1] == "a-p"
+    
+    print("   ✓ 核外填充测试通过")
+
+def test_job_queue_admission():
+    """测试任务队列的限流、公平调度与相同请求合并"""
+    print("\n27. 测试任务队列限流与调度...")
+    import threading
+    import time
+    from jobs import CANCELLED, DONE, JobQueue, QueueFull
+    
+    queue = JobQueue(max_workers=1, max_pending=5, max_per_owner=3)
+    release = threading.Event()
+    order, calls = [], []
+    
+    def blocking(ctx):
+        while not release.wait(0.01):
+            ctx.check()
+    
+    def record(ctx, name):
+        order.append(name)
+        return name
+    
+    def wait(job_id, timeout=5):
+        deadline = time.time() + timeout
+        while not queue.get(job_id).done:
+            assert time.time() < deadline, "任务超时"
+            time.sleep(0.01)
+        return queue.get(job_id)
+    
+    blocker = queue.submit("阻塞", blocking, owner="z")
+    while queue.running_count() == 0:
+        time.sleep(0.01)
+    a = [queue.submit("a", record, f"a{i}", owner="a") for i in range(3)]
+    b = queue.submit("b", record, "b0", owner="b")
+    try:
+        queue.submit("a", record, "a3", owner="a")
+        assert False, "超出会话上限应拒绝"
+    except QueueFull:
+        pass
+    assert queue.position(a[0]) == 0 and queue.position(b) == 1, "应按会话轮流排队"
+    
+    # 相同输入的请求共享同一个任务，只计算一次
+    def counted(ctx, value):
+        calls.append(value)
+        return value
+    shared = queue.submit("合并", counted, 1, owner="b", key="k")
+    assert queue.submit("合并", counted, 1, owner="c", key="k") == shared
+    assert queue.submit("合并", counted, 1, owner="d", key="k") == shared
+    assert queue.cancel(shared) and queue.get(shared).status != CANCELLED, "仍有提交者时不应取消"
+    try:
+        queue.submit("c", record, "c0", owner="c")
+        assert False, "超出排队上限应拒绝"
+    except QueueFull:
+        pass
+    
+    release.set()
+    for job_id in a + [b, shared]:
+        assert wait(job_id).status == DONE
+    assert order == ["a0", "b0", "a1", "a2"], f"调度顺序不公平: {order}"
+    assert calls == [1], "相同请求应只计算一次"
+    assert queue.pop(shared).result == 1 and queue.get(shared) is not None, "共享任务应保留到所有提交者取走"
+    assert queue.pop(shared).result == 1 and queue.get(shared) is None
+    
+    # 放弃的任务：已取消但仍在执行时计入会话上限，结束后不再保留；已完成未取走的任务放弃时直接丢弃
+    release.clear()
+    stubborn = queue.submit("阻塞", lambda ctx: release.wait(5), owner="e")
+    while queue.running_count() == 0:
+        time.sleep(0.01)
+    others = [queue.submit("e", record, f"e{i}", owner="e") for i in range(2)]
+    queue.release(stubborn)
+    assert queue.get(stubborn).status != CANCELLED
+    try:
+        queue.submit("e", record, "e2", owner="e")
+        assert False, "已取消但仍在执行的任务应计入会话上限"
+    except QueueFull:
+        pass
+    queue.release(others[1])
+    assert queue.get(others[1]) is None, "未开始的任务放弃后应直接丢弃"
+    release.set()
+    assert wait(others[0]).status == DONE
+    while queue.get(stubborn) is not None:
+        time.sleep(0.01)
+    queue.release(others[0])
+    assert queue.get(others[0]) is None, "已完成未取走的任务放弃后应丢弃结果"
+    
+    shared = queue.submit("合并", counted, 2, owner="e", key="k2")
+    assert queue.submit("合并", counted, 2, owner="f", key="k2") == shared
+    assert wait(shared).status == DONE
+    queue.release(shared)
+    assert queue.pop(shared).result == 2 and queue.get(shared) is None, "放弃与取走各占一个提交者"
+    
+    print("   ✓ 任务队列限流与调度测试通过")
+
+def test_compact_results():
+    """测试会话结果的紧凑存储"""
+    print("\n28. 测试会话结果紧凑存储...")
+    import time
+    from compact import CompactTable, compact_results, compress_idle
+    from exporter import export_bytes
+    from preview import page_slice
+    from sparse_template import sparse_blank_template, to_dense
+    
+    words = [f"词{i % 300}" for i in range(60_000)]
+    stage_df = generate_intermediate_result(" ".join(words), "a b", "", "", "c")
+    adaptive_df = generate_adaptive_table_by_option(stage_df, "选项C")
+    uploaded = create_template_from_upload(_named_buffer("项目,A\n1,\ns,\n,\n".encode(), "t.csv"))[0]
+    mixed = pd.DataFrame({"n": [1.5, None, 3.0], "i": [1, 2, 3]}, index=[10, 11, 12])
+    for df in [stage_df, adaptive_df, uploaded, mixed, stage_df.iloc[:0]]:
+        compact = CompactTable.from_frame(df)
+        pd.testing.assert_frame_equal(to_dense(compact), df)
+        pd.testing.assert_frame_equal(page_slice(compact, 2, 2), page_slice(df, 2, 2))
+        compact.compress()
+        assert compact.compressed or len(df) == 0
+        pd.testing.assert_frame_equal(compact.slice(1, 3), df.iloc[1:3])
+        assert not compact.compressed, "访问后应解压"
+        assert export_bytes(compact, "csv") == export_bytes(df, "csv")
+    
+    compact = CompactTable.from_frame(stage_df)
+    dense_bytes = int(stage_df.memory_usage(deep=True).sum())
+    print(f"   阶段性结果: DataFrame {dense_bytes} 字节 → 紧凑存储 {compact.nbytes} 字节")
+    assert compact.nbytes * 4 < dense_bytes, "重复 token 字典编码后应显著变小"
+    compact_bytes = compact.nbytes
+    compact.last_access -= 3600
+    assert compress_idle(60) >= 1 and compact.compressed
+    assert compact.nbytes * 2 < compact_bytes, "闲置压缩后应更小"
+    pd.testing.assert_frame_equal(to_dense(compact), stage_df)
+    
+    sparse = sparse_blank_template(3, 3)
+    updates = compact_results({"stage_result": stage_df, "final_result": sparse, "stage_key": "k"})
+    assert isinstance(updates["stage_result"], CompactTable)
+    assert updates["final_result"] is sparse and updates["stage_key"] == "k", "非 DataFrame 的值应原样保留"
+    
+    # 紧凑存储的上传模板直接用于填充和生成稀疏模板，与 DataFrame 模板结果一致
+    from result_cache import cached_sparse_template
+    from sparse_template import final_result
+    compact_template = CompactTable.from_frame(uploaded)
+    pd.testing.assert_frame_equal(
+        final_result(stage_df, adaptive_df, "p", compact_template, 4, 2),
+        final_result(stage_df, adaptive_df, "p", uploaded, 4, 2),
+    )
+    _, sparse_template = cached_sparse_template("compact-template", compact_template)
+    pd.testing.assert_frame_equal(
+        to_dense(final_result(stage_df, adaptive_df, "p", sparse_template, 4, 2)),
+        final_result(stage_df, adaptive_df, "p", uploaded, 4, 2),
+    )
+    
+    print("   ✓ 会话结果紧凑存储测试通过")
+
+def test_spreadsheet_engines():
+    """测试 xlsx 读写引擎的选择与各引擎结果一致"""
+    print("\n29. 测试 xlsx 读写引擎...")
+    import spreadsheet_io
+    from exporter import export_bytes, write_frames
+    from sparse_template import sparse_blank_template
+    
+    read_engines = spreadsheet_io.available_read_engines()
+    write_engines = spreadsheet_io.available_write_engines()
+    print(f"   已安装的读取引擎: {read_engines}，写出引擎: {write_engines}")
+    for engine, module in [("calamine", "python-calamine"), ("xlsxwriter", "xlsxwriter")]:
+        if engine not in read_engines + write_engines:
+            print(f"   跳过 {engine} 引擎: 未安装 {module}（pip install -r requirements-optional.txt）")
+    assert "openpyxl" in read_engines and "openpyxl" in write_engines
+    assert spreadsheet_io.read_engine("auto") == read_engines[0]
+    assert spreadsheet_io.write_engine("auto") == write_engines[0]
+    for resolve in [spreadsheet_io.read_engine, spreadsheet_io.write_engine]:
+        try:
+            resolve("xls")
+            assert False, "不支持的引擎应抛出 ValueError"
+        except ValueError:
+            pass
+    
+    # 未安装可选引擎时 auto 回退到 openpyxl，显式指定则报错
+    installed = spreadsheet_io._installed
+    spreadsheet_io._installed = lambda module: module == "openpyxl"
+    try:
+        assert spreadsheet_io.read_engine("auto") == "openpyxl"
+        assert spreadsheet_io.write_engine("auto") == "openpyxl"
+        for resolve, engine in [(spreadsheet_io.read_engine, "calamine"), (spreadsheet_io.write_engine, "xlsxwriter")]:
+            try:
+                resolve(engine)
+                assert False, "未安装的引擎应抛出 ImportError"
+            except ImportError:
+                pass
+    finally:
+        spreadsheet_io._installed = installed
+    
+    df = pd.DataFrame({
+        "项目": ["A", "B", None, "D"],
+        "数量": [1, 2, None, 4],
+        "比例": [0.5, None, 1.25, 2.0],
+        "备注": ["x", "", "y", "http://example.com"],
+    })
+    # 各写出引擎的结果读回后一致（稀疏表格 / 数据块流同样逐块写出）
+    expected = io.BytesIO()
+    spreadsheet_io.write_sheets({"Sheet1": [df]}, expected, engine="openpyxl")
+    expected = pd.read_excel(io.BytesIO(expected.getvalue()), engine="openpyxl")
+    sparse = sparse_blank_template(6, 3)
+    for engine in write_engines:
+        spreadsheet_io.cfg.excel_write_engine = engine
+        try:
+            buf = io.BytesIO()
+            write_frames([df.iloc[:0], df.iloc[:2], df.iloc[2:]], buf, "xlsx")
+            written = io.BytesIO()
+            spreadsheet_io.write_sheets({"Sheet1": [df.iloc[:0], df.iloc[:2], df.iloc[2:]]}, written)
+            sparse_bytes = export_bytes(sparse, "xlsx")
+        finally:
+            spreadsheet_io.cfg.excel_write_engine = "auto"
+        pd.testing.assert_frame_equal(pd.read_excel(io.BytesIO(written.getvalue()), engine="openpyxl"), expected)
+        pd.testing.assert_frame_equal(pd.read_excel(io.BytesIO(buf.getvalue()), engine="openpyxl"), expected)
+        pd.testing.assert_frame_equal(pd.read_excel(io.BytesIO(sparse_bytes), engine="openpyxl"),
+                                      pd.read_excel(io.BytesIO(export_bytes(sparse.to_frame(), "xlsx"))))
+    
+    # 各读取引擎整表读取的模板与流式读取一致
+    data = io.BytesIO()
+    spreadsheet_io.write_sheets({"模板": [df]}, data, engine="openpyxl")
+    data = data.getvalue()
+    streamed = create_template_from_upload(_named_buffer(data, "t.xlsx"), streaming=True)
+    for engine in read_engines:
+        pd.testing.assert_frame_equal(spreadsheet_io.read_excel(io.BytesIO(data), engine=engine), expected)
+        spreadsheet_io.cfg.excel_read_engine = engine
+        try:
+            template_df, rows, cols, error = create_template_from_upload(_named_buffer(data, "t.xlsx"))
+        finally:
+            spreadsheet_io.cfg.excel_read_engine = "auto"
+        assert error is None and (rows, cols) == streamed[1:3]
+        pd.testing.assert_frame_equal(template_df, streamed[0])
+    
+    print("   ✓ xlsx 读写引擎测试通过")
+
 def main():
     """主测试函数"""
     print("=" * 50)
@@ -99,6 +1198,31 @@ def main():
         test_data_handler()
         test_template_loading()
         test_new_fill_logic()
+        test_block_fill_engine()
+        test_streaming_template_ingest()
+        test_token_frequencies()
+        test_intermediate_result_columns()
+        test_result_cache()
+        test_batch_runner()
+        test_stream_final_result()
+        test_benchmark_runner()
+        test_perf_instrumentation()
+        test_string_dtype_conversion()
+        test_exporter()
+        test_paginated_preview()
+        test_adaptive_strategy_registry()
+        test_parallel_tokenization()
+        test_tokenizers_and_extractors()
+        test_template_store()
+        test_incremental_computation()
+        test_job_queue()
+        test_sparse_template()
+        test_multi_template_fill()
+        test_external_sort()
+        test_out_of_core_fill()
+        test_job_queue_admission()
+        test_compact_results()
+        test_spreadsheet_engines()
         
         print("\n" + "=" * 50)
         print("🎉 所有测试通过！应用可以正常运行")
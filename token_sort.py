@@ -0,0 +1,215 @@
+"""
+选项D 的排序引擎
+- 数据量不超过 Config.sort_memory_limit 时在内存中排序：已安装 pyarrow 时使用 Arrow 字符串数组排序
+  （UTF-8 字节序即码点序，结果与 Python 的字符串比较一致），否则使用 NumPy
+- 超过时进行外部归并排序：从输入的 token 流（可以是惰性迭代器）按内存上限分段排序后写入临时文件，
+  再逐批读回多路归并，内存中只保留当前一段、各段当前读取的批次和排序结果
+  （结果为 Arrow 字符串数组时不再为每个 token 保留 Python 对象）
+- merge_sorted 直接归并已各自排好序的多段 token（如各文本块的排序结果），不再拼接后整体重排
+- 可选去重（sort_unique）和排序规则（sort_collation）：None（或 "C" / "POSIX"）为码点顺序，"casefold" 不区分大小写，
+  其他值视为 locale 名称（如 "zh_CN.UTF-8"），由 ICU（PyICU，可选依赖）生成排序键；
+  不修改进程的 locale 设置，多个任务线程可同时使用不同的排序规则
+- 均为稳定排序：排序键相同的 token 保持原有先后顺序；去重时保留首次出现的 token
+"""
+import heapq
+import os
+import pickle
+import tempfile
+from contextlib import ExitStack
+from functools import lru_cache
+from itertools import chain, islice
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# 临时文件中每批 token 数，归并时每段只在内存中保留一批
+SPILL_BATCH = 64 * 1024
+
+# 单个 str 对象的固定开销（sys.getsizeof("")），用于估算 token 列表的内存占用
+_STR_OVERHEAD = 49
+
+# 与码点顺序相同的 locale 名称
+_CODEPOINT_COLLATIONS = {"C", "POSIX", "C.UTF-8", "C.utf8"}
+
+
+def estimate_bytes(tokens: Sequence[str]) -> int:
+    """估算 token 列表转换为 Python str 对象后的内存占用（Arrow 字符串数组按其缓冲区大小估算）"""
+    if isinstance(tokens, pd.arrays.ArrowStringArray):
+        return int(tokens.nbytes) + len(tokens) * (_STR_OVERHEAD + 8)
+    return sum(map(len, tokens)) + len(tokens) * (_STR_OVERHEAD + 8)
+
+
+@lru_cache(maxsize=None)
+def _icu_collator(collation: str):
+    try:
+        import icu
+    except ImportError:
+        raise ImportError(f"排序规则 {collation} 需要安装 PyICU（或改用 None / casefold）") from None
+    # "zh_CN.UTF-8" → ICU locale "zh_CN"；ICU 的 Collator 在不修改设置时可被多个线程同时使用
+    return icu.Collator.createInstance(icu.Locale(collation.split(".")[0]))
+
+
+def collation_key(collation: Optional[str]) -> Optional[Callable[[str], Any]]:
+    """排序规则对应的排序键函数；码点顺序时返回 None，直接比较 token"""
+    if collation is None or collation in _CODEPOINT_COLLATIONS:
+        return None
+    if collation == "casefold":
+        return str.casefold
+    return _icu_collator(collation).getSortKey
+
+
+def sort_keys(tokens: Sequence[str], collation: Optional[str]) -> Optional[List[Any]]:
+    """计算排序键；码点顺序时返回 None，直接比较 token"""
+    key = collation_key(collation)
+    return None if key is None else [key(token) for token in tokens]
+
+
+def _arrow_sort(tokens: np.ndarray, keys: Optional[List[Any]]):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    values = pa.array(tokens, pa.large_string())
+    # Arrow 的 sort_indices 为稳定排序
+    order = pc.sort_indices(values if keys is None else pa.array(keys))
+    return pd.arrays.ArrowStringArray(pa.chunked_array([values.take(order)], pa.large_string()))
+
+
+def _numpy_sort(tokens: np.ndarray, keys: Optional[List[Any]]) -> np.ndarray:
+    if keys is None:
+        return np.sort(tokens, kind="stable")
+    return tokens[np.argsort(np.asarray(keys, dtype=object), kind="stable")]
+
+
+def sort_in_memory(tokens: Sequence[str], unique: bool = False, collation: Optional[str] = None):
+    """内存中排序，返回 Arrow 字符串数组（已安装 pyarrow 时）或 NumPy object 数组"""
+    tokens = np.asarray(tokens, dtype=object)
+    if unique:
+        # 先按首次出现去重再稳定排序，与排序后去重（保留首次出现）结果相同，且排序的数据更少
+        tokens = pd.unique(tokens)
+    keys = sort_keys(tokens, collation)
+    try:
+        return _arrow_sort(tokens, keys)
+    except ImportError:
+        pass
+    except (TypeError, ValueError, UnicodeError):
+        # 无法编码为 UTF-8 的 token（如单独的代理字符）按 Python 字符串排序
+        pass
+    return _numpy_sort(tokens, keys)
+
+
+def _spill_run(run: Sequence[str], unique: bool, collation: Optional[str], spill_dir: Optional[str]) -> str:
+    """对一段 token 排序后写入临时文件（分批 pickle (排序键, token) 列表），返回文件路径"""
+    ordered = list(sort_in_memory(run, unique, collation))
+    keys = sort_keys(ordered, collation) or ordered
+    fd, path = tempfile.mkstemp(prefix="tablegen-sort-", suffix=".run", dir=spill_dir)
+    with os.fdopen(fd, "wb") as f:
+        for start in range(0, len(ordered), SPILL_BATCH):
+            batch = list(zip(keys[start:start + SPILL_BATCH], ordered[start:start + SPILL_BATCH]))
+            pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_run(f) -> Iterator[tuple]:
+    while True:
+        try:
+            yield from pickle.load(f)
+        except EOFError:
+            return
+
+
+def _iter_runs(tokens: Iterable[str], run_bytes: int) -> Iterator[List[str]]:
+    """按估算的内存占用把 token 流切成若干段"""
+    it = iter(tokens)
+    while True:
+        run, size = [], 0
+        for token in it:
+            run.append(token)
+            size += len(token) + _STR_OVERHEAD + 8
+            if size >= run_bytes:
+                break
+        if not run:
+            return
+        yield run
+
+
+def _dedup(items: Iterator[tuple]) -> Iterator[tuple]:
+    """去掉有序序列中重复的 token（同一排序键下可能有多个不同的 token，逐组记录已出现的 token）"""
+    current_key, seen = object(), set()
+    for key, token in items:
+        if key != current_key:
+            current_key, seen = key, set()
+        if token not in seen:
+            seen.add(token)
+            yield key, token
+
+
+def _collect(tokens: Iterator[str]):
+    """把有序 token 流逐批收集为 Arrow 字符串数组（未安装 pyarrow 时为 NumPy object 数组）"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return np.array(list(tokens), dtype=object)
+    chunks = []
+    while True:
+        batch = list(islice(tokens, SPILL_BATCH))
+        if not batch:
+            break
+        chunks.append(pa.array(batch, pa.large_string()))
+    return pd.arrays.ArrowStringArray(pa.chunked_array(chunks, pa.large_string()))
+
+
+def _merge(runs: List[Iterator[tuple]], unique: bool):
+    # heapq.merge 在排序键相同时按段的先后输出，保持稳定
+    merged = heapq.merge(*runs, key=itemgetter(0))
+    if unique:
+        merged = _dedup(merged)
+    return _collect(token for _, token in merged)
+
+
+def external_sort(tokens: Iterable[str], run_bytes: int, unique: bool = False,
+                  collation: Optional[str] = None, spill_dir: Optional[str] = None):
+    """
+    外部归并排序：从 token 流中逐段读取、排序并写入临时文件后多路归并，结果与 sort_in_memory 相同
+    整个输入不超过一段时直接在内存中排序，不写临时文件
+    """
+    runs = _iter_runs(tokens, run_bytes)
+    first = next(runs, [])
+    second = next(runs, None)
+    if second is None:
+        return sort_in_memory(first, unique, collation)
+    paths = []
+    try:
+        for run in chain([first, second], runs):
+            paths.append(_spill_run(run, unique, collation, spill_dir))
+            del run
+        del first, second
+        with ExitStack() as stack:
+            return _merge([_read_run(stack.enter_context(open(path, "rb"))) for path in paths], unique)
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+
+def merge_sorted(runs: Sequence[Iterable[str]], unique: bool = False, collation: Optional[str] = None):
+    """
+    多路归并已按相同规则排好序（及各自去重）的多段 token，结果与把各段拼接后排序相同；
+    逐个读取各段，不拼接、不整体重排
+    """
+    key = collation_key(collation)
+    keyed = [((token if key is None else key(token), token) for token in run) for run in runs]
+    return _merge(keyed, unique)
+
+
+def sort_tokens(tokens: Iterable[str], options: Any):
+    """
+    按 options（Config）中的排序设置排序：估算内存不超过 sort_memory_limit 时在内存中排序，否则外部排序
+    tokens 可以是惰性迭代器（如逐块读取阶段性结果），此时边读取边分段，不预先载入全部 token
+    """
+    limit = options.sort_memory_limit
+    sized = hasattr(tokens, "__len__")
+    if limit is None or (sized and estimate_bytes(tokens) <= limit):
+        return sort_in_memory(tokens if sized else list(tokens), options.sort_unique, options.sort_collation)
+    return external_sort(tokens, max(1, limit // 2), options.sort_unique, options.sort_collation,
+                         options.sort_spill_dir)
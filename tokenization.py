@@ -0,0 +1,226 @@
+"""
+文本分词与信息抽取
+- 分词器（tokenizer）：whitespace / delimiter / cjk 等，按名称注册，正则在注册时预编译一次
+- 抽取器（extractor）：email / date / number / keyword 等，选中的抽取器合并为一个带命名分组的正则，
+  单次扫描即可同时取出各类数据（同一位置按注册顺序优先匹配，如日期中的数字不再计为数字）
+- Config.tokenizer / Config.extractors 选择生成阶段性结果时使用的分词器或抽取器
+- 文本总长度低于阈值时在当前线程串行切分；超过阈值时按文本块分片，超大文本块再按分隔边界切成若干段，
+  交给进程池并行切分，合并时保持各文本块及块内 token 的原有顺序
+"""
+import functools
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from config import Config
+
+cfg = Config()
+
+_WHITESPACE = re.compile(r"\s")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """进程池在首次需要时创建并复用，避免每次调用都启动新进程"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_workers = workers
+        return _pool
+
+
+class Tokenizer:
+    """
+    基于预编译正则的分词器：findall 返回全部 token，iter_tokens 惰性产出
+    boundary 为 token 中不会出现的分隔字符模式，并行分词时只在这些字符处切段（None 表示文本块不可切段）
+    """
+
+    def __init__(self, pattern: str, boundary: Optional[str] = r"\s", flags: int = 0):
+        self.pattern = re.compile(pattern, flags)
+        self.boundary = re.compile(boundary) if boundary else None
+
+    def findall(self, text: str) -> List[str]:
+        if self.pattern.groups:
+            return [match.group() for match in self.pattern.finditer(text)]
+        return self.pattern.findall(text)
+
+    def iter_tokens(self, text: str) -> Iterator[str]:
+        for match in self.pattern.finditer(text):
+            yield match.group()
+
+
+class WhitespaceTokenizer(Tokenizer):
+    """按空白切分（默认），整段切分时直接使用 str.split"""
+
+    def __init__(self):
+        super().__init__(r"\S+")
+
+    def findall(self, text: str) -> List[str]:
+        return text.split()
+
+
+def delimiter_tokenizer(delimiters: str = ",;|，；、") -> Tokenizer:
+    """按分隔符切分，去掉 token 两端空白、丢弃空 token（token 内部可以包含空格）"""
+    d = re.escape(delimiters)
+    return Tokenizer(rf"[^{d}\s](?:[^{d}]*[^{d}\s])?", boundary=f"[{d}]")
+
+
+# 中日韩文字（汉字、假名、谚文）逐字成词；全角标点视为分隔符
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_CJK_PUNCT = "\u3000-\u303f\uff01-\uff0f\uff1a-\uff20\uff3b-\uff40\uff5b-\uff65"
+
+
+def cjk_tokenizer() -> Tokenizer:
+    """中日韩文字逐字切分，其余字符按空白和全角标点切分（如 "价格25元" → 价 / 格 / 25 / 元）"""
+    return Tokenizer(rf"[{_CJK_CHARS}]|[^\s{_CJK_CHARS}{_CJK_PUNCT}]+")
+
+
+_TOKENIZERS: Dict[str, Tokenizer] = {}
+
+
+def register_tokenizer(name: str, tokenizer: Tokenizer) -> Tokenizer:
+    """注册分词器（同名覆盖）；自定义正则分词器可直接注册 Tokenizer(pattern)"""
+    _TOKENIZERS[name] = tokenizer
+    return tokenizer
+
+
+def get_tokenizer(name: str) -> Tokenizer:
+    try:
+        return _TOKENIZERS[name]
+    except KeyError:
+        raise ValueError(f"不支持的分词器: {name}") from None
+
+
+def tokenizer_names() -> List[str]:
+    return list(_TOKENIZERS)
+
+
+register_tokenizer("whitespace", WhitespaceTokenizer())
+register_tokenizer("delimiter", delimiter_tokenizer())
+register_tokenizer("cjk", cjk_tokenizer())
+
+
+# 抽取器名称 → 正则；合并时按注册顺序排列，同一位置先注册的优先匹配
+_EXTRACTORS: Dict[str, str] = {}
+
+
+def register_extractor(name: str, pattern: str) -> None:
+    """注册抽取器（同名覆盖）；pattern 不应匹配空白，否则并行时可能在 token 中间切段"""
+    _EXTRACTORS[name] = pattern
+    compile_extractors.cache_clear()
+
+
+def extractor_names() -> List[str]:
+    return list(_EXTRACTORS)
+
+
+class ExtractorSet:
+    """
+    多个抽取器合并后的单一正则，一次扫描产出 (类别, 值)
+    findall 返回 (类别, 值) 列表，iter_tokens 只产出值，可与 Tokenizer 互换使用
+    """
+
+    def __init__(self, names: Sequence[str]):
+        unknown = [name for name in names if name not in _EXTRACTORS]
+        if unknown:
+            raise ValueError(f"不支持的抽取器: {', '.join(unknown)}")
+        self.names = [name for name in _EXTRACTORS if name in names]
+        self._group_names = {f"e{i}": name for i, name in enumerate(self.names)}
+        self.pattern = re.compile("|".join(
+            f"(?P<e{i}>{_EXTRACTORS[name]})" for i, name in enumerate(self.names)
+        ))
+        self.boundary = _WHITESPACE
+
+    def findall(self, text: str) -> List[Tuple[str, str]]:
+        group_names = self._group_names
+        return [(group_names[m.lastgroup], m.group()) for m in self.pattern.finditer(text)]
+
+    def iter_tokens(self, text: str) -> Iterator[str]:
+        for match in self.pattern.finditer(text):
+            yield match.group()
+
+    def extract(self, text: str) -> Dict[str, List[str]]:
+        """按类别汇总抽取结果，未匹配到的类别为空列表"""
+        result = {name: [] for name in self.names}
+        for kind, value in self.findall(text):
+            result[kind].append(value)
+        return result
+
+
+@functools.lru_cache(maxsize=32)
+def compile_extractors(names: Tuple[str, ...]) -> ExtractorSet:
+    """按抽取器组合缓存合并后的正则，同一组合只编译一次"""
+    return ExtractorSet(names)
+
+
+register_extractor("email", r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
+register_extractor("date", r"\d{4}-\d{2}-\d{2}")
+register_extractor("number", r"\d+")
+register_extractor("keyword", r"\b[A-Z][a-z]+\b")
+
+
+def text_engine(options: Any) -> Any:
+    """按配置返回分词器，或（配置了 extractors 时）合并后的抽取器"""
+    if options.extractors:
+        return compile_extractors(tuple(options.extractors))
+    return get_tokenizer(options.tokenizer)
+
+
+def _split(engine: Any, text: str) -> list:
+    return engine.findall(text)
+
+
+def chunk_bounds(text: str, chunk_size: int, boundary: re.Pattern = _WHITESPACE) -> List[Tuple[int, int]]:
+    """将文本切成约 chunk_size 长的若干段，切分点落在分隔字符（默认空白）上，保证 token 不会跨段"""
+    bounds = []
+    start = 0
+    while len(text) - start > chunk_size:
+        match = boundary.search(text, start + chunk_size)
+        if match is None:
+            break
+        bounds.append((start, match.start()))
+        start = match.start()
+    bounds.append((start, len(text)))
+    return bounds
+
+
+def tokenize_blocks(texts: Sequence[str], workers: Optional[int] = None, threshold: Optional[int] = None,
+                    chunk_size: Optional[int] = None, engine: Any = None) -> List[list]:
+    """
+    切分各文本块，返回与 texts 一一对应的 engine.findall 结果（默认按空白切分）
+    - engine: 分词器或抽取器（见 text_engine）
+    - threshold: 文本总字符数低于该值时串行切分（默认取配置）
+    - workers: 进程数，0 表示使用全部 CPU 核心，1 表示始终串行（默认取配置）
+    - chunk_size: 超大文本块的分段字符数（默认取配置）
+    """
+    texts = [str(t) for t in texts]
+    engine = engine or get_tokenizer("whitespace")
+    threshold = cfg.parallel_tokenize_threshold if threshold is None else threshold
+    workers = cfg.parallel_tokenize_workers if workers is None else workers
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or sum(len(t) for t in texts) < threshold:
+        return [engine.findall(t) for t in texts]
+
+    chunk_size = chunk_size or cfg.parallel_tokenize_chunk_size
+    pieces = []
+    owners = []
+    for b, text in enumerate(texts):
+        bounds = [(0, len(text))] if engine.boundary is None else chunk_bounds(text, chunk_size, engine.boundary)
+        for start, end in bounds:
+            pieces.append(text[start:end])
+            owners.append(b)
+
+    # map 按提交顺序返回结果，依次追加即可保持原有顺序
+    merged: List[list] = [[] for _ in texts]
+    for b, tokens in zip(owners, _get_pool(workers).map(_split, repeat(engine), pieces)):
+        merged[b].extend(tokens)
+    return merged